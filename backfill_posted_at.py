@@ -0,0 +1,26 @@
+"""
+Migrazione una tantum dei documenti salvati prima dell'introduzione delle date in formato datetime.
+
+Aggiunge posted_at (UTC) ai post e alle loro citazioni e last_message_at alle sezioni, calcolandoli
+dalle stringhe di data e ora (vedi utils_scraper.backfill_posted_at). Può essere rieseguita.
+
+Uso:
+    python backfill_posted_at.py <database> [--batch-size N]
+"""
+import argparse
+import logging
+
+from shared.utils_scraper import backfill_posted_at
+from shared.utils_storage import DEFAULT_BULK_SIZE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="Nome del database MongoDB")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BULK_SIZE, help="Documenti aggiornati per blocco")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    counts = backfill_posted_at(args.database, args.batch_size)
+    print(f"Post aggiornati: {counts['post']}, sezioni aggiornate: {counts['sezioni']}")
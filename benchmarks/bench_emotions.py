@@ -0,0 +1,91 @@
+"""
+Benchmark della codifica dei punteggi delle emozioni.
+
+Confronta la forma a dizionari (sentiment_analysis_full + sentiment_analysis_relevant) con la codifica
+compatta di utils_emotions (vettore float32 in BinData), misurando la dimensione BSON dei documenti e
+la velocità con cui get_emotion_scores ricava i punteggi (decodifica BSON + conversione in array NumPy).
+Con --database i documenti vengono anche scritti in una collezione temporanea del database indicato,
+misurando dimensione su disco e tempo di scansione con find(); la collezione viene poi eliminata.
+
+Uso:
+    python -m benchmarks.bench_emotions [--documents N] [--repeat N] [--database NOME]
+"""
+import argparse
+import time
+
+import bson
+import numpy as np
+
+from shared.utils_emotions import (
+    EMOTION_PROJECTION,
+    EMOTION_SCHEMAS,
+    EMOTION_SCHEMA_VERSION,
+    emotion_scores,
+    encode_emotions,
+    relevant_emotions,
+)
+
+
+def make_documents(n, seed=0):
+    """Post sintetici con i punteggi nelle due forme (stesse etichette e valori)."""
+    rng = np.random.default_rng(seed)
+    labels = EMOTION_SCHEMAS[EMOTION_SCHEMA_VERSION]
+    dict_docs, compact_docs = [], []
+    for i in range(n):
+        scores = rng.dirichlet(np.full(len(labels), 0.3)).astype(np.float32)
+        full = {label: float(score) for label, score in zip(labels, scores)}
+        dict_docs.append({"_id": i, "sentiment_analysis_full": full,
+                          "sentiment_analysis_relevant": relevant_emotions(full)})
+        compact_docs.append({"_id": i, **encode_emotions(full)})
+    return dict_docs, compact_docs
+
+
+def time_decode(encoded, repeat):
+    """Tempo medio per decodificare i documenti BSON e ricavarne i punteggi."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        scores = emotion_scores(bson.decode_all(encoded))
+    return (time.perf_counter() - start) / repeat, scores
+
+
+def run(n, repeat, database=None):
+    dict_docs, compact_docs = make_documents(n)
+    print(f"{n} documenti, {repeat} ripetizioni")
+    print(f"{'forma':<10} {'byte/doc':>10} {'doc/s':>12}")
+    results = {}
+    for name, docs in (("dizionari", dict_docs), ("compatta", compact_docs)):
+        encoded = b"".join(bson.encode(doc) for doc in docs)
+        elapsed, scores = time_decode(encoded, repeat)
+        results[name] = scores
+        print(f"{name:<10} {len(encoded) / n:>10.1f} {n / elapsed:>12.0f}")
+    identical = all(np.array_equal(results["dizionari"][label], results["compatta"][label])
+                    for label in results["dizionari"])
+    print(f"Punteggi identici: {identical}")
+
+    if database:
+        from shared.utils_mongo import get_database
+
+        db = get_database(database)
+        print(f"\n{'collezione':<10} {'byte/doc':>10} {'doc/s (find)':>14}")
+        for name, docs in (("dizionari", dict_docs), ("compatta", compact_docs)):
+            collection = db[f"bench_emotions_{name}"]
+            collection.drop()
+            try:
+                collection.insert_many(docs)
+                size = db.command("collstats", collection.name)["size"]
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    emotion_scores(collection.find({}, EMOTION_PROJECTION))
+                elapsed = (time.perf_counter() - start) / repeat
+                print(f"{name:<10} {size / n:>10.1f} {n / elapsed:>14.0f}")
+            finally:
+                collection.drop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20000, help="Numero di documenti sintetici")
+    parser.add_argument("--repeat", type=int, default=3, help="Numero di ripetizioni per forma")
+    parser.add_argument("--database", help="Database MongoDB in cui misurare anche la scansione con find()")
+    args = parser.parse_args()
+    run(args.documents, args.repeat, args.database)
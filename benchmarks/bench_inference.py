@@ -0,0 +1,68 @@
+"""
+Benchmark dell'analisi semantica a blocchi usata da integra_database.
+
+Legge dal database i primi N messaggi dei post e li analizza con i modelli configurati nel file .env,
+prima uno alla volta (analisi_semantica, il percorso originale) e poi con analisi_semantica_batch
+a diverse dimensioni di blocco, misurando post/secondo. Per ogni dimensione verifica che entità
+ed emozioni coincidano con il percorso per messaggio e che i punteggi differiscano al più di
+BATCH_SCORE_TOLERANCE (il padding dei blocchi cambia le ultime cifre dei calcoli in virgola mobile).
+Il database non viene modificato.
+
+Uso:
+    python -m benchmarks.bench_inference <database> [--documents N] [--batch-sizes 8 16 32 64]
+"""
+import argparse
+import time
+
+from shared.utils_mongo import get_database
+from shared.utils_semantics import (
+    BATCH_SCORE_TOLERANCE,
+    analisi_semantica,
+    analisi_semantica_batch,
+    confronta_risultati,
+    load_models,
+    recupera_autori,
+    rimuovi_emoji,
+)
+
+
+def load_messages(database, n):
+    db = get_database(database)
+    messages = []
+    for documento in db["post"].find({"message": {"$nin": [None, ""]}}, {"message": 1}).limit(n):
+        messages.append(rimuovi_emoji(documento["message"]))
+    return messages, recupera_autori(db["autori"])
+
+
+def run(database, n, batch_sizes):
+    messages, autori = load_messages(database, n)
+    if not messages:
+        print(f"Nessun messaggio trovato nel database {database}")
+        return
+    model_1, model_2, model_3, model_4, model_1_id, model_2_id = load_models()
+
+    start = time.perf_counter()
+    expected = [analisi_semantica(text, autori, model_1, model_2, model_3, model_4, model_1_id, model_2_id)
+                for text in messages]
+    elapsed = time.perf_counter() - start
+    print(f"{len(messages)} messaggi")
+    print(f"{'blocco':>8} {'post/s':>10} {'entro tol.':>10} {'diff. max':>10}  (tolleranza {BATCH_SCORE_TOLERANCE:.0e})")
+    print(f"{'1 (orig)':>8} {len(messages) / elapsed:>10.2f} {'-':>10} {'-':>10}")
+
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        actual = analisi_semantica_batch(messages, autori, model_1, model_2, model_3, model_4, model_1_id, model_2_id,
+                                         batch_size)
+        elapsed = time.perf_counter() - start
+        same, max_diff = confronta_risultati(expected, actual)
+        within = same and max_diff <= BATCH_SCORE_TOLERANCE
+        print(f"{batch_size:>8} {len(messages) / elapsed:>10.2f} {str(within):>10} {max_diff:>10.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="Nome del database MongoDB con i post da analizzare")
+    parser.add_argument("--documents", type=int, default=256, help="Numero di messaggi analizzati")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32, 64], help="Dimensioni dei blocchi")
+    args = parser.parse_args()
+    run(args.database, args.documents, args.batch_sizes)
@@ -0,0 +1,87 @@
+"""
+Benchmark dei backend di parsing HTML dello scraper.
+
+Confronta, su un insieme di pagine registrate (una cartella creata con AsyncForumCrawler(record_dir=...)
+oppure un archivio creato con crawl_session(archive_path=...)),
+il parsing completo con 'html.parser' (comportamento originale) con lxml e con il parsing
+ristretto ai soli li.post, misurando post/secondo e picco di memoria, e verifica che
+l'output di extract_post sia identico campo per campo.
+
+Uso:
+    python -m benchmarks.bench_parsing <cartella_pagine_registrate | archivio.warc.gz> [--repeat N]
+"""
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+from shared import utils_scraper
+from shared.utils_archive import CrawlArchive
+
+
+CONFIGURATIONS = [
+    ("html.parser", None),
+    ("html.parser", "posts"),
+    ("lxml", None),
+    ("lxml", "posts"),
+]
+
+
+def load_post_pages(source):
+    if os.path.isfile(source):
+        archive = CrawlArchive(source)
+        try:
+            contents = [content for _, content in archive.records()]
+        finally:
+            archive.close()
+    else:
+        contents = []
+        for path in sorted(glob.glob(os.path.join(source, "*.html"))):
+            with open(path, "rb") as f:
+                contents.append(f.read())
+    return [content for content in contents if b'class="post"' in content]
+
+
+def extract_all(pages, parser, only):
+    utils_scraper.set_html_parser(parser)
+    results = []
+    for content in pages:
+        soup = utils_scraper.parse_html(content, only)
+        results.append([utils_scraper.extract_post(post) for post in soup.find_all('li', class_='post')])
+    return results
+
+
+def run(source, repeat):
+    pages = load_post_pages(source)
+    if not pages:
+        print(f"Nessuna pagina di discussione trovata in {source}")
+        return
+
+    reference = None
+    print(f"{len(pages)} pagine di discussione, {repeat} ripetizioni")
+    print(f"{'parser':<12} {'parse_only':<10} {'post/s':>10} {'picco MB':>10} {'identico':>9}")
+    for parser, only in CONFIGURATIONS:
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results = extract_all(pages, parser, only)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if reference is None:
+            reference = results
+        num_posts = sum(len(page) for page in results) * repeat
+        print(f"{utils_scraper.HTML_PARSER:<12} {str(only):<10} {num_posts / elapsed:>10.1f} "
+              f"{peak / 1024 / 1024:>10.2f} {str(results == reference):>9}")
+
+    utils_scraper.set_html_parser("html.parser")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Cartella con le pagine registrate (*.html) o archivio del crawl")
+    parser.add_argument("--repeat", type=int, default=3, help="Numero di ripetizioni per configurazione")
+    args = parser.parse_args()
+    run(args.source, args.repeat)
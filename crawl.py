@@ -0,0 +1,46 @@
+"""
+Crawl riprendibile del forum con salvataggio su MongoDB.
+
+Lo stato del crawl (URL da visitare, visitati e falliti) è salvato in un file SQLite: se il crawl
+si interrompe, lo si riprende dal punto in cui si era fermato con --resume.
+
+Uso:
+    python crawl.py <database> [--start-date YYYY-MM-DD] [--end-date YYYY-MM-DD] [--frontier FILE]
+    python crawl.py <database> --resume [--frontier FILE]
+    python crawl.py <database> --reset [--frontier FILE]
+"""
+import argparse
+import logging
+import os
+import sys
+
+from shared.utils_frontier import DEFAULT_FRONTIER_PATH, crawl_with_frontier
+from shared.utils_scraper import BASE_URL
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="Nome del database MongoDB")
+    parser.add_argument("--start-date", help="Data iniziale dei post (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="Data finale dei post (YYYY-MM-DD)")
+    parser.add_argument("--url", help=f"URL di partenza del forum (default {BASE_URL})")
+    parser.add_argument("--frontier", default=DEFAULT_FRONTIER_PATH, help="File SQLite con lo stato del crawl")
+    parser.add_argument("--cache", help="File SQLite della cache delle risposte HTTP")
+    parser.add_argument("--rate-limit", type=float, help="Richieste al secondo iniziali (limite adattivo)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--resume", action="store_true", help="Riprende il crawl interrotto")
+    mode.add_argument("--reset", action="store_true", help="Cancella lo stato salvato e riparte dalla radice")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.resume and not os.path.exists(args.frontier):
+        sys.exit(f"Nessun crawl da riprendere in {args.frontier}")
+
+    try:
+        counts = crawl_with_frontier(args.database, args.start_date, args.end_date, args.url, args.frontier,
+                                     resume=args.resume, reset=args.reset, cache_path=args.cache,
+                                     rate_limit=args.rate_limit)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"URL visitati: {counts['done']}, falliti: {counts['failed']}, da visitare: {counts['pending']}")
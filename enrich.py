@@ -0,0 +1,46 @@
+"""
+Analisi semantica (NER ed emozioni) dei post del database con più processi.
+
+Ogni processo carica i modelli una sola volta e analizza intervalli disgiunti di _id dei post
+(vedi utils_enrichment.integra_database_parallel). Con --estimate-memory avvia un solo processo,
+ne misura la memoria dopo il caricamento dei modelli e stima quanti processi può sostenere la macchina.
+
+Uso:
+    python enrich.py <database> [--workers N] [--threads N] [--batch-size N] [--compact-emotions]
+                     [--cache FILE | --cache-db] [--estimate-memory]
+"""
+import argparse
+import logging
+
+from shared.utils_enrichment import DEFAULT_RANGE_SIZE, estimate_worker_memory, integra_database_parallel
+from shared.utils_semantics import DEFAULT_INFERENCE_BATCH_SIZE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="Nome del database MongoDB")
+    parser.add_argument("--workers", type=int, help="Processi di analisi (default: numero di CPU)")
+    parser.add_argument("--threads", type=int, help="Thread di PyTorch per processo (default: CPU / processi)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_INFERENCE_BATCH_SIZE, help="Messaggi per blocco")
+    parser.add_argument("--range-size", type=int, default=DEFAULT_RANGE_SIZE, help="Post per intervallo di _id")
+    parser.add_argument("--compact-emotions", action="store_true", help="Salva le emozioni nella codifica compatta")
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument("--cache", help="File SQLite della cache di inferenza")
+    cache.add_argument("--cache-db", action="store_true", help="Cache di inferenza nella collezione inference_cache")
+    parser.add_argument("--estimate-memory", action="store_true", help="Stima la memoria per processo ed esce")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.estimate_memory:
+        report = estimate_worker_memory(args.database, args.threads or 1)
+        print(f"Modelli: {report['model_bytes'] / 2**20:.0f} MB, memoria per processo: "
+              f"{report['rss_bytes'] / 2**20:.0f} MB, disponibile: {report['available_bytes'] / 2**20:.0f} MB, "
+              f"processi sostenibili: {report['max_workers']}")
+    else:
+        result = integra_database_parallel(
+            args.database, args.workers, args.threads, args.compact_emotions, args.batch_size, args.range_size,
+            cache_path=args.cache, cache_database=args.database if args.cache_db else None,
+        )
+        print(f"Post analizzati: {result['posts']} ({result['posts_per_second']:.1f} post/s), "
+              f"errori: {len(result['failed'])}, intervalli falliti: {len(result['failed_ranges'])}")
@@ -0,0 +1,33 @@
+"""
+Esportazione dei post in file Parquet per le analisi.
+
+Scrive in <path>/posts e <path>/ner le tabelle colonnari dei post (metadati e punteggi delle emozioni)
+e delle entità riconosciute, partizionate per mese (vedi utils_columnar.export_posts). Le esecuzioni
+successive esportano solo i post nuovi o aggiornati (anche quelli spostati di mese, es. da
+backfill_posted_at.py); --full riesporta tutto da zero (necessario dopo cancellazioni di post o
+migrate_post_ids.py, o per esportare un altro database nella stessa cartella).
+
+Uso:
+    python export_analytics.py <database> [--path CARTELLA] [--full]
+"""
+import argparse
+import logging
+import sys
+
+from shared.utils_columnar import DEFAULT_COLUMNAR_PATH, export_posts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="Nome del database MongoDB")
+    parser.add_argument("--path", default=DEFAULT_COLUMNAR_PATH, help="Cartella dell'esportazione")
+    parser.add_argument("--full", action="store_true", help="Riesporta tutti i post invece dei soli aggiornati")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    try:
+        counts = export_posts(args.database, args.path, args.full)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"Post esportati: {counts['posts']}, partizioni riscritte: {counts['partitions']}")
@@ -0,0 +1,35 @@
+"""
+Creazione degli indici MongoDB e verifica dei piani delle query.
+
+Crea (se mancano) gli indici dichiarati in shared/utils_schema.py; con --audit esegue explain() su ogni
+forma di query usata da utils_analysis, utils_scraper e utils_semantics e segnala quelle che ricorrono
+a una scansione completa della collezione (COLLSCAN). Esce con codice 1 se ne trova.
+
+Uso:
+    python indexes.py <database> [--audit]
+"""
+import argparse
+import logging
+import sys
+
+from shared.utils_schema import audit_queries, ensure_indexes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="Nome del database MongoDB")
+    parser.add_argument("--audit", action="store_true", help="Verifica con explain() i piani delle query")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    for name in ensure_indexes(args.database):
+        print(f"Indice: {name}")
+
+    if args.audit:
+        report = audit_queries(args.database)
+        for entry in report:
+            status = "COLLSCAN" if entry["flagged"] else "ok"
+            print(f"{status:8} {entry['name']} ({entry['collection']}): {' > '.join(entry['stages'])}")
+        if any(entry["flagged"] for entry in report):
+            sys.exit(1)
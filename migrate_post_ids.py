@@ -0,0 +1,26 @@
+"""
+Migrazione una tantum della collezione "post" agli _id derivati dal contenuto (vedi utils_scraper.post_id).
+
+I post salvati con un _id generato da MongoDB vengono riscritti con il nuovo _id e i duplicati eliminati.
+La migrazione può essere interrotta e rieseguita.
+
+Uso:
+    python migrate_post_ids.py <database> [--batch-size N]
+"""
+import argparse
+import logging
+
+from shared.utils_scraper import migrate_post_ids
+from shared.utils_storage import DEFAULT_BULK_SIZE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="Nome del database MongoDB")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BULK_SIZE, help="Post riscritti per blocco")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    counts = migrate_post_ids(args.database, args.batch_size)
+    print(f"Post riscritti: {counts['migrated']}, duplicati eliminati: {counts['duplicates']}")
@@ -1,4 +1,3 @@
-from pymongo import MongoClient
 import pandas as pd
 import numpy as np
 import os
@@ -9,6 +8,13 @@ from collections import Counter
 import base64
 import io 
 
+from shared.utils_columnar import DEFAULT_COLUMNAR_PATH, read_emotion_scores, read_top_entities
+from shared.utils_dates import date_range_filter
+from shared.utils_emotions import EMOTION_PROJECTION, emotion_scores
+from shared.utils_mongo import get_database
+from shared.utils_schema import ensure_indexes
+
+
 def calculate_statistics(emotions_scores):
     stats = []
     for emotion, scores in emotions_scores.items():
@@ -120,23 +126,31 @@ def plot_emotion_means(emotion_dict, plot_type='bar', save_path='plots/'):
 
 
 
-def get_top_entities(entity, n, db_name):
+def get_top_entities(entity, n, db_name, start_date=None, end_date=None, backend="mongo",
+                     columnar_path=DEFAULT_COLUMNAR_PATH):
     """
     Estrae le 'n' parole più frequenti associate a una determinata entità in un database MongoDB.
 
     :param entity: Il tipo di entità da analizzare (es. "PER", "LOC").
     :param n: Numero di parole più frequenti da restituire.
     :param db_name: Nome del database MongoDB (default: "analisi_centri").
+    :param start_date, end_date: Intervallo di date dei post (YYYY-MM-DD o datetime, estremi inclusi; None = aperto).
+    :param backend: "mongo" per interrogare il database, "parquet" per leggere l'esportazione in columnar_path
+        (vedi utils_columnar.export_posts).
     :return: Lista delle 'n' parole più frequenti associate all'entità.
     """
+    if backend == "parquet":
+        return read_top_entities(entity, n, columnar_path, start_date, end_date)
+
     # Connetti al database MongoDB
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client[db_name]
+    db = get_database(db_name)
+    ensure_indexes(db_name)
     collection = db["post"]
 
-    # Query per filtrare i documenti contenenti l'entità
-    query = {"ner.entity": entity}
-    documents = collection.find(query)
+    # Query per filtrare i documenti contenenti l'entità nell'intervallo di date (indice ner_entity_word_posted_at);
+    # serve solo il campo ner
+    query = {"ner.entity": entity, **date_range_filter(start_date, end_date)}
+    documents = collection.find(query, {"ner": 1})
 
     # Contatore per le entità
     entity_counter = Counter()
@@ -215,11 +229,13 @@ def generate_entity_section(index, entity, emotion_scores):
     </div>
     """
 
-def generate_combined_emotion_analysis_report(title, db_name, entity, top_entities):
+def generate_combined_emotion_analysis_report(title, db_name, entity, top_entities, start_date=None, end_date=None,
+                                              backend="mongo", columnar_path=DEFAULT_COLUMNAR_PATH):
     # Inizializza un dizionario per raccogliere tutte le informazioni delle emozioni per ciascuna entità
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client[db_name]
-    collection = db["post"]
+    if backend != "parquet":
+        db = get_database(db_name)
+        ensure_indexes(db_name)
+        collection = db["post"]
 
     all_emotion_scores = {}
 
@@ -232,26 +248,18 @@ def generate_combined_emotion_analysis_report(title, db_name, entity, top_entiti
                     "entity": entity,  # Filtro per entità
                     "word": top_entities[i]  # Filtro per parola
                 }
-            }
+            },
+            **date_range_filter(start_date, end_date)  # Intervallo di date, applicato da MongoDB
         }
 
-        # Recupera i documenti filtrati
-        documents = collection.find(query)
-
-        # Inizializza un dizionario con liste vuote per ogni emozione per questa entità
-        emotion_scores = {}
-
-        # Itera sui documenti filtrati
-        for doc in documents:
-            sentiment_analysis = doc.get("sentiment_analysis_full", {})
-
-            for emotion, score in sentiment_analysis.items():
-                if emotion not in emotion_scores:
-                    emotion_scores[emotion] = []  # Crea la lista se non esiste
-                emotion_scores[emotion].append(score)  # Aggiunge lo score
-        
-        # Salva i punteggi emozionali per questa entità
-        all_emotion_scores[top_entities[i]] = emotion_scores
+        # Salva i punteggi emozionali per questa entità (emozione -> array NumPy)
+        if backend == "parquet":
+            all_emotion_scores[top_entities[i]] = read_emotion_scores(
+                {"ner": query["ner"]}, columnar_path, start_date, end_date)
+        else:
+            # Recupera i documenti filtrati (solo i punteggi delle emozioni, in entrambe le codifiche)
+            documents = collection.find(query, EMOTION_PROJECTION)
+            all_emotion_scores[top_entities[i]] = emotion_scores(documents)
     
     # Crea un unico report HTML con il nuovo design
     report_html = f"""
@@ -372,26 +380,24 @@ def generate_combined_emotion_analysis_report(title, db_name, entity, top_entiti
 
     print(f"HTML report has been generated and saved as '{title}_emotion_analysis_report.html'.")
 
-from pymongo import MongoClient
-
-def get_emotion_scores(query):
-    client = MongoClient("mongodb://localhost:27017/")  # Assicurati che l'URL sia corretto
-    db = client["analisi_centri"]  # Nome del database
-    collection = db["post"]  # Nome della collezione
 
-    # Recupera i documenti filtrati
-    documents = collection.find(query)
+def get_emotion_scores(query, db_name=None, start_date=None, end_date=None, backend="mongo",
+                       columnar_path=DEFAULT_COLUMNAR_PATH):
+    if backend == "parquet":
+        # Sui file Parquet sono supportate le condizioni su ner (vedi utils_columnar.read_emotion_scores)
+        return read_emotion_scores(query, columnar_path, start_date, end_date)
 
-    # Inizializza un dizionario con liste vuote per ogni emozione
-    emotion_scores = {}
+    db = get_database(db_name)  # Default: MONGODB_DATABASE ("analisi_centri")
+    ensure_indexes(db_name)
+    collection = db["post"]  # Nome della collezione
 
-    # Itera sui documenti filtrati
-    for doc in documents:
-        sentiment_analysis = doc.get("sentiment_analysis_full", {})
+    # Intervallo di date (YYYY-MM-DD o datetime, estremi inclusi) applicato da MongoDB insieme alla query
+    date_range = date_range_filter(start_date, end_date)
+    if date_range:
+        query = {"$and": [query, date_range]}
 
-        for emotion, score in sentiment_analysis.items():
-            if emotion not in emotion_scores:
-                emotion_scores[emotion] = []  # Crea la lista se non esiste
-            emotion_scores[emotion].append(score)  # Aggiunge lo score
+    # Recupera i documenti filtrati (solo i punteggi delle emozioni, in entrambe le codifiche)
+    documents = collection.find(query, EMOTION_PROJECTION)
 
-    return emotion_scores
\ No newline at end of file
+    # Dizionario emozione -> array NumPy dei punteggi
+    return emotion_scores(documents)
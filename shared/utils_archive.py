@@ -0,0 +1,170 @@
+import datetime
+import logging
+import os
+import threading
+import zlib
+
+from shared.utils_http import content_hash, normalize_url
+
+
+LOGGER = logging.getLogger("archive")
+
+# Ogni record è un membro gzip indipendente: l'archivio è un file .warc.gz leggibile in sequenza
+# e, grazie all'indice degli offset, anche ad accesso casuale.
+_GZIP_WBITS = 31
+
+
+def _compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(data):
+    return zlib.decompressobj(_GZIP_WBITS).decompress(data)
+
+
+def _parse_record(record):
+    """Separa header e corpo di un record (formato WARC/1.1 semplificato)."""
+    header, _, rest = record.partition(b"\r\n\r\n")
+    fields = {}
+    for line in header.decode("utf-8").split("\r\n")[1:]:
+        name, _, value = line.partition(": ")
+        fields[name] = value
+    length = int(fields["Content-Length"])
+    return fields, rest[:length]
+
+
+class CrawlArchive:
+    """
+    Archivio delle pagine scaricate durante un crawl, per poterlo rieseguire senza rete.
+
+    Le risposte vengono aggiunte in coda a un file in formato simile a WARC (un record 'response'
+    per pagina, ciascuno compresso come membro gzip separato); accanto all'archivio un indice
+    testuale (<path>.cdx) associa a ogni URL normalizzato offset e lunghezza del suo ultimo record,
+    così che una pagina possa essere riletta con un solo seek. Se l'indice manca (o è indietro
+    rispetto all'archivio, ad esempio dopo un'interruzione) viene ricostruito scorrendo l'archivio.
+
+    Args:
+        path (str): Percorso del file di archivio (es. "crawl.warc.gz").
+        mode (str): 'a' per registrare (aggiungendo a un archivio esistente), 'r' per la sola lettura.
+    """
+
+    def __init__(self, path, mode="r"):
+        if mode not in ("r", "a"):
+            raise ValueError(f"Modalità non supportata: {mode}")
+        if mode == "r" and not os.path.exists(path):
+            raise FileNotFoundError(path)
+        directory = os.path.dirname(path)
+        if mode == "a" and directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.index_path = path + ".cdx"
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._file = open(path, "ab+" if mode == "a" else "rb")
+        self._index = {}
+        self._load_index()
+        self._index_file = open(self.index_path, "a", encoding="utf-8") if mode == "a" else None
+
+    def _load_index(self):
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        indexed_until = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").rsplit(" ", 2)
+                    if len(parts) != 3:
+                        continue  # Riga troncata da un'interruzione
+                    url, offset, length = parts[0], int(parts[1]), int(parts[2])
+                    if offset + length <= size:
+                        self._index[url] = (offset, length)
+                        indexed_until = max(indexed_until, offset + length)
+        if indexed_until < size:
+            self._scan(indexed_until, size)
+
+    def _scan(self, offset, size):
+        """Ricostruisce l'indice dei record a partire da offset, scartando un eventuale record finale incompleto."""
+        LOGGER.info(f"Ricostruzione dell'indice di {self.path} da offset {offset}")
+        self._file.seek(offset)
+        data = self._file.read(size - offset)
+        position = 0
+        while position < len(data):
+            decompressor = zlib.decompressobj(_GZIP_WBITS)
+            try:
+                record = decompressor.decompress(data[position:])
+            except zlib.error:
+                break
+            if not decompressor.eof:
+                break
+            length = len(data) - position - len(decompressor.unused_data)
+            fields, _ = _parse_record(record)
+            self._index[normalize_url(fields["WARC-Target-URI"])] = (offset + position, length)
+            position += length
+        if position + offset < size:
+            LOGGER.warning(f"{self.path}: {size - offset - position} byte finali incompleti ignorati")
+        if self.mode == "a":
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                for url, (record_offset, length) in self._index.items():
+                    f.write(f"{url} {record_offset} {length}\n")
+            if position + offset < size:
+                self._file.truncate(offset + position)
+
+    def __contains__(self, url):
+        return normalize_url(url) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def urls(self):
+        """URL (normalizzati) presenti nell'archivio."""
+        return list(self._index)
+
+    def append(self, url, body, status=200):
+        """Aggiunge la risposta per l'URL in coda all'archivio e all'indice."""
+        if self.mode != "a":
+            raise ValueError("Archivio aperto in sola lettura")
+        header = (
+            "WARC/1.1\r\n"
+            "WARC-Type: response\r\n"
+            f"WARC-Target-URI: {url}\r\n"
+            f"WARC-Date: {datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+            f"WARC-Payload-Digest: sha256:{content_hash(body)}\r\n"
+            f"HTTP-Status: {status}\r\n"
+            "Content-Type: text/html\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n"
+        ).encode("utf-8")
+        record = _compress(header + body + b"\r\n\r\n")
+        key = normalize_url(url)
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(record)
+            self._file.flush()
+            # L'indice viene scritto dopo il record: un'interruzione lascia al più un record non indicizzato
+            self._index_file.write(f"{key} {offset} {len(record)}\n")
+            self._index_file.flush()
+            self._index[key] = (offset, len(record))
+
+    def get(self, url):
+        """Restituisce il corpo dell'ultima risposta registrata per l'URL, o None se assente."""
+        entry = self._index.get(normalize_url(url))
+        if entry is None:
+            return None
+        offset, length = entry
+        with self._lock:
+            self._file.seek(offset)
+            record = self._file.read(length)
+        return _parse_record(_decompress(record))[1]
+
+    def records(self):
+        """Scorre (url, corpo) di tutte le pagine dell'archivio, nell'ordine in cui sono state registrate."""
+        for url in sorted(self._index, key=lambda url: self._index[url][0]):
+            yield url, self.get(url)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            if self._index_file is not None:
+                self._index_file.close()
@@ -0,0 +1,119 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from shared.utils_http import content_hash, normalize_url
+
+
+LOGGER = logging.getLogger("cache")
+
+# Budget di default della cache su disco: 512 MB di corpi compressi
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "last_modified", "content_hash", "fetched_at"])
+
+
+class ResponseCache:
+    """
+    Cache persistente delle risposte HTTP, salvata in un file SQLite.
+
+    Per ogni URL (normalizzato con normalize_url) conserva il corpo compresso con zlib, gli header
+    ETag/Last-Modified e l'hash del contenuto, così da poter rivalidare la pagina con una GET
+    condizionale. Quando la dimensione totale supera max_bytes vengono eliminate le voci usate
+    meno di recente (LRU).
+
+    Args:
+        path (str): Percorso del file SQLite della cache.
+        max_bytes (int): Budget massimo, in byte, dei corpi compressi.
+        max_age (float): Età massima, in secondi, entro cui una voce viene restituita senza
+            rivalidarla con il server (0 = rivalida sempre).
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_CACHE_MAX_BYTES, max_age=0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, url):
+        """Restituisce la voce in cache per l'URL (CachedResponse), o None se assente."""
+        key = normalize_url(url)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, content_hash, fetched_at FROM responses WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), key))
+            self._conn.commit()
+        body, etag, last_modified, digest, fetched_at = row
+        return CachedResponse(zlib.decompress(body), etag, last_modified, digest, fetched_at)
+
+    def is_fresh(self, entry):
+        """True se la voce è abbastanza recente da poter essere usata senza rivalidarla."""
+        return self.max_age > 0 and time.time() - entry.fetched_at < self.max_age
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """Salva (o sostituisce) la risposta per l'URL e applica il budget di spazio."""
+        key = normalize_url(url)
+        compressed = zlib.compress(body)
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM responses WHERE url = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, compressed, etag, last_modified, content_hash(body), len(compressed), now, now),
+            )
+            self.total_bytes += len(compressed) - (previous[0] if previous else 0)
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, url):
+        """Segna la voce come appena rivalidata (risposta 304)."""
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "UPDATE responses SET fetched_at = ?, last_access = ? WHERE url = ?", (now, now, normalize_url(url))
+            )
+            self._conn.commit()
+
+    def _evict(self):
+        """Elimina le voci usate meno di recente finché la cache non rientra nel budget."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        cursor = self._conn.execute("SELECT url, size FROM responses ORDER BY last_access")
+        to_delete = []
+        for url, size in cursor:
+            if self.total_bytes <= self.max_bytes:
+                break
+            to_delete.append((url,))
+            self.total_bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE url = ?", to_delete)
+        LOGGER.info(f"Cache: eliminate {len(to_delete)} voci per rientrare nel budget di {self.max_bytes} byte")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
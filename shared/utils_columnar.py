@@ -0,0 +1,305 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+from collections import Counter
+
+import numpy as np
+
+from shared.utils_dates import date_range_filter
+from shared.utils_emotions import EMOTION_SCHEMAS, EMOTION_SCHEMA_VERSION, SCHEMA_FIELD, VECTOR_FIELD, document_emotions
+from shared.utils_mongo import get_database
+from shared.utils_schema import ensure_indexes
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # Dipendenza opzionale: serve solo all'esportazione e al backend "parquet"
+    pa = None
+
+
+LOGGER = logging.getLogger("columnar")
+
+# Cartella di default dell'esportazione: <path>/posts e <path>/ner, partizionate per mese (month=YYYY-MM)
+DEFAULT_COLUMNAR_PATH = "analytics"
+STATE_FILE = "_export_state.json"
+UNKNOWN_MONTH = "unknown"
+
+EMOTION_LABELS = EMOTION_SCHEMAS[EMOTION_SCHEMA_VERSION]
+# Prefisso delle colonne dei punteggi delle emozioni nella tabella dei post
+EMOTION_PREFIX = "emotion_"
+
+# Campi dei post letti da MongoDB per l'esportazione
+_PROJECTION = {
+    "section_title": 1, "discussion_title": 1, "discussion_link": 1, "author": 1, "date": 1, "time": 1,
+    "posted_at": 1, "message": 1, "ner": 1, "sentiment_analysis_full": 1, VECTOR_FIELD: 1, SCHEMA_FIELD: 1,
+}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow non è installato: necessario per l'esportazione e il backend 'parquet'")
+
+
+def _schemas():
+    timestamp = pa.timestamp("ms", tz="UTC")
+    posts = pa.schema(
+        [("_id", pa.string()), ("section_title", pa.string()), ("discussion_title", pa.string()),
+         ("discussion_link", pa.string()), ("author", pa.string()), ("date", pa.string()), ("time", pa.string()),
+         ("posted_at", timestamp), ("message", pa.string())]
+        + [(EMOTION_PREFIX + label, pa.float32()) for label in EMOTION_LABELS]
+    )
+    ner = pa.schema([("_id", pa.string()), ("posted_at", timestamp), ("entity", pa.string()),
+                     ("word", pa.string()), ("score", pa.float64())])
+    return posts, ner
+
+
+def _utc(value):
+    # pymongo restituisce datetime UTC senza fuso orario
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def _month(posted_at):
+    return posted_at.strftime("%Y-%m") if posted_at is not None else UNKNOWN_MONTH
+
+
+def _rows(documento):
+    """Riga della tabella dei post e righe della tabella NER di un documento."""
+    post_id = str(documento["_id"])
+    posted_at = _utc(documento.get("posted_at"))
+    row = {
+        "_id": post_id,
+        **{field: documento.get(field) for field in
+           ("section_title", "discussion_title", "discussion_link", "author", "date", "time", "message")},
+        "posted_at": posted_at,
+    }
+    try:
+        vector = document_emotions(documento)
+    except ValueError as e:
+        LOGGER.warning(f"Emozioni del post {post_id} non esportate: {e}")
+        vector = None
+    for i, label in enumerate(EMOTION_LABELS):
+        score = None if vector is None or np.isnan(vector[i]) else float(vector[i])
+        row[EMOTION_PREFIX + label] = score
+    ner_rows = [
+        {"_id": post_id, "posted_at": posted_at, "entity": item.get("entity"), "word": item.get("word"),
+         "score": item.get("score")}
+        for item in documento.get("ner") or []
+    ]
+    return row, ner_rows
+
+
+def _write_partition(directory, month, table, replaced_ids):
+    """Riscrive la partizione del mese: righe esistenti non sostituite più le nuove (se vuota viene rimossa)."""
+    partition = os.path.join(directory, f"month={month}")
+    path = os.path.join(partition, "part-0.parquet")
+    if os.path.exists(path):
+        existing = pq.read_table(path, schema=table.schema)
+        keep = pc.invert(pc.is_in(existing["_id"], value_set=pa.array(sorted(replaced_ids), pa.string())))
+        table = pa.concat_tables([existing.filter(keep), table])
+    if not table.num_rows:
+        shutil.rmtree(partition, ignore_errors=True)
+        return
+    os.makedirs(partition, exist_ok=True)
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)  # La partizione viene sostituita solo quando è stata scritta per intero
+
+
+def _exported_months(directory, ids):
+    """Mese della partizione in cui è già esportato ciascuno degli _id indicati (se presente)."""
+    if not ids or not os.path.isdir(directory):
+        return {}
+    partitioning = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+    dataset = ds.dataset(directory, format="parquet", partitioning=partitioning)
+    table = dataset.to_table(columns=["_id", "month"], filter=ds.field("_id").isin(sorted(ids)))
+    return dict(zip(table["_id"].to_pylist(), table["month"].to_pylist()))
+
+
+def _load_state(path):
+    state_path = os.path.join(path, STATE_FILE)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(path, state):
+    state_path = os.path.join(path, STATE_FILE)
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+
+
+def export_posts(database_name=None, path=DEFAULT_COLUMNAR_PATH, full=False, batch_size=5000):
+    """
+    Esporta la collezione "post" in file Parquet per le analisi: <path>/posts con una riga per post
+    (metadati, posted_at e una colonna float32 per emozione) e <path>/ner con una riga per entità
+    riconosciuta, entrambe partizionate per mese di pubblicazione.
+
+    L'esportazione è incrementale: vengono letti solo i post con updated_at successivo all'esportazione
+    precedente (nuovi, arricchiti da integra_database o con posted_at aggiunto da backfill_posted_at) e
+    riscritte solo le partizioni dei mesi a cui appartengono, più quelle da cui un post si è spostato
+    perché è cambiato il suo mese (es. da month=unknown). Con full=True (necessario dopo cancellazioni o
+    migrazioni degli _id, che non vengono rilevate) l'esportazione viene rifatta da zero.
+
+    Returns:
+        dict: Post esportati e partizioni riscritte.
+
+    Raises:
+        ValueError: Se path contiene l'esportazione di un altro database e full non è indicato.
+    """
+    _require_pyarrow()
+    posts_schema, ner_schema = _schemas()
+    posts_dir, ner_dir = os.path.join(path, "posts"), os.path.join(path, "ner")
+    collection = get_database(database_name)["post"]
+    state = {} if full else _load_state(path)
+    if state.get("database") not in (None, collection.database.name):
+        raise ValueError(f"{path} contiene l'esportazione del database {state['database']}: "
+                         f"usare full=True per sostituirla con quella di {collection.database.name}")
+    if full:
+        for directory in (posts_dir, ner_dir):
+            shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+    # Il nuovo watermark è l'inizio dell'esportazione: i post modificati durante l'esportazione
+    # verranno riletti la volta successiva
+    started = datetime.datetime.now(datetime.timezone.utc)
+    query = {}
+    if state.get("updated_since"):
+        query = {"updated_at": {"$gte": datetime.datetime.fromisoformat(state["updated_since"])}}
+
+    # Righe raccolte per mese; le partizioni vengono riscritte a blocchi per limitare la memoria
+    pending = {}
+    exported = 0
+    months = set()
+
+    def flush():
+        # Righe da eliminare per mese: quelle sostituite e quelle dei post che hanno cambiato mese
+        replaced = {month: {row["_id"] for row in rows} for month, (rows, _) in pending.items()}
+        new_months = {post_id: month for month, ids in replaced.items() for post_id in ids}
+        for post_id, old_month in _exported_months(posts_dir, set(new_months)).items():
+            if old_month != new_months[post_id]:
+                replaced.setdefault(old_month, set()).add(post_id)
+                months.add(old_month)
+        for month, ids in replaced.items():
+            rows, ner_rows = pending.get(month, ([], []))
+            _write_partition(posts_dir, month, pa.Table.from_pylist(rows, schema=posts_schema), ids)
+            _write_partition(ner_dir, month, pa.Table.from_pylist(ner_rows, schema=ner_schema), ids)
+        pending.clear()
+
+    ensure_indexes(database_name)
+    buffered = 0
+    for documento in collection.find(query, _PROJECTION).batch_size(batch_size):
+        row, ner_rows = _rows(documento)
+        month = _month(row["posted_at"])
+        rows, month_ner = pending.setdefault(month, ([], []))
+        rows.append(row)
+        month_ner.extend(ner_rows)
+        months.add(month)
+        exported += 1
+        buffered += 1
+        if buffered >= batch_size:
+            flush()
+            buffered = 0
+    flush()
+
+    _save_state(path, {"updated_since": started.isoformat(), "database": collection.database.name})
+    counts = {"posts": exported, "partitions": len(months)}
+    LOGGER.info(f"Esportazione in {path} completata: {counts}")
+    return counts
+
+
+def _dataset(path, table):
+    _require_pyarrow()
+    directory = os.path.join(path, table)
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"Nessuna esportazione in {directory}: eseguire prima export_posts")
+    return ds.dataset(directory, format="parquet", partitioning="hive")
+
+
+def _date_expression(start_date, end_date):
+    """Filtro su posted_at (stessa semantica di date_range_filter), applicato ai file Parquet."""
+    bounds = date_range_filter(start_date, end_date).get("posted_at", {})
+    expression = None
+    operators = {"$gte": "__ge__", "$lt": "__lt__", "$lte": "__le__"}
+    for operator, value in bounds.items():
+        condition = getattr(ds.field("posted_at"), operators[operator])(pa.scalar(value, pa.timestamp("ms", tz="UTC")))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _and(*expressions):
+    result = None
+    for expression in expressions:
+        if expression is not None:
+            result = expression if result is None else result & expression
+    return result
+
+
+def _ner_expressions(query):
+    """
+    Traduce le condizioni di una query MongoDB sul campo ner in filtri sulla tabella NER: ciascun
+    filtro seleziona i post con almeno un'entità che lo soddisfa. Sono supportati
+    {"ner": {"$elemMatch": {...}}} e {"ner.<campo>": valore} con uguaglianze.
+    """
+    expressions = []
+    for key, value in query.items():
+        if key == "ner" and isinstance(value, dict) and set(value) == {"$elemMatch"}:
+            conditions = value["$elemMatch"]
+        elif key.startswith("ner.") and not isinstance(value, dict):
+            conditions = {key[len("ner."):]: value}
+        else:
+            raise ValueError(f"Condizione {key}: {value} non supportata dal backend 'parquet'")
+        if any(isinstance(v, dict) or field not in ("entity", "word") for field, v in conditions.items()):
+            raise ValueError(f"Condizione {key}: {value} non supportata dal backend 'parquet'")
+        expressions.append(_and(*[ds.field(field) == v for field, v in conditions.items()]))
+    return expressions
+
+
+def matching_post_ids(query, path=DEFAULT_COLUMNAR_PATH, start_date=None, end_date=None):
+    """_id dei post esportati che soddisfano le condizioni su ner della query, nell'intervallo di date."""
+    dataset = _dataset(path, "ner")
+    dates = _date_expression(start_date, end_date)
+    ids = None
+    for expression in _ner_expressions(query):
+        table = dataset.to_table(columns=["_id"], filter=_and(expression, dates))
+        found = set(table["_id"].to_pylist())
+        ids = found if ids is None else ids & found
+    return ids
+
+
+def read_emotion_scores(query=None, path=DEFAULT_COLUMNAR_PATH, start_date=None, end_date=None):
+    """
+    Equivalente di get_emotion_scores sui file Parquet: legge solo le colonne delle emozioni dei post
+    che soddisfano la query (condizioni su ner, vedi _ner_expressions) e l'intervallo di date.
+
+    Returns:
+        dict: Emozione -> array NumPy (float32) dei punteggi.
+    """
+    dataset = _dataset(path, "posts")
+    expression = _date_expression(start_date, end_date)
+    if query:
+        ids = matching_post_ids(query, path, start_date, end_date)
+        expression = _and(expression, ds.field("_id").isin(sorted(ids)))
+    columns = [EMOTION_PREFIX + label for label in EMOTION_LABELS]
+    table = dataset.to_table(columns=columns, filter=expression)
+    scores = {}
+    for label, column in zip(EMOTION_LABELS, columns):
+        values = table[column].drop_null().to_numpy()
+        if values.size:
+            scores[label] = values
+    return scores
+
+
+def read_top_entities(entity, n, path=DEFAULT_COLUMNAR_PATH, start_date=None, end_date=None):
+    """Equivalente di get_top_entities sulla tabella NER: le n parole più frequenti per l'entità."""
+    dataset = _dataset(path, "ner")
+    table = dataset.to_table(columns=["word"],
+                             filter=_and(ds.field("entity") == entity, _date_expression(start_date, end_date)))
+    return [word for word, _ in Counter(table["word"].to_pylist()).most_common(n)]
@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlparse, urlunparse
+
+import httpx
+
+from shared.utils_http import DEFAULT_MAX_RETRIES, RETRY_STATUS, backoff_delay, retry_after_seconds
+from shared.utils_scraper import (
+    BASE_URL,
+    HEADERS,
+    add_section_info,
+    extract_discussions,
+    extract_sections,
+    filter_posts_by_date,
+    filter_valid_sections,
+    is_past_last_page,
+    last_page_from_pagination,
+    normalize_date_range,
+    normalize_url,
+    page_signature,
+    parse_html,
+    parse_post_page,
+    save_data_locally,
+    section_key,
+    store_forum_data,
+    store_posts,
+    unique_discussions,
+)
+
+
+LOGGER = logging.getLogger("crawler")
+
+# Numero massimo di richieste contemporanee verso lo stesso host
+DEFAULT_MAX_PER_HOST = 8
+
+
+def recorded_page_name(url):
+    """Nome del file con cui una pagina registrata viene salvata e servita (path + query dell'URL normalizzato)."""
+    parsed = urlparse(normalize_url(url))
+    key = parsed.path or "/"
+    if parsed.query:
+        key = f"{key}?{parsed.query}"
+    return quote(key, safe="") + ".html"
+
+
+class AsyncForumCrawler:
+    """
+    Motore di crawling asincrono per forumfree.
+
+    Scarica le pagine in parallelo (con un limite di richieste contemporanee per host) e le passa
+    alle stesse funzioni di parsing di utils_scraper, producendo gli stessi risultati della versione
+    sincrona e nello stesso ordine.
+
+    Args:
+        max_per_host (int): Numero massimo di richieste contemporanee verso ciascun host.
+        timeout (float): Timeout in secondi per ogni richiesta.
+        base_url_override (str): Se indicato, le richieste verso l'host di BASE_URL vengono dirottate
+            verso questo indirizzo (es. un server locale che serve pagine registrate). I link estratti
+            restano quelli originali del forum.
+        record_dir (str): Se indicato, ogni pagina scaricata viene salvata in questa cartella,
+            con il nome restituito da recorded_page_name.
+        max_retries (int): Tentativi aggiuntivi, con backoff esponenziale e jitter, su timeout e stati 5xx/429.
+        rate_limiter (AdaptiveRateLimiter): Limita (e adatta) la velocità delle richieste, oltre al limite per host.
+    """
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST, timeout=10, base_url_override=None, record_dir=None,
+                 max_retries=DEFAULT_MAX_RETRIES, rate_limiter=None):
+        self.max_per_host = max_per_host
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_url_override = base_url_override
+        self.record_dir = record_dir
+        self._semaphores = {}
+        self._client = None
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=self.timeout,
+            follow_redirects=True,  # Come requests nella versione sincrona: un redirect non è un errore
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.max_per_host),
+        )
+        if self.record_dir:
+            os.makedirs(self.record_dir, exist_ok=True)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._client.aclose()
+        self._client = None
+
+    def _rewrite(self, url):
+        """Dirotta verso base_url_override le richieste destinate all'host del forum."""
+        if not self.base_url_override:
+            return url
+        parsed = urlparse(url)
+        if parsed.netloc != urlparse(BASE_URL).netloc:
+            return url
+        override = urlparse(self.base_url_override)
+        return urlunparse(parsed._replace(scheme=override.scheme, netloc=override.netloc))
+
+    def _semaphore(self, host):
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self._semaphores[host]
+
+    async def fetch(self, url):
+        """Scarica una pagina e ne restituisce il contenuto in byte, o None in caso di errore."""
+        request_url = self._rewrite(url)
+        semaphore = self._semaphore(urlparse(request_url).netloc)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve())
+            async with semaphore:
+                try:
+                    started = time.monotonic()
+                    response = await self._client.get(request_url)
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.observe(time.monotonic() - started, response.status_code,
+                                                  retry_after_seconds(response.headers.get("Retry-After")))
+                    if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                        response.raise_for_status()
+                        break
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.observe(latency=time.monotonic() - started)
+                    if attempt >= self.max_retries:
+                        logging.error(f"Error downloading page {url}: {str(e)}")
+                        return None
+                except httpx.HTTPError as e:
+                    logging.error(f"Error downloading page {url}: {str(e)}")
+                    return None
+
+            # L'attesa avviene fuori dal semaforo, per non occupare uno slot dell'host
+            attempt += 1
+            await asyncio.sleep(backoff_delay(attempt))
+
+        if self.record_dir:
+            with open(os.path.join(self.record_dir, recorded_page_name(url)), "wb") as f:
+                f.write(response.content)
+        return response.content
+
+    async def download_and_parse(self, url, only=None):
+        content = await self.fetch(url)
+        if content is None:
+            return None
+        return parse_html(content, only)
+
+    async def extract_all_sections(self, url, max_depth=None):
+        """
+        Equivalente asincrono di extract_all_sections_recursive (vedi walk_sections): la visita procede
+        per livelli e le pagine delle sezioni di uno stesso livello vengono scaricate in parallelo.
+        Ogni sezione viene visitata una sola volta, anche se raggiungibile da più sezioni.
+        """
+        visited = set()
+        all_sections = []
+        level = [(None, url)]
+        depth = 0
+        while level and (max_depth is None or depth < max_depth):
+            for section, link in level:
+                if section is not None and link:
+                    logging.info(f"Exploring link: {link}")
+            soups = await asyncio.gather(*[
+                self.download_and_parse(link, only="sections") if link else asyncio.sleep(0) for _, link in level
+            ])
+            next_level = []
+            for soup in soups:
+                if not soup:
+                    continue
+                for child in filter_valid_sections(extract_sections(soup)):
+                    key = section_key(child)
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                    all_sections.append(child)
+                    next_level.append((child, child.get("Link")))
+            level = next_level
+            depth += 1
+        return all_sections
+
+    async def _fetch_listing(self, url, page_size, parse, first_url=None):
+        """
+        Scarica tutte le pagine di un elenco (&st=): le pagine indicate dalla paginazione della prima pagina
+        vengono scaricate in parallelo, le eventuali successive una alla volta. parse(content, download_url)
+        restituisce (risultati della pagina, True se è l'ultima pagina), oppure None se si è andati oltre la fine.
+        """
+        results = []
+        first_url = first_url or url
+        content = await self.fetch(first_url)
+        if content is None:
+            return None
+        page_results, is_last = parse(content, first_url)
+        results.append(page_results)
+        if is_last:
+            return results
+
+        last_page = last_page_from_pagination(content, url, page_size) or 0
+        download_urls = [f"{url}&st={page * page_size}" for page in range(1, last_page + 1)]
+        contents = await asyncio.gather(*[self.fetch(download_url) for download_url in download_urls])
+        for download_url, content in zip(download_urls, contents):
+            parsed = parse(content, download_url) if content is not None else None
+            if parsed is None:
+                return results
+            results.append(parsed[0])
+            if parsed[1]:
+                return results
+
+        page = last_page + 1
+        while True:
+            download_url = f"{url}&st={page * page_size}"
+            content = await self.fetch(download_url)
+            parsed = parse(content, download_url) if content is not None else None
+            if parsed is None:
+                return results
+            results.append(parsed[0])
+            if parsed[1]:
+                return results
+            page += 1
+
+    async def extract_discussions_paginated(self, url):
+        """Equivalente asincrono di extract_discussions_paginated."""
+        original_url = normalize_url(url)
+        logging.info(f"Downloading discussions from: {original_url}")
+
+        def parse(content, download_url):
+            soup = parse_html(content, only="discussions")
+            if download_url != original_url and is_past_last_page(soup, download_url):
+                return None
+            return extract_discussions(soup), False
+
+        pages = await self._fetch_listing(original_url, 30, parse)
+        if pages is None:
+            logging.warning(f"Failed to download or parse the page: {original_url}")
+            return []
+        return [discussion for page_discussions in pages for discussion in page_discussions]
+
+    async def _process_section(self, item):
+        title = item.get("Title")
+        link = item.get("Link")
+        try:
+            discussioni = await self.extract_discussions_paginated(link)
+            add_section_info(discussioni, title, link)
+            logging.info(f"Sezione {title}: {len(discussioni)} discussioni estratte")
+        except Exception as e:
+            logging.error(f"Errore nell'estrazione delle discussioni per il link {link}: {e}")
+            discussioni = []
+        return discussioni
+
+    async def process_discussions(self, items):
+        """Equivalente asincrono di process_discussions: le sezioni vengono elaborate in parallelo."""
+        results = await asyncio.gather(*[self._process_section(item) for item in items])
+        discussioni_totali = []
+        for discussioni in results:
+            discussioni_totali.extend(discussioni)
+        return list(unique_discussions(discussioni_totali))
+
+    async def extract_posts(self, url, start_date, end_date):
+        """Equivalente asincrono di extract_posts: le pagine indicate dalla paginazione vengono scaricate in parallelo."""
+        first_url = f"{url}&st=0"
+        signatures = []  # Firme delle pagine già analizzate (parse viene chiamata nell'ordine delle pagine)
+
+        def parse(content, download_url):
+            post_dicts, num_post_divs, _ = parse_post_page(content, download_url)
+            # Oltre l'ultima pagina il forum può restituire di nuovo l'ultima pagina: una pagina identica a una
+            # pagina precedente indica che si è andati oltre la fine (come in post_pages_plan)
+            signature = page_signature(post_dicts)
+            if download_url != first_url and signature is not None and signature in signatures:
+                return None
+            signatures.append(signature)
+            return filter_posts_by_date(post_dicts, start_date, end_date), num_post_divs < 15
+
+        pages = await self._fetch_listing(url, 15, parse, first_url=first_url)
+        return [post for page_posts in pages or [] for post in page_posts]
+
+    async def extract_all_posts(self, discussioni, start_date, end_date):
+        """Scarica in parallelo i post di tutte le discussioni, restituendoli nell'ordine delle discussioni."""
+        return await asyncio.gather(*[
+            self.extract_posts(discussione["link"], start_date, end_date) for discussione in discussioni
+        ])
+
+
+async def crawl_forum(url=BASE_URL, save_to_local=False, **crawler_options):
+    """
+    Versione asincrona di process_forum_data. Da usare con `await` all'interno di un notebook.
+
+    Args:
+        url (str): URL di partenza del forum.
+        save_to_local (bool): Se True salva sezioni e discussioni in locale.
+        **crawler_options: Parametri passati ad AsyncForumCrawler (max_per_host, timeout, ...).
+
+    Returns:
+        tuple: (sezioni, discussioni), oppure None in caso di errore.
+    """
+    try:
+        logging.info(f"Inizio elaborazione asincrona dell'URL: {url}")
+        async with AsyncForumCrawler(**crawler_options) as crawler:
+            sections = await crawler.extract_all_sections(url)
+            logging.info(f"Estrazione completata. Numero di sezioni trovate: {len(sections)}")
+
+            discussions = await crawler.process_discussions(sections)
+            logging.info(f"Elaborazione completata. Numero di discussioni processate: {len(discussions)}")
+
+        if save_to_local:
+            save_data_locally(sections, "sections")
+            save_data_locally(discussions, "discussions")
+
+        return sections, discussions
+
+    except Exception as e:
+        logging.error(f"Si è verificato un errore durante l'elaborazione: {e}")
+        return None
+
+
+async def crawl_forum_and_insert(database_name, start_date, end_date, url=BASE_URL, **crawler_options):
+    """Versione asincrona di process_forum_data_and_insert: sezioni, discussioni e post vengono scaricati in parallelo."""
+    start_date, end_date = normalize_date_range(start_date, end_date)
+
+    async with AsyncForumCrawler(**crawler_options) as crawler:
+        result_sections = await crawler.extract_all_sections(url)
+        result_discussion = await crawler.process_discussions(result_sections)
+        posts_per_discussione = await crawler.extract_all_posts(result_discussion, start_date, end_date)
+
+    store_forum_data(result_sections, result_discussion, database_name)
+    store_posts(result_discussion, posts_per_discussione, database_name)
+
+
+def process_forum_data_async(url=BASE_URL, save_to_local=False, **crawler_options):
+    """Alternativa a process_forum_data basata sul crawler asincrono. Restituisce gli stessi risultati."""
+    return asyncio.run(crawl_forum(url, save_to_local, **crawler_options))
+
+
+def process_forum_data_and_insert_async(database_name, start_date, end_date, url=BASE_URL, **crawler_options):
+    """Alternativa a process_forum_data_and_insert basata sul crawler asincrono."""
+    asyncio.run(crawl_forum_and_insert(database_name, start_date, end_date, url, **crawler_options))
+
+
+class _RecordedPageHandler(SimpleHTTPRequestHandler):
+    """Serve le pagine registrate cercandole per nome (path + query della richiesta)."""
+
+    def do_GET(self):
+        page = os.path.join(self.directory, recorded_page_name(f"http://localhost{self.path}"))
+        if not os.path.exists(page):
+            self.send_error(404)
+            return
+        with open(page, "rb") as f:
+            content = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+
+def serve_recorded_pages(directory, host="127.0.0.1", port=0):
+    """
+    Avvia in un thread un server HTTP locale che sostituisce forumfree servendo le pagine
+    registrate con AsyncForumCrawler(record_dir=...).
+
+    Returns:
+        tuple: (server, base_url) - base_url va passato come base_url_override al crawler;
+        il server si ferma con server.shutdown().
+    """
+    handler = lambda *args, **kwargs: _RecordedPageHandler(*args, directory=directory, **kwargs)
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/"
@@ -0,0 +1,57 @@
+import datetime
+from zoneinfo import ZoneInfo
+
+
+# Il forum mostra data e ora dei messaggi nel fuso orario italiano
+FORUM_TIMEZONE = ZoneInfo("Europe/Rome")
+
+
+def parse_forum_datetime(date, time=None):
+    """
+    Converte data ("12/03/2021") e ora ("10:45") mostrate dal forum in un datetime UTC.
+    Senza ora (o con un'ora non valida) si usa la mezzanotte del giorno. None se la data non è valida.
+    """
+    try:
+        day = datetime.datetime.strptime(date, "%d/%m/%Y")
+    except (TypeError, ValueError):
+        return None
+    try:
+        moment = datetime.datetime.strptime(time, "%H:%M").time()
+    except (TypeError, ValueError):
+        moment = datetime.time()
+    local = datetime.datetime.combine(day.date(), moment, tzinfo=FORUM_TIMEZONE)
+    return local.astimezone(datetime.timezone.utc)
+
+
+def _to_utc(value, end=False):
+    if isinstance(value, str):
+        value = datetime.datetime.strptime(value, "%Y-%m-%d")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=FORUM_TIMEZONE)
+    if end:
+        # Giorno di calendario nel fuso del forum: la data finale include l'intero giorno (come nello scraper),
+        # il limite è la mezzanotte del giorno successivo
+        day = value.astimezone(FORUM_TIMEZONE).date() + datetime.timedelta(days=1)
+        value = datetime.datetime.combine(day, datetime.time(), tzinfo=FORUM_TIMEZONE)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def date_range_filter(start_date=None, end_date=None, field="posted_at"):
+    """
+    Filtro MongoDB sull'intervallo di date del campo indicato (un datetime UTC), da combinare con
+    le altre condizioni della query così che l'intervallo venga applicato dal server usando l'indice.
+
+    Args:
+        start_date, end_date: Stringhe YYYY-MM-DD (giorni del fuso del forum, estremi inclusi) o datetime
+            (senza fuso orario si intendono nel fuso del forum; di end_date conta il giorno, incluso per
+            intero come nello scraper); None = intervallo aperto.
+
+    Returns:
+        dict: Il filtro, vuoto se entrambi gli estremi sono None.
+    """
+    bounds = {}
+    if start_date is not None:
+        bounds["$gte"] = _to_utc(start_date)
+    if end_date is not None:
+        bounds["$lt"] = _to_utc(end_date, end=True)
+    return {field: bounds} if bounds else {}
@@ -0,0 +1,157 @@
+import datetime
+import logging
+
+import numpy as np
+from bson.binary import Binary
+from pymongo import UpdateOne
+
+
+LOGGER = logging.getLogger("emotions")
+
+# Schemi delle etichette delle emozioni: la posizione di ogni etichetta nel vettore salvato.
+# Uno schema non va mai modificato: per cambiare etichette o ordine se ne aggiunge uno nuovo.
+EMOTION_SCHEMAS = {
+    1: (
+        "ammirazione", "divertimento", "rabbia", "fastidio", "approvazione", "cura", "confusione",
+        "curiosità", "desiderio", "delusione", "disapprovazione", "disgusto", "imbarazzo", "eccitazione",
+        "paura", "gratitudine", "lutto", "gioia", "amore", "nervosismo", "ottimismo", "orgoglio",
+        "realizzazione", "rilievo", "rimorso", "tristezza", "sorpresa", "neutrale",
+    ),
+}
+EMOTION_SCHEMA_VERSION = max(EMOTION_SCHEMAS)
+
+# Campi del documento con la codifica compatta (in alternativa a sentiment_analysis_full/relevant)
+VECTOR_FIELD = "emotion_vector"
+SCHEMA_FIELD = "emotion_schema"
+# Campi da leggere per calcolare i punteggi, in entrambi i formati
+EMOTION_PROJECTION = {"sentiment_analysis_full": 1, VECTOR_FIELD: 1, SCHEMA_FIELD: 1}
+
+# Soglia con cui analisi_semantica seleziona le emozioni rilevanti (sentiment_analysis_relevant)
+RELEVANT_THRESHOLD = 0.15
+
+_DTYPE = np.dtype("<f4")  # float32 little-endian, indipendente dalla piattaforma
+
+
+def emotion_vector(scores, version=EMOTION_SCHEMA_VERSION):
+    """
+    Vettore float32 dei punteggi nell'ordine dello schema; le emozioni assenti valgono NaN.
+    Solleva ValueError per un'etichetta che non fa parte dello schema.
+    """
+    labels = EMOTION_SCHEMAS[version]
+    vector = np.full(len(labels), np.nan, dtype=_DTYPE)
+    for label, score in scores.items():
+        try:
+            vector[labels.index(label)] = score
+        except ValueError:
+            raise ValueError(f"Emozione '{label}' non presente nello schema {version}") from None
+    return vector
+
+
+def encode_emotions(scores, version=EMOTION_SCHEMA_VERSION):
+    """
+    Codifica compatta dei punteggi (dizionario etichetta -> punteggio, come sentiment_analysis_full):
+    restituisce i campi da salvare nel documento, cioè la versione dello schema e il vettore float32
+    come BinData (4 byte per emozione invece di etichetta e double per ogni chiave).
+    """
+    return {SCHEMA_FIELD: version, VECTOR_FIELD: Binary(emotion_vector(scores, version).tobytes())}
+
+
+def decode_emotions(document):
+    """Vettore NumPy (float32) dei punteggi salvati con encode_emotions e relative etichette."""
+    labels = EMOTION_SCHEMAS[document[SCHEMA_FIELD]]
+    return np.frombuffer(document[VECTOR_FIELD], dtype=_DTYPE), labels
+
+
+def decode_emotions_dict(document):
+    """Come decode_emotions, nel formato di sentiment_analysis_full (solo le emozioni presenti)."""
+    vector, labels = decode_emotions(document)
+    return {label: float(score) for label, score in zip(labels, vector) if not np.isnan(score)}
+
+
+def relevant_emotions(scores, threshold=RELEVANT_THRESHOLD):
+    """Emozioni con punteggio superiore alla soglia (il contenuto di sentiment_analysis_relevant)."""
+    return {label: score for label, score in scores.items() if score > threshold}
+
+
+def document_emotions(doc, version=EMOTION_SCHEMA_VERSION):
+    """
+    Vettore float32 dei punteggi di un documento salvato in uno dei due formati (vettore compatto o
+    dizionario sentiment_analysis_full), nell'ordine dello schema indicato; None se il documento non
+    ha punteggi. Solleva ValueError per etichette non presenti nello schema.
+    """
+    if doc.get(VECTOR_FIELD) is not None:
+        vector, doc_labels = decode_emotions(doc)
+        if doc_labels != EMOTION_SCHEMAS[version]:
+            vector = emotion_vector(dict(zip(doc_labels, vector.tolist())), version)
+        return vector
+    if doc.get("sentiment_analysis_full"):
+        return emotion_vector(doc["sentiment_analysis_full"], version)
+    return None
+
+
+def emotion_matrix(documents, version=EMOTION_SCHEMA_VERSION):
+    """
+    Matrice (documenti x emozioni, float32) dei punteggi dei documenti (vedi document_emotions).
+    I documenti senza punteggi vengono saltati, quelli con etichette sconosciute segnalati e saltati.
+
+    Returns:
+        tuple: (matrice, etichette dello schema)
+    """
+    labels = EMOTION_SCHEMAS[version]
+    rows = []
+    for doc in documents:
+        try:
+            vector = document_emotions(doc, version)
+        except ValueError as e:
+            LOGGER.warning(f"Documento {doc.get('_id')} ignorato: {e}")
+            continue
+        if vector is not None:
+            rows.append(vector)
+    matrix = np.vstack(rows) if rows else np.empty((0, len(labels)), dtype=_DTYPE)
+    return matrix, labels
+
+
+def emotion_scores(documents, version=EMOTION_SCHEMA_VERSION):
+    """
+    Punteggi di ogni emozione sui documenti, come dizionario etichetta -> array NumPy (il formato usato
+    da calculate_statistics e plot_emotion_means). Le emozioni mai presenti non compaiono.
+    """
+    matrix, labels = emotion_matrix(documents, version)
+    scores = {}
+    for i, label in enumerate(labels):
+        column = matrix[:, i]
+        column = column[~np.isnan(column)]
+        if column.size:
+            scores[label] = column
+    return scores
+
+
+def compact_stored_emotions(collection, batch_size=500):
+    """
+    Converte alla codifica compatta i documenti della collezione salvati con i dizionari
+    sentiment_analysis_full/sentiment_analysis_relevant, con aggiornamenti a blocchi di batch_size.
+    I documenti con etichette non presenti nello schema restano invariati.
+
+    Returns:
+        int: Documenti convertiti.
+    """
+    converted = 0
+    operations = []
+    query = {"sentiment_analysis_full": {"$exists": True}, VECTOR_FIELD: {"$exists": False}}
+    for doc in collection.find(query, {"sentiment_analysis_full": 1}).batch_size(batch_size):
+        try:
+            fields = encode_emotions(doc["sentiment_analysis_full"] or {})
+        except ValueError as e:
+            LOGGER.warning(f"Documento {doc['_id']} non convertito: {e}")
+            continue
+        fields["updated_at"] = datetime.datetime.now(datetime.timezone.utc)
+        operations.append(UpdateOne({"_id": doc["_id"]}, {
+            "$set": fields, "$unset": {"sentiment_analysis_full": "", "sentiment_analysis_relevant": ""},
+        }))
+        if len(operations) >= batch_size:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+            operations.clear()
+    if operations:
+        converted += collection.bulk_write(operations, ordered=False).modified_count
+    LOGGER.info(f"{collection.name}: {converted} documenti convertiti alla codifica compatta delle emozioni")
+    return converted
@@ -0,0 +1,193 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import psutil
+import torch
+
+from shared.utils_inference import open_inference_cache
+from shared.utils_mongo import get_database
+from shared.utils_schema import ensure_indexes
+from shared.utils_semantics import DEFAULT_INFERENCE_BATCH_SIZE, arricchisci_post, load_models, recupera_autori
+
+
+LOGGER = logging.getLogger("enrichment")
+
+# Post per intervallo di _id assegnato a un processo: intervalli piccoli bilanciano il carico tra i processi
+DEFAULT_RANGE_SIZE = 500
+
+# Stato del processo di analisi, creato una sola volta da _init_worker
+_worker = {}
+
+
+def post_id_ranges(collection, range_size=DEFAULT_RANGE_SIZE):
+    """
+    Divide gli _id dei post in intervalli disgiunti [inizio, fine) di circa range_size post ciascuno;
+    fine None indica un intervallo aperto. Gli _id di tipo diverso (ObjectId dei post non ancora
+    migrati, stringhe di post_id) finiscono in intervalli diversi, perché MongoDB confronta con
+    $gte/$lt solo valori dello stesso tipo.
+
+    Returns:
+        list: Coppie (inizio, fine).
+    """
+    bounds = []
+    count = 0
+    for documento in collection.find({}, {"_id": 1}).sort("_id", 1):
+        _id = documento["_id"]
+        if not bounds or type(_id) is not type(bounds[-1]) or count >= range_size:
+            bounds.append(_id)
+            count = 0
+        count += 1
+    ranges = []
+    for start, end in zip(bounds, bounds[1:] + [None]):
+        ranges.append((start, end if type(end) is type(start) else None))
+    return ranges
+
+
+def range_filter(start, end):
+    """Filtro MongoDB dei post con _id nell'intervallo [start, end)."""
+    bounds = {"$gte": start}
+    if end is not None:
+        bounds["$lt"] = end
+    return {"_id": bounds}
+
+
+def model_memory(models_pipelines):
+    """Byte occupati da parametri e buffer dei modelli caricati (vedi load_models)."""
+    total = 0
+    for engine in models_pipelines:
+        model = getattr(engine, "model", None)
+        if model is None or not hasattr(model, "parameters"):
+            continue
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def _memory_report():
+    return {"model_bytes": _worker["model_bytes"], "rss_bytes": psutil.Process().memory_info().rss}
+
+
+def _init_worker(database_name, threads, compact_emotions, batch_size, cache_path, cache_database):
+    """Inizializza un processo di analisi: thread di PyTorch, modelli (caricati una sola volta) e cache."""
+    torch.set_num_threads(threads)
+    models_pipelines = load_models()
+    _worker.update(
+        database_name=database_name,
+        models_pipelines=models_pipelines,
+        autori=recupera_autori(get_database(database_name)["autori"]),
+        compact_emotions=compact_emotions,
+        batch_size=batch_size,
+        cache=open_inference_cache(cache_path, cache_database) if cache_path or cache_database else None,
+        model_bytes=model_memory(models_pipelines),
+    )
+
+
+def _enrich_range(start, end):
+    """Analizza i post con _id nell'intervallo [start, end) nel processo corrente."""
+    started = time.perf_counter()
+    collection = get_database(_worker["database_name"])["post"]
+    batch_size = _worker["batch_size"]
+    documenti = collection.find(range_filter(start, end), {"message": 1}).batch_size(max(50, batch_size or 0))
+    conteggi = arricchisci_post(collection, documenti, _worker["autori"], _worker["models_pipelines"],
+                                _worker["compact_emotions"], batch_size, _worker["cache"], verbose=False)
+    cache = _worker["cache"]
+    return {
+        **conteggi,
+        "pid": os.getpid(),
+        "elapsed": time.perf_counter() - started,
+        "memory": _memory_report(),
+        "cache": cache.stats() if cache is not None else None,
+    }
+
+
+def _measure_worker():
+    return _memory_report()
+
+
+def _pool(workers, database_name, threads, compact_emotions=False, batch_size=None, cache_path=None,
+          cache_database=None):
+    # I processi vengono avviati con spawn: un fork di un processo che ha già usato PyTorch può bloccarsi
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+        initargs=(database_name, threads, compact_emotions, batch_size, cache_path, cache_database),
+    )
+
+
+def estimate_worker_memory(database_name=None, threads=1):
+    """
+    Stima la memoria di un processo di analisi avviandone uno e caricando i modelli.
+
+    Returns:
+        dict: Byte dei modelli ("model_bytes"), memoria residente del processo ("rss_bytes"), memoria
+            disponibile sulla macchina ("available_bytes") e numero di processi che vi rientrano ("max_workers").
+    """
+    with _pool(1, database_name, threads) as pool:
+        report = pool.submit(_measure_worker).result()
+    available = psutil.virtual_memory().available
+    return {**report, "available_bytes": available, "max_workers": max(1, available // report["rss_bytes"])}
+
+
+def integra_database_parallel(nome_db, workers=None, threads_per_worker=None, compact_emotions=False,
+                              batch_size=DEFAULT_INFERENCE_BATCH_SIZE, range_size=DEFAULT_RANGE_SIZE, cache_path=None,
+                              cache_database=None):
+    """
+    Come integra_database, distribuendo l'analisi su più processi. Ogni processo carica i modelli una
+    sola volta, usa threads_per_worker thread di PyTorch e analizza intervalli disgiunti di _id dei
+    post (vedi post_id_ranges), assegnati man mano che i processi si liberano; il processo principale
+    raccoglie avanzamento ed errori.
+
+    Ogni processo occupa la memoria di una copia dei modelli: il numero di processi che la macchina può
+    sostenere si ricava da estimate_worker_memory (e viene riportato nel risultato).
+
+    Args:
+        nome_db (str): Nome del database.
+        workers (int): Processi di analisi (default: numero di CPU).
+        threads_per_worker (int): Thread di PyTorch per processo (default: CPU divise per i processi).
+        compact_emotions, batch_size: Come in integra_database.
+        range_size (int): Post per intervallo di _id.
+        cache_path, cache_database: Cache di inferenza di ogni processo (vedi open_inference_cache);
+            con più processi è preferibile quella su MongoDB (cache_database).
+
+    Returns:
+        dict: Post analizzati, _id dei post non elaborati, intervalli falliti, post/secondo, memoria e
+            statistiche della cache per processo.
+    """
+    workers = workers or os.cpu_count() or 1
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    ensure_indexes(nome_db)
+    ranges = post_id_ranges(get_database(nome_db)["post"], range_size)
+    LOGGER.info(f"{len(ranges)} intervalli di _id da analizzare con {workers} processi "
+                f"({threads_per_worker} thread ciascuno)")
+
+    started = time.perf_counter()
+    totals = {"posts": 0, "failed": [], "failed_ranges": [], "memory": {}, "cache": {}}
+    with _pool(workers, nome_db, threads_per_worker, compact_emotions, batch_size, cache_path,
+               cache_database) as pool:
+        futures = {pool.submit(_enrich_range, start, end): (start, end) for start, end in ranges}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                LOGGER.error(f"Intervallo {futures[future]} non elaborato: {e}")
+                totals["failed_ranges"].append(futures[future])
+                continue
+            totals["posts"] += result["posts"]
+            totals["failed"].extend(result["failed"])
+            totals["memory"][result["pid"]] = result["memory"]
+            if result["cache"] is not None:
+                totals["cache"][result["pid"]] = result["cache"]
+            elapsed = time.perf_counter() - started
+            LOGGER.info(f"Intervalli {done}/{len(ranges)}: {totals['posts']} post analizzati "
+                        f"({totals['posts'] / elapsed:.1f} post/s), {len(totals['failed'])} errori")
+
+    elapsed = time.perf_counter() - started
+    totals["elapsed"] = elapsed
+    totals["posts_per_second"] = totals["posts"] / elapsed if elapsed else 0.0
+    if totals["memory"]:
+        totals["rss_bytes_per_worker"] = max(memory["rss_bytes"] for memory in totals["memory"].values())
+    LOGGER.info(f"Analisi completata: {totals['posts']} post in {elapsed:.1f} s, {len(totals['failed'])} errori, "
+                f"{len(totals['failed_ranges'])} intervalli falliti")
+    return totals
@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import partial
+
+import requests
+
+from shared.utils_dates import parse_forum_datetime
+from shared.utils_scraper import (
+    BASE_URL,
+    add_section_info,
+    crawl_session,
+    discussion_page_url,
+    discussion_pages_plan,
+    extract_sections,
+    fetch_page,
+    filter_valid_sections,
+    iter_posts,
+    normalize_date_range,
+    normalize_url,
+    parse_discussion_page,
+    parse_html,
+    run_page_plan,
+    store_discussion_posts,
+    store_forum_data,
+)
+from shared.utils_schema import ensure_indexes
+
+
+LOGGER = logging.getLogger("frontier")
+
+DEFAULT_FRONTIER_PATH = "crawl_frontier.sqlite"
+# Tentativi (su esecuzioni successive) prima di abbandonare un URL
+MAX_ATTEMPTS = 3
+
+ROOT = "root"
+SECTION = "sezione"
+DISCUSSION = "discussione"
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class CrawlFrontier:
+    """
+    Frontiera persistente di un crawl, salvata in un file SQLite: per ogni URL da visitare conserva
+    tipo (radice, sezione, discussione), dati già estratti, stato (pending / done / failed), numero
+    di tentativi e ultimo errore. Gli URL vengono visitati nell'ordine in cui sono stati aggiunti
+    (visita in ampiezza) e ogni URL viene aggiunto una sola volta.
+
+    Args:
+        path (str): Percorso del file SQLite della frontiera.
+    """
+
+    def __init__(self, path=DEFAULT_FRONTIER_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                payload TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, seq);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self._conn.commit()
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+            self._conn.commit()
+
+    def add(self, kind, url, payload=None):
+        """Aggiunge un URL da visitare; True se era nuovo (gli URL già presenti vengono ignorati)."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO frontier (url, kind, payload, state, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (normalize_url(url), kind, json.dumps(payload, default=str) if payload is not None else None,
+                 PENDING, time.time()),
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def next_pending(self):
+        """Restituisce (tipo, url, dati) del prossimo URL da visitare, o None se la frontiera è esaurita."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, url, payload FROM frontier WHERE state = ? ORDER BY seq LIMIT 1", (PENDING,)
+            ).fetchone()
+        if row is None:
+            return None
+        kind, url, payload = row
+        return kind, url, json.loads(payload) if payload else None
+
+    def _set_state(self, url, state, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE frontier SET state = ?, attempts = attempts + ?, last_error = ?, updated_at = ? WHERE url = ?",
+                (state, 1 if error is not None else 0, error, time.time(), normalize_url(url)),
+            )
+            self._conn.commit()
+
+    def mark_done(self, url):
+        self._set_state(url, DONE)
+
+    def mark_failed(self, url, error):
+        """Segna un URL come fallito: verrà ritentato alla ripresa del crawl (fino a MAX_ATTEMPTS tentativi)."""
+        self._set_state(url, FAILED, str(error) or type(error).__name__)
+
+    def record_error(self, url, error):
+        """Registra l'errore che ha interrotto il crawl lasciando l'URL da visitare."""
+        self._set_state(url, PENDING, str(error) or type(error).__name__)
+
+    def requeue_failed(self, max_attempts=MAX_ATTEMPTS):
+        """Rimette in coda gli URL falliti con meno di max_attempts tentativi; restituisce quanti."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE frontier SET state = ? WHERE state = ? AND attempts < ?", (PENDING, FAILED, max_attempts)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def counts(self):
+        """Numero di URL per stato."""
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM frontier GROUP BY state").fetchall()
+        return {PENDING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM frontier").fetchone()[0] == 0
+
+    def reset(self):
+        """Cancella frontiera e parametri: il prossimo crawl ripartirà dalla radice del forum."""
+        with self._lock:
+            self._conn.execute("DELETE FROM frontier")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _visit_root(frontier, url):
+    sections = filter_valid_sections(extract_sections(parse_html(fetch_page(url), only="sections")))
+    for section in sections:
+        frontier.add(SECTION, section["Link"], section)
+
+
+def _visit_section(frontier, database_name, section):
+    link = normalize_url(section["Link"])
+    # Nella frontiera i dati sono salvati in JSON: il datetime viene ricalcolato dalle stringhe
+    section["last_message_at"] = parse_forum_datetime(section.get("Last Message Date"), section.get("Last Message Time"))
+
+    # Sottosezioni e discussioni: un errore di download interrompe la visita della sezione,
+    # che resta da completare (a differenza di extract_discussions_paginated)
+    first_page = fetch_page(link)
+    for subsection in filter_valid_sections(extract_sections(parse_html(first_page, only="sections"))):
+        frontier.add(SECTION, subsection["Link"], subsection)
+
+    # La prima pagina serve anche per l'elenco delle discussioni: non viene scaricata di nuovo
+    pages, selected = {0: parse_discussion_page(first_page, link)}, []
+    for _ in run_page_plan(discussion_pages_plan(pages, selected), pages, partial(discussion_page_url, link),
+                           parse_discussion_page):
+        pass
+    discussioni = [discussione for page in selected for discussione in pages[page][0]]
+    add_section_info(discussioni, section.get("Title"), section["Link"])
+
+    for discussione in discussioni:
+        frontier.add(DISCUSSION, discussione["link"], discussione)
+    store_forum_data([section], discussioni, database_name)
+
+
+def _visit_discussion(database_name, discussione, start_date, end_date):
+    stats = {}
+    posts = iter_posts(discussione["link"], start_date, end_date, replies=discussione.get("replies"), stats=stats)
+    store_discussion_posts([(discussione, posts)], database_name)
+    if stats["truncated"]:
+        raise requests.exceptions.RequestException(f"discussione {discussione['link']} scaricata solo in parte")
+
+
+def _check_resume_params(params, database_name, start_date, end_date, url):
+    """Solleva ValueError se i parametri indicati alla ripresa non coincidono con quelli del crawl salvato."""
+    stored_start, stored_end = normalize_date_range(params["start_date"], params["end_date"])
+    given_start, given_end = normalize_date_range(start_date or stored_start, end_date or stored_end)
+    given = {"database_name": database_name, "start_date": given_start.strftime("%Y-%m-%d"),
+             "end_date": given_end.strftime("%Y-%m-%d"), "url": url or params["url"]}
+    different = {key: (params[key], value) for key, value in given.items() if value != params[key]}
+    if different:
+        raise ValueError(f"Parametri diversi da quelli del crawl da riprendere (salvato, indicato): {different}")
+
+
+def crawl_with_frontier(database_name, start_date=None, end_date=None, url=None,
+                        frontier_path=DEFAULT_FRONTIER_PATH, resume=False, reset=False, **session_options):
+    """
+    Crawl completo del forum (sezioni, discussioni e post salvati in MongoDB) che può essere interrotto
+    e ripreso: lo stato di ogni URL è salvato in una CrawlFrontier, un URL viene segnato come visitato
+    solo dopo che i suoi dati sono stati scritti, e alla ripresa si prosegue dal primo URL non visitato
+    (ritentando quelli falliti). Gli errori non vengono nascosti: un errore di download segna l'URL
+    come fallito e il crawl prosegue, qualunque altro errore interrompe il crawl lasciando l'URL in coda.
+
+    Args:
+        database_name (str): Nome del database MongoDB.
+        start_date, end_date: Intervallo di date dei post (stringhe YYYY-MM-DD o datetime).
+        url (str): URL di partenza del forum (default BASE_URL).
+        frontier_path (str): File SQLite della frontiera.
+        resume (bool): Se True riprende il crawl salvato nella frontiera, con i suoi parametri; quelli
+            indicati esplicitamente devono coincidere con quelli salvati.
+        reset (bool): Se True cancella la frontiera esistente e riparte dalla radice.
+        **session_options: Parametri passati a crawl_session (cache_path, rate_limit, ...).
+
+    Returns:
+        dict: Numero di URL per stato al termine.
+
+    Raises:
+        ValueError: Se la frontiera contiene già un crawl e non è indicato né resume né reset, se resume
+            è indicato ma non c'è un crawl da riprendere (o è già completato), o se i parametri indicati
+            non coincidono con quelli del crawl salvato.
+    """
+    if resume and reset:
+        raise ValueError("resume e reset non possono essere usati insieme")
+    frontier = CrawlFrontier(frontier_path)
+    try:
+        if reset:
+            frontier.reset()
+        params = frontier.get_meta("params")
+        if params is None:
+            if resume:
+                raise ValueError(f"Nessun crawl da riprendere in {frontier_path}")
+            start_date, end_date = normalize_date_range(start_date, end_date)
+            params = {"database_name": database_name, "start_date": start_date.strftime("%Y-%m-%d"),
+                      "end_date": end_date.strftime("%Y-%m-%d"), "url": url or BASE_URL}
+            frontier.set_meta("params", params)
+            frontier.add(ROOT, params["url"])
+        else:
+            if not resume:
+                raise ValueError(f"Esiste già un crawl in {frontier_path}: usare resume per riprenderlo "
+                                 f"o reset per ricominciare")
+            # Alla ripresa valgono i parametri del crawl originale
+            _check_resume_params(params, database_name, start_date, end_date, url)
+            requeued = frontier.requeue_failed()
+            counts = frontier.counts()
+            if not counts[PENDING]:
+                raise ValueError(f"Il crawl in {frontier_path} è già completato ({counts}): "
+                                 f"usare reset per ricominciare")
+            LOGGER.info(f"Ripresa del crawl {params}: {counts}, {requeued} URL falliti rimessi in coda")
+        database_name = params["database_name"]
+        start_date, end_date = normalize_date_range(params["start_date"], params["end_date"])
+        ensure_indexes(database_name)
+
+        with crawl_session(**session_options):
+            while True:
+                entry = frontier.next_pending()
+                if entry is None:
+                    break
+                kind, entry_url, payload = entry
+                try:
+                    if kind == ROOT:
+                        _visit_root(frontier, entry_url)
+                    elif kind == SECTION:
+                        _visit_section(frontier, database_name, payload)
+                    else:
+                        _visit_discussion(database_name, payload, start_date, end_date)
+                except requests.exceptions.RequestException as e:
+                    logging.error(f"Errore nella visita di {entry_url}: {e}")
+                    frontier.mark_failed(entry_url, e)
+                    continue
+                except BaseException as e:
+                    frontier.record_error(entry_url, e)
+                    raise
+                frontier.mark_done(entry_url)
+
+        counts = frontier.counts()
+        LOGGER.info(f"Crawl completato: {counts}")
+        return counts
+    finally:
+        frontier.close()
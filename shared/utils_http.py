@@ -0,0 +1,320 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse, urlunparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+LOGGER = logging.getLogger("http")
+
+# Stati HTTP per cui ha senso ritentare la richiesta
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_BACKOFF_MAX = 30
+DEFAULT_BACKOFF_JITTER = 0.5
+
+# Limiti del rate limiter adattivo (richieste al secondo)
+DEFAULT_RATE = 4.0
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_MAX_RATE = 20.0
+# Latenza oltre la quale il server è considerato sotto carico
+DEFAULT_TARGET_LATENCY = 2.0
+
+
+def content_hash(body):
+    """Hash SHA-256 del contenuto di una pagina, usato per riconoscere le pagine invariate."""
+    return hashlib.sha256(body).hexdigest()
+
+
+def normalize_url(url):
+    """Normalizza l'URL rimuovendo differenze come / e //."""
+    parsed = urlparse(url)
+    normalized_path = parsed.path.replace("//", "/")
+    return urlunparse(parsed._replace(path=normalized_path))
+
+
+def backoff_delay(attempt, backoff_factor=DEFAULT_BACKOFF_FACTOR, backoff_max=DEFAULT_BACKOFF_MAX,
+                  backoff_jitter=DEFAULT_BACKOFF_JITTER):
+    """
+    Attesa (in secondi) prima del tentativo successivo: backoff esponenziale con jitter casuale,
+    con la stessa formula usata da urllib3 per le sessioni sincrone.
+
+    Args:
+        attempt (int): Numero del tentativo fallito (a partire da 1).
+    """
+    delay = backoff_factor * (2 ** (attempt - 1)) + random.uniform(0, backoff_jitter)
+    return min(delay, backoff_max)
+
+
+def retry_after_seconds(value):
+    """Valore dell'header Retry-After in secondi (solo nella forma numerica), o None."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket con velocità adattiva, condiviso da tutte le richieste di un crawl.
+
+    Ogni richiesta consuma un token; i token si ricaricano a `rate` al secondo fino a `burst`.
+    La velocità segue uno schema AIMD: cresce di `increase` a ogni risposta rapida, viene
+    dimezzata a ogni 429/503 (sospendendo le richieste per l'eventuale Retry-After) e ridotta
+    del 10% quando la latenza supera target_latency.
+
+    Args:
+        rate (float): Velocità iniziale, in richieste al secondo.
+        min_rate (float): Velocità minima.
+        max_rate (float): Velocità massima.
+        burst (int): Numero massimo di richieste consecutive senza attesa (default: max(1, rate)).
+        target_latency (float): Latenza, in secondi, oltre la quale rallentare.
+        increase (float): Incremento della velocità dopo ogni risposta rapida.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE, burst=None,
+                 target_latency=DEFAULT_TARGET_LATENCY, increase=0.1):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.capacity = burst or max(1, int(rate))
+        self.target_latency = target_latency
+        self.increase = increase
+        self.tokens = float(self.capacity)
+        self.throttled = 0
+        self.waited = 0.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Prenota un token e restituisce i secondi da attendere prima di usarlo."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= 1
+            delay = max(-self.tokens / self.rate if self.tokens < 0 else 0.0, self._paused_until - now)
+            self.waited += delay
+            return delay
+
+    def acquire(self):
+        """Attende (bloccando il thread) il proprio turno."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def observe(self, latency=None, status=None, retry_after=None):
+        """Aggiorna la velocità in base all'esito di una richiesta."""
+        with self._lock:
+            if status in (429, 503):
+                self.throttled += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+                if retry_after:
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                LOGGER.info(f"Risposta {status}: velocità ridotta a {self.rate:.2f} richieste/s")
+            elif latency is not None and latency > self.target_latency:
+                self.rate = max(self.min_rate, self.rate * 0.9)
+            elif status is not None and status < 400:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def stats(self):
+        return {"rate": round(self.rate, 2), "throttled": self.throttled, "waited_seconds": round(self.waited, 1)}
+
+
+class HttpTransport:
+    """
+    Sessione HTTP condivisa da tutte le richieste di un crawl.
+
+    Mantiene un pool di connessioni keep-alive, richiede risposte compresse (gzip) e ritenta
+    automaticamente, con backoff esponenziale e jitter, le richieste fallite per timeout,
+    errori di connessione o stati 5xx/429 (rispettando l'header Retry-After).
+
+    Args:
+        pool_size (int): Numero massimo di connessioni mantenute aperte per host.
+        max_retries (int): Numero massimo di tentativi aggiuntivi per ogni richiesta.
+        backoff_factor (float): Fattore del backoff esponenziale tra i tentativi.
+        backoff_max (float): Attesa massima tra due tentativi, in secondi.
+        backoff_jitter (float): Ampiezza massima del jitter casuale aggiunto all'attesa.
+        timeout (float): Timeout di ogni richiesta, in secondi.
+        headers (dict): Header inviati con ogni richiesta.
+        cache (ResponseCache): Cache su disco opzionale (vedi utils_cache); le pagine in cache
+            vengono rivalidate con GET condizionali (If-None-Match / If-Modified-Since).
+        archive (CrawlArchive): Archivio opzionale (vedi utils_archive). Se replay è False ogni pagina
+            scaricata viene registrata nell'archivio; se replay è True le pagine vengono lette solo
+            dall'archivio, senza alcun accesso alla rete.
+        replay (bool): Esegue il crawl a partire dall'archivio.
+        rate_limiter (AdaptiveRateLimiter): Limita (e adatta) la velocità delle richieste.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, backoff_max=DEFAULT_BACKOFF_MAX,
+                 backoff_jitter=DEFAULT_BACKOFF_JITTER, timeout=10, headers=None, cache=None, archive=None,
+                 replay=False, rate_limiter=None):
+        if replay and archive is None:
+            raise ValueError("La modalità replay richiede un archivio")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cache = cache
+        self.archive = archive
+        self.replay = replay
+        self.archive_stats = {"recorded": 0, "replayed": 0}
+        self.rate_limiter = rate_limiter
+        self._lock = threading.Lock()  # I contatori sono aggiornati anche da download paralleli
+        self.pages = 0
+        self.retries = 0
+        self.cache_stats = {"local": 0, "not_modified": 0, "unchanged": 0, "miss": 0}
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            backoff_factor=backoff_factor,
+            backoff_max=backoff_max,
+            backoff_jitter=backoff_jitter,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self.session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        if headers:
+            self.session.headers.update(headers)
+
+    def get(self, url, headers=None):
+        """
+        Esegue una GET tramite il pool. Solleva requests.exceptions.RequestException
+        se la richiesta fallisce anche dopo tutti i tentativi.
+        """
+        if self.rate_limiter is None:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        else:
+            response = self._limited_get(url, headers)
+        with self._lock:
+            self.pages += 1
+            if response.raw is not None and response.raw.retries is not None:
+                self.retries += len(response.raw.retries.history)
+        response.raise_for_status()
+        return response
+
+    def _limited_get(self, url, headers):
+        self.rate_limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            self.rate_limiter.observe(latency=time.monotonic() - started)
+            raise
+        # I tentativi ripetuti da urllib3 segnalano anch'essi un server sotto carico
+        if response.raw is not None and response.raw.retries is not None:
+            for attempt in response.raw.retries.history:
+                self.rate_limiter.observe(status=attempt.status)
+        self.rate_limiter.observe(time.monotonic() - started, response.status_code,
+                                  retry_after_seconds(response.headers.get("Retry-After")))
+        return response
+
+    def fetch(self, url):
+        """
+        Scarica una pagina e ne restituisce il contenuto (già decompresso) in byte.
+        Se è configurata una cache, la pagina viene letta in locale quando ancora fresca,
+        altrimenti rivalidata con una GET condizionale. In modalità replay la pagina viene letta
+        dall'archivio (RequestException se non è stata registrata).
+        """
+        if self.replay:
+            body = self.archive.get(url)
+            if body is None:
+                raise requests.exceptions.ConnectionError(f"{url} non presente nell'archivio {self.archive.path}")
+            self._count("replayed", self.archive_stats)
+            return body
+
+        body = self._fetch(url)
+        if self.archive is not None:
+            self.archive.append(url, body)
+            self._count("recorded", self.archive_stats)
+        return body
+
+    def _fetch(self, url):
+        if self.cache is None:
+            return self.get(url).content
+
+        entry = self.cache.get(url)
+        if entry is None:
+            self._count("miss")
+            response = self.get(url)
+            self.cache.put(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+            return response.content
+
+        if self.cache.is_fresh(entry):
+            self._count("local")
+            return entry.body
+
+        conditional_headers = {}
+        if entry.etag:
+            conditional_headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            conditional_headers["If-Modified-Since"] = entry.last_modified
+
+        response = self.get(url, headers=conditional_headers)
+        if response.status_code == 304:
+            self._count("not_modified")
+            self.cache.touch(url)
+            return entry.body
+
+        self._count("unchanged" if content_hash(response.content) == entry.content_hash else "miss")
+        self.cache.put(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.content
+
+    def _count(self, outcome, counters=None):
+        with self._lock:
+            (self.cache_stats if counters is None else counters)[outcome] += 1
+
+    def stats(self):
+        """
+        Statistiche di utilizzo della sessione.
+
+        Returns:
+            dict: pagine scaricate, richieste HTTP effettive (tentativi inclusi), connessioni aperte,
+            richieste servite su connessioni riutilizzate e tentativi ripetuti.
+        """
+        pools = self._adapter.poolmanager.pools
+        http_requests = 0
+        connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                http_requests += pool.num_requests
+                connections += pool.num_connections
+        return {
+            "pages": self.pages,
+            "http_requests": http_requests,
+            "connections": connections,
+            "reused_connections": max(http_requests - connections, 0),
+            "retries": self.retries,
+            "cache": dict(self.cache_stats) if self.cache is not None else None,
+            "archive": dict(self.archive_stats) if self.archive is not None else None,
+            "rate_limiter": self.rate_limiter.stats() if self.rate_limiter is not None else None,
+        }
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.archive is not None:
+            self.archive.close()
@@ -0,0 +1,250 @@
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+
+from shared.utils_http import content_hash
+from shared.utils_mongo import get_database
+from shared.utils_schema import ensure_indexes
+
+
+LOGGER = logging.getLogger("inference")
+
+# Da incrementare quando cambia l'elaborazione dei risultati dei modelli (reconstruct_word, merge_results, ...):
+# le voci salvate con la versione precedente non vengono più usate
+INFERENCE_CACHE_VERSION = 1
+
+DEFAULT_INFERENCE_CACHE_PATH = "inference_cache.sqlite"
+INFERENCE_CACHE_COLLECTION = "inference_cache"
+# Risultati tenuti in memoria (LRU) davanti alla cache persistente
+DEFAULT_MEMORY_ENTRIES = 10000
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Forma normalizzata del messaggio usata per la chiave (Unicode NFC, spazi consecutivi ridotti a uno)."""
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def model_fingerprint(engine):
+    """
+    Identifica modello e versione di una pipeline (o di un MarianTranslator): ID del modello, revisione
+    scaricata da Hugging Face Hub (o, in sua assenza, l'hash della configurazione) e parametri di
+    generazione. Cambia quando il modello viene aggiornato, invalidando i risultati in cache.
+    """
+    model = getattr(engine, "model", None)
+    config = getattr(model, "config", None)
+    if config is None:
+        return f"{type(engine).__module__}.{getattr(engine, '__qualname__', type(engine).__name__)}"
+    revision = getattr(config, "_commit_hash", None) or content_hash(config.to_json_string().encode("utf-8"))
+    fingerprint = f"{config.name_or_path}@{revision}"
+    options = getattr(engine, "generation_options", None)
+    if options:
+        fingerprint += json.dumps(options, sort_keys=True)
+    return fingerprint
+
+
+class SqliteInferenceStore:
+    """Risultati dei modelli salvati in un file SQLite locale."""
+
+    def __init__(self, path=DEFAULT_INFERENCE_CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                models TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_stage_models ON results (stage, models)")
+        self._conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):  # Limite dei parametri di una query SQLite
+                chunk = keys[start:start + 500]
+                query = f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(chunk))})"
+                found.update(self._conn.execute(query, chunk).fetchall())
+        return found
+
+    def put_many(self, stage, models, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                   [(key, stage, models, value, now) for key, value in items.items()])
+            self._conn.commit()
+
+    def purge(self, stage, models):
+        """Elimina i risultati della fase calcolati con modelli diversi da quelli indicati."""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM results WHERE stage = ? AND models != ?", (stage, models)).rowcount
+            self._conn.commit()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MongoInferenceStore:
+    """Risultati dei modelli salvati in una collezione MongoDB (condivisa tra macchine e processi)."""
+
+    def __init__(self, database_name=None, collection_name=INFERENCE_CACHE_COLLECTION):
+        self.collection = get_database(database_name)[collection_name]
+        ensure_indexes(database_name)
+
+    def get_many(self, keys):
+        return {doc["_id"]: doc["value"] for doc in self.collection.find({"_id": {"$in": list(keys)}}, {"value": 1})}
+
+    def put_many(self, stage, models, items):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.collection.bulk_write([
+            UpdateOne({"_id": key}, {"$setOnInsert": {"stage": stage, "models": models, "value": value, "created_at": now}},
+                      upsert=True)
+            for key, value in items.items()
+        ], ordered=False)
+
+    def purge(self, stage, models):
+        """Elimina i risultati della fase calcolati con modelli diversi da quelli indicati."""
+        return self.collection.delete_many({"stage": stage, "models": {"$ne": models}}).deleted_count
+
+    def close(self):
+        pass
+
+
+class InferenceCache:
+    """
+    Cache dei risultati dei modelli per testo, persistente (SQLite o MongoDB) con una LRU in memoria.
+
+    La chiave di un risultato è l'hash del testo normalizzato, della fase ("ner", "emotions") e
+    dell'impronta dei modelli che la eseguono (vedi model_fingerprint): aggiornando un modello le voci
+    della fase non vengono più trovate, e la prima volta che la fase viene usata con le nuove impronte
+    quelle calcolate con le versioni precedenti vengono eliminate dalla cache persistente.
+
+    Args:
+        store: SqliteInferenceStore o MongoInferenceStore.
+        memory_entries (int): Risultati tenuti in memoria (0 = nessuna LRU).
+    """
+
+    def __init__(self, store, memory_entries=DEFAULT_MEMORY_ENTRIES):
+        self.store = store
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        self._purged = set()
+        self.hits = {"memory": 0, "store": 0}
+        self.misses = 0
+
+    def _models(self, stage, engines):
+        fingerprints = []
+        for engine in engines:
+            entry = self._fingerprints.get(id(engine))
+            if entry is None or entry[0] is not engine:
+                entry = self._fingerprints[id(engine)] = (engine, model_fingerprint(engine))
+            fingerprints.append(entry[1])
+        models = "\x1f".join(fingerprints)
+        if (stage, models) not in self._purged:
+            self._purged.add((stage, models))
+            deleted = self.store.purge(stage, models)
+            if deleted:
+                LOGGER.info(f"Cache di inferenza: eliminati {deleted} risultati '{stage}' di modelli precedenti")
+        return models
+
+    def _remember(self, key, value):
+        if not self.memory_entries:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_or_compute(self, stage, engines, texts, compute):
+        """
+        Restituisce i risultati della fase per ogni testo, calcolando con compute solo quelli assenti
+        dalla cache (ogni testo distinto una sola volta) e salvandoli.
+
+        Args:
+            stage (str): Nome della fase.
+            engines (list): Pipeline usate dalla fase, per l'impronta dei modelli.
+            texts (list): Testi da analizzare.
+            compute (callable): Funzione che riceve la lista dei testi mancanti e restituisce i risultati.
+
+        Returns:
+            list: Un risultato per testo (una copia, che il chiamante può modificare).
+        """
+        with self._lock:
+            models = self._models(stage, engines)
+        prefix = f"{INFERENCE_CACHE_VERSION}\x1f{stage}\x1f{models}\x1f"
+        keys = [content_hash((prefix + normalize_text(text)).encode("utf-8")) for text in texts]
+
+        values = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    values[key] = self._memory[key]
+        memory_hits = sum(1 for key in keys if key in values)
+        missing = [key for key in dict.fromkeys(keys) if key not in values]
+        if missing:
+            values.update(self.store.get_many(missing))
+        store_hits = sum(1 for key in keys if key in values) - memory_hits
+
+        # Testi da calcolare: il primo di ogni chiave ancora mancante
+        to_compute = {}
+        for key, text in zip(keys, texts):
+            if key not in values:
+                to_compute.setdefault(key, text)
+        with self._lock:
+            self.hits["memory"] += memory_hits
+            self.hits["store"] += store_hits
+            self.misses += len(keys) - memory_hits - store_hits
+        if to_compute:
+            results = compute(list(to_compute.values()))
+            computed = {key: json.dumps(result, default=float) for key, result in zip(to_compute, results)}
+            self.store.put_many(stage, models, computed)
+            values.update(computed)
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                self._remember(key, values[key])
+        return [json.loads(values[key]) for key in keys]
+
+    def stats(self):
+        """Conteggi di risultati trovati in memoria, nella cache persistente e calcolati, con il tasso di successo."""
+        with self._lock:
+            hits = self.hits["memory"] + self.hits["store"]
+            total = hits + self.misses
+            return {"memory_hits": self.hits["memory"], "store_hits": self.hits["store"], "misses": self.misses,
+                    "hit_rate": hits / total if total else 0.0}
+
+    def close(self):
+        self.store.close()
+
+
+def open_inference_cache(path=DEFAULT_INFERENCE_CACHE_PATH, database_name=None, memory_entries=DEFAULT_MEMORY_ENTRIES):
+    """
+    Apre la cache di inferenza: nel database MongoDB indicato (collezione "inference_cache") se
+    database_name non è None, altrimenti nel file SQLite path.
+    """
+    if database_name is not None:
+        store = MongoInferenceStore(database_name)
+    else:
+        store = SqliteInferenceStore(path)
+    return InferenceCache(store, memory_entries)
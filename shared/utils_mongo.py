@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+
+LOGGER = logging.getLogger("mongo")
+
+load_dotenv()
+
+# Connessione di default, sovrascrivibile con le variabili d'ambiente (anche dal file .env)
+DEFAULT_MONGODB_URI = "mongodb://localhost:27017/?retryWrites=true&w=majority"
+DEFAULT_DATABASE = "analisi_centri"
+
+# Parametri del client: pool di connessioni, timeout (in millisecondi), read preference e write concern
+DEFAULT_CLIENT_OPTIONS = {
+    "maxPoolSize": 50,
+    "serverSelectionTimeoutMS": 30000,
+    "connectTimeoutMS": 20000,
+    "socketTimeoutMS": None,
+    "readPreference": "primary",
+    "w": "majority",
+}
+
+_settings = {
+    "uri": os.getenv("MONGODB_URI", DEFAULT_MONGODB_URI),
+    "database": os.getenv("MONGODB_DATABASE", DEFAULT_DATABASE),
+    "options": dict(DEFAULT_CLIENT_OPTIONS),
+}
+
+# Client del processo corrente (vedi get_client)
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def configure(uri=None, database=None, **options):
+    """
+    Modifica i parametri di connessione usati da get_client: URI, database di default e opzioni
+    di MongoClient (maxPoolSize, serverSelectionTimeoutMS, connectTimeoutMS, socketTimeoutMS,
+    readPreference, w, ...). Il client già aperto viene chiuso e ricreato al prossimo utilizzo.
+    """
+    global _client
+    with _lock:
+        if uri is not None:
+            _settings["uri"] = uri
+        if database is not None:
+            _settings["database"] = database
+        _settings["options"].update(options)
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+
+
+def get_client():
+    """
+    Restituisce il MongoClient del processo, creandolo al primo utilizzo: tutte le funzioni che
+    accedono al database condividono così lo stesso pool di connessioni. Un client non può essere
+    usato dopo una fork, quindi in un processo figlio (es. in un pool di processi) ne viene creato uno nuovo.
+    """
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            options = {k: v for k, v in _settings["options"].items() if v is not None}
+            _client = MongoClient(_settings["uri"], **options)
+            _client_pid = os.getpid()
+            LOGGER.debug(f"Nuovo client MongoDB (pid {_client_pid}, {options})")
+        return _client
+
+
+def get_database(database_name=None):
+    """Database indicato (default: MONGODB_DATABASE, "analisi_centri") sul client condiviso."""
+    return get_client()[database_name or _settings["database"]]
+
+
+def close_client():
+    """Chiude il client del processo corrente (ne verrà creato uno nuovo al prossimo utilizzo)."""
+    global _client
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+
+
+def _after_fork():
+    # Il client ereditato appartiene al processo padre: non va chiuso né usato nel figlio
+    global _client, _lock
+    _client = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,259 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import requests
+
+
+LOGGER = logging.getLogger("pipeline")
+
+DEFAULT_FETCH_WORKERS = 8
+# Pagine scaricate in attesa di essere analizzate (e elenchi completati in attesa di essere scritti)
+DEFAULT_QUEUE_SIZE = 32
+
+_DONE = object()
+
+
+def _timed_parse(parse, content, url):
+    """Eseguita nei processi del pool: analizza la pagina e misura il tempo impiegato."""
+    started = time.perf_counter()
+    result = parse(content, url)
+    return result, time.perf_counter() - started
+
+
+class StageMetrics:
+    """Contatori di uno stadio della pipeline (aggiornati da più thread)."""
+
+    def __init__(self):
+        self.items = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items=0, nbytes=0, busy=0.0, blocked=0.0):
+        with self._lock:
+            self.items += items
+            self.bytes += nbytes
+            self.busy += busy
+            self.blocked += blocked
+
+    def summary(self, elapsed):
+        """
+        Returns:
+            dict: elementi elaborati, elementi al secondo, tempo di lavoro, tempo passato bloccato in attesa
+            dello stadio successivo (backpressure) e byte elaborati.
+        """
+        return {
+            "items": self.items,
+            "items_per_second": round(self.items / elapsed, 2) if elapsed > 0 else 0.0,
+            "busy_seconds": round(self.busy, 3),
+            "blocked_seconds": round(self.blocked, 3),
+            "bytes": self.bytes,
+        }
+
+
+class PageTask:
+    """
+    Visita delle pagine di un elenco (le pagine di una discussione o di una sezione).
+
+    Args:
+        item: Oggetto a cui la visita si riferisce (es. il dizionario della discussione), restituito al chiamante.
+        plan: Generatore che produce liste di pagine da scaricare (vedi utils_scraper.post_pages_plan).
+        pages (dict): Risultati dell'analisi delle pagine, riempito dalla pipeline.
+        page_url (callable): Restituisce l'URL di una pagina dato il suo indice.
+        parse (callable): Funzione di modulo parse(content, url) eseguita nel pool di processi.
+        selected (list): Pagine che fanno parte del risultato, riempita dal piano.
+    """
+
+    def __init__(self, item, plan, pages, page_url, parse, selected=None):
+        self.item = item
+        self.plan = plan
+        self.pages = pages
+        self.page_url = page_url
+        self.parse = parse
+        self.selected = selected if selected is not None else []
+        self.error = None
+        self._waiting = set()
+
+
+class CrawlPipeline:
+    """
+    Pipeline a stadi per scaricare e analizzare le pagine del forum.
+
+    - download: un pool di thread scarica i byte delle pagine e li mette in una coda limitata;
+    - analisi: un pool di processi trasforma le pagine in dizionari (parse_post_page, parse_discussion_page);
+    - scrittura: gli elenchi completati vengono restituiti, tramite una seconda coda limitata, a chi itera
+      su run() (ad esempio il codice che li inserisce in MongoDB).
+
+    Le code limitate creano backpressure: se l'analisi o la scrittura rallentano, i download si fermano
+    invece di accumulare pagine in memoria. Il coordinamento (quali pagine scaricare) avviene in un thread
+    dedicato, che fa avanzare il piano di ogni PageTask man mano che le sue pagine vengono analizzate.
+
+    Args:
+        fetch (callable): Funzione fetch(url) -> bytes che solleva RequestException in caso di errore.
+        fetch_workers (int): Download contemporanei.
+        parse_workers (int): Processi di analisi (default: numero di CPU).
+        queue_size (int): Capienza delle code tra gli stadi.
+        max_active (int): Elenchi visitati contemporaneamente (default: 4 * fetch_workers).
+        initializer, initargs: Inizializzazione dei processi di analisi (es. scelta del parser HTML).
+    """
+
+    def __init__(self, fetch, fetch_workers=DEFAULT_FETCH_WORKERS, parse_workers=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_active=None, initializer=None, initargs=()):
+        self.fetch = fetch
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.max_active = max_active or 4 * fetch_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.metrics = {"fetch": StageMetrics(), "parse": StageMetrics(), "write": StageMetrics()}
+        self.elapsed = 0.0
+
+    def run(self, tasks):
+        """
+        Visita gli elenchi e restituisce (generatore) i PageTask completati, nell'ordine in cui terminano.
+        Un elenco la cui visita si è interrotta per un errore di download ha task.error valorizzato.
+        """
+        tasks = iter(tasks)
+        completed = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        started = time.perf_counter()
+        coordinator = threading.Thread(target=self._coordinate, args=(tasks, completed, stop), daemon=True)
+        coordinator.start()
+        try:
+            while True:
+                task = completed.get()
+                if task is _DONE:
+                    break
+                if isinstance(task, BaseException):
+                    raise task
+                write_started = time.perf_counter()
+                yield task
+                self.metrics["write"].add(items=1, busy=time.perf_counter() - write_started)
+        finally:
+            stop.set()
+            coordinator.join()
+            self.elapsed = time.perf_counter() - started
+            LOGGER.info(f"Pipeline completata in {self.elapsed:.1f}s: {self.stats()}")
+
+    def stats(self):
+        """Statistiche per stadio (vedi StageMetrics.summary)."""
+        return {name: metrics.summary(self.elapsed) for name, metrics in self.metrics.items()}
+
+    def _coordinate(self, tasks, completed, stop):
+        try:
+            self._loop(tasks, completed, stop)
+        except BaseException as e:
+            self._put(completed, e, stop)
+        else:
+            self._put(completed, _DONE, stop)
+
+    def _put(self, q, item, stop, metrics=None):
+        """Inserisce in una coda limitata, attendendo (backpressure) finché c'è posto o la pipeline viene fermata."""
+        started = time.perf_counter()
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        if metrics is not None:
+            metrics.add(blocked=time.perf_counter() - started)
+
+    def _loop(self, tasks, completed, stop):
+        fetched = queue.Queue(maxsize=self.queue_size)
+        fetch_metrics = self.metrics["fetch"]
+        parse_metrics = self.metrics["parse"]
+
+        def download(task, page):
+            url = task.page_url(page)
+            started = time.perf_counter()
+            try:
+                content, error = self.fetch(url), None
+            except requests.exceptions.RequestException as e:
+                content, error = None, e
+            fetch_metrics.add(items=1, nbytes=len(content or b""), busy=time.perf_counter() - started)
+            self._put(fetched, (task, page, url, content, error), stop, fetch_metrics)
+
+        active = set()
+        exhausted = False
+        parsing = {}
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as fetchers, \
+                ProcessPoolExecutor(max_workers=self.parse_workers, initializer=self.initializer,
+                                    initargs=self.initargs) as parsers:
+
+            def finish(task):
+                active.discard(task)
+                self._put(completed, task, stop)
+
+            def advance(task):
+                # Fa avanzare il piano finché non chiede pagine non ancora disponibili
+                while True:
+                    try:
+                        wanted = next(task.plan)
+                    except StopIteration:
+                        finish(task)
+                        return
+                    missing = [page for page in wanted if page not in task.pages]
+                    if missing:
+                        break
+                task._waiting = set(missing)
+                for page in missing:
+                    fetchers.submit(download, task, page)
+
+            def page_done(task, page):
+                task._waiting.discard(page)
+                if not task._waiting:
+                    if task.error is not None:
+                        finish(task)
+                    else:
+                        advance(task)
+
+            while not stop.is_set():
+                while not exhausted and len(active) < self.max_active:
+                    task = next(tasks, None)
+                    if task is None:
+                        exhausted = True
+                        break
+                    active.add(task)
+                    advance(task)
+
+                if exhausted and not active:
+                    return
+
+                for future in [future for future in parsing if future.done()]:
+                    task, page, url = parsing.pop(future)
+                    try:
+                        result, busy = future.result()
+                        task.pages[page] = result
+                        parse_metrics.add(items=1, busy=busy)
+                    except Exception as e:
+                        LOGGER.error(f"Errore nell'analisi della pagina {url}: {e}")
+                        task.error = e
+                    page_done(task, page)
+
+                # Al massimo due pagine in attesa per processo: il resto resta nella coda limitata
+                if len(parsing) >= 2 * self.parse_workers:
+                    wait(parsing, timeout=0.1, return_when=FIRST_COMPLETED)
+                    continue
+                try:
+                    task, page, url, content, error = fetched.get(timeout=0.01 if parsing else 0.1)
+                except queue.Empty:
+                    if parsing:
+                        wait(parsing, timeout=0.05, return_when=FIRST_COMPLETED)
+                    continue
+                if error is not None:
+                    LOGGER.error(f"Error downloading page {url}: {error}")
+                    task.error = error
+                    page_done(task, page)
+                else:
+                    parsing[parsers.submit(_timed_parse, task.parse, content, url)] = (task, page, url)
+
+            # Pipeline fermata da chi la consuma: i download in coda vengono scartati
+            fetchers.shutdown(wait=False, cancel_futures=True)
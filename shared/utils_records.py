@@ -0,0 +1,221 @@
+import bisect
+import datetime
+import logging
+import mmap
+import os
+import threading
+import zlib
+
+from bson import json_util
+from bson.json_util import JSONOptions, JSONMode
+
+
+LOGGER = logging.getLogger("records")
+
+# Record per blocco compresso: un'interruzione perde al più il blocco non ancora scritto
+DEFAULT_BLOCK_RECORDS = 256
+RECORDS_SUFFIX = ".jsonl.gz"
+
+# Ogni blocco è un membro gzip indipendente con un record JSON per riga: il file si legge anche
+# con zcat/gzip, e grazie all'indice dei blocchi un record si ritrova con un solo seek.
+_GZIP_WBITS = 31
+# JSON esteso di MongoDB: i datetime (posted_at, last_message_at) tornano datetime UTC
+_JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=True, tzinfo=datetime.timezone.utc)
+
+
+def _compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decode_block(data):
+    # Solo "\n" separa i record: splitlines dividerebbe anche su U+2028, \x85, \x1c... scritti nei messaggi
+    lines = zlib.decompressobj(_GZIP_WBITS).decompress(data).decode("utf-8").split("\n")
+    return [json_util.loads(line, json_options=_JSON_OPTIONS) for line in lines[:-1]]
+
+
+class RecordFile:
+    """
+    File di record (dizionari) in sola aggiunta, per salvare in locale l'output dello scraper.
+
+    I record vengono scritti in blocchi di block_records righe JSON, ciascuno compresso come membro
+    gzip separato e aggiunto in coda al file; accanto al file un indice testuale (<path>.idx) registra
+    per ogni blocco offset, lunghezza, posizione del primo record e numero di record, così che il
+    record i-esimo si legga decomprimendo un solo blocco. Come per CrawlArchive, un indice mancante o
+    indietro rispetto al file viene ricostruito, e un blocco finale incompleto (interruzione durante
+    la scrittura) viene scartato.
+
+    In lettura il file è mappato in memoria e i record si scorrono un blocco alla volta.
+
+    Args:
+        path (str): Percorso del file (es. "discussions.jsonl.gz").
+        mode (str): 'a' per aggiungere record (creando il file se necessario), 'r' per la sola lettura.
+        block_records (int): Record per blocco in scrittura.
+    """
+
+    def __init__(self, path, mode="r", block_records=DEFAULT_BLOCK_RECORDS):
+        if mode not in ("r", "a"):
+            raise ValueError(f"Modalità non supportata: {mode}")
+        if mode == "r" and not os.path.exists(path):
+            raise FileNotFoundError(path)
+        directory = os.path.dirname(path)
+        if mode == "a" and directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.index_path = path + ".idx"
+        self.mode = mode
+        self.block_records = block_records
+        self._lock = threading.Lock()
+        self._file = open(path, "ab+" if mode == "a" else "rb")
+        self._blocks = []  # (offset, lunghezza, primo record, numero di record)
+        self._starts = []  # Primo record di ogni blocco, per la ricerca binaria
+        self._buffer = []
+        self._cached = (None, None)  # Ultimo blocco decompresso: (indice, record)
+        self._load_index()
+        self._index_file = open(self.index_path, "a", encoding="utf-8") if mode == "a" else None
+        self._map = None
+        if mode == "r" and self._size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _add_block(self, offset, length, count):
+        first = self._starts[-1] + self._blocks[-1][3] if self._blocks else 0
+        self._blocks.append((offset, length, first, count))
+        self._starts.append(first)
+
+    def _load_index(self):
+        self._file.seek(0, os.SEEK_END)
+        self._size = self._file.tell()
+        indexed_until = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 4:
+                        continue  # Riga troncata da un'interruzione
+                    offset, length, count = int(parts[0]), int(parts[1]), int(parts[3])
+                    if offset != indexed_until or offset + length > self._size:
+                        break
+                    self._add_block(offset, length, count)
+                    indexed_until = offset + length
+        if indexed_until < self._size:
+            self._scan(indexed_until)
+
+    def _scan(self, offset):
+        """Ricostruisce l'indice dei blocchi a partire da offset, scartando un eventuale blocco finale incompleto."""
+        LOGGER.info(f"Ricostruzione dell'indice di {self.path} da offset {offset}")
+        self._file.seek(offset)
+        data = self._file.read(self._size - offset)
+        position = 0
+        while position < len(data):
+            decompressor = zlib.decompressobj(_GZIP_WBITS)
+            try:
+                block = decompressor.decompress(data[position:])
+            except zlib.error:
+                break
+            if not decompressor.eof:
+                break
+            length = len(data) - position - len(decompressor.unused_data)
+            self._add_block(offset + position, length, block.count(b"\n"))
+            position += length
+        if offset + position < self._size:
+            LOGGER.warning(f"{self.path}: {self._size - offset - position} byte finali incompleti ignorati")
+        if self.mode == "a":
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                for block in self._blocks:
+                    f.write(" ".join(map(str, block)) + "\n")
+            if offset + position < self._size:
+                self._file.truncate(offset + position)
+                self._size = offset + position
+
+    def __len__(self):
+        """Numero di record scritti (esclusi quelli ancora nel blocco in memoria)."""
+        return self._starts[-1] + self._blocks[-1][3] if self._blocks else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, record):
+        """Aggiunge un record; il blocco viene scritto su disco ogni block_records record."""
+        if self.mode != "a":
+            raise ValueError("File aperto in sola lettura")
+        self._buffer.append(json_util.dumps(record, json_options=_JSON_OPTIONS, ensure_ascii=False))
+        if len(self._buffer) >= self.block_records:
+            self.flush()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def flush(self):
+        """Scrive in coda al file il blocco dei record in memoria, e poi la sua voce nell'indice."""
+        if not self._buffer:
+            return
+        block = _compress(("\n".join(self._buffer) + "\n").encode("utf-8"))
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(block)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            # L'indice viene scritto dopo il blocco: un'interruzione lascia al più un blocco non indicizzato
+            self._add_block(offset, len(block), len(self._buffer))
+            self._index_file.write(" ".join(map(str, self._blocks[-1])) + "\n")
+            self._index_file.flush()
+            self._size = offset + len(block)
+        self._buffer.clear()
+
+    def _block_data(self, number):
+        offset, length, _, _ = self._blocks[number]
+        if self._map is not None:
+            return self._map[offset:offset + length]
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def _read_block(self, number):
+        cached_number, records = self._cached
+        if cached_number != number:
+            records = _decode_block(self._block_data(number))
+            self._cached = (number, records)
+        return records
+
+    def __getitem__(self, position):
+        """Record in posizione position (0 = primo record del file)."""
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        number = bisect.bisect_right(self._starts, position) - 1
+        return self._read_block(number)[position - self._starts[number]]
+
+    def records(self, start=0):
+        """Scorre i record a partire dalla posizione start, decomprimendo un blocco alla volta."""
+        if start >= len(self):
+            return
+        number = bisect.bisect_right(self._starts, start) - 1
+        skip = start - self._starts[number]
+        for number in range(number, len(self._blocks)):
+            yield from _decode_block(self._block_data(number))[skip:]
+            skip = 0
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        if self.mode == "a":
+            self.flush()
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+            if self._index_file is not None:
+                self._index_file.close()
+
+
+def read_records(path, start=0):
+    """Generatore dei record di un file salvato con RecordFile (o save_data_locally), dalla posizione start."""
+    with RecordFile(path) as records:
+        yield from records.records(start)
@@ -0,0 +1,163 @@
+import datetime
+import heapq
+import itertools
+import logging
+
+import requests
+
+from shared.utils_dates import parse_forum_datetime
+from shared.utils_http import DEFAULT_RATE
+from shared.utils_schema import ensure_indexes
+from shared.utils_scraper import (
+    BASE_URL,
+    crawl_session,
+    extract_sections,
+    fetch_page,
+    filter_valid_sections,
+    iter_posts,
+    iter_section_discussions,
+    normalize_date_range,
+    parse_count,
+    parse_html,
+    section_key,
+    store_discussion_posts,
+    store_forum_data,
+    unique_discussions,
+)
+
+
+LOGGER = logging.getLogger("scheduler")
+
+SECTION = "sezione"
+DISCUSSION = "discussione"
+
+# A parità di data, una sezione viene visitata prima delle discussioni (per scoprirne il contenuto)
+_KIND_RANK = {SECTION: 0, DISCUSSION: 1}
+_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def last_message_datetime(section):
+    """Data e ora (UTC) dell'ultimo messaggio di una sezione ('Last Message Date'/'Last Message Time'), o None."""
+    return parse_forum_datetime(section.get("Last Message Date"), section.get("Last Message Time"))
+
+
+def crawl_priority(kind, last_message, replies=None):
+    """
+    Chiave di ordinamento (crescente) di un elemento da visitare: prima l'attività più recente,
+    poi le sezioni rispetto alle discussioni, infine le discussioni con più risposte.
+    Elementi senza data vengono visitati per ultimi.
+    """
+    recency = (last_message - _EPOCH).total_seconds() if last_message else float("-inf")
+    return -recency, _KIND_RANK[kind], -(parse_count(replies) or 0)
+
+
+class CrawlScheduler:
+    """
+    Coda con priorità delle sezioni e delle discussioni da visitare (vedi crawl_priority).
+    Ogni discussione eredita la data dell'ultimo messaggio della sua sezione.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()  # A parità di priorità si mantiene l'ordine di inserimento
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push_section(self, section):
+        priority = crawl_priority(SECTION, last_message_datetime(section))
+        heapq.heappush(self._heap, (priority, next(self._counter), SECTION, section, None))
+
+    def push_discussion(self, discussione, section):
+        priority = crawl_priority(DISCUSSION, last_message_datetime(section), discussione.get("replies"))
+        heapq.heappush(self._heap, (priority, next(self._counter), DISCUSSION, discussione, section))
+
+    def pop(self):
+        """Restituisce (tipo, elemento, sezione di appartenenza) con la priorità più alta."""
+        _, _, kind, item, section = heapq.heappop(self._heap)
+        return kind, item, section
+
+
+def crawl_by_priority(database_name, start_date=None, end_date=None, url=BASE_URL, max_requests=None,
+                      rate_limit=DEFAULT_RATE, **session_options):
+    """
+    Crawl del forum guidato dall'attività: sezioni e discussioni vengono visitate a partire da quelle
+    con il messaggio più recente (e, tra le discussioni, con più risposte), con una velocità limitata
+    e adattata alle risposte del server (vedi AdaptiveRateLimiter). Con un budget di richieste i dati
+    più freschi vengono quindi salvati per primi.
+
+    Args:
+        database_name (str): Nome del database MongoDB.
+        start_date, end_date: Intervallo di date dei post (default come process_posts).
+        url (str): URL di partenza del forum.
+        max_requests (int): Numero massimo di pagine da scaricare (None = nessun limite). Il budget viene
+            controllato anche durante lo scaricamento dei post: una discussione interrotta torna in coda
+            (il limite può essere superato al più dal gruppo di pagine già richiesto).
+        rate_limit (float): Velocità iniziale in richieste al secondo.
+        **session_options: Parametri passati a crawl_session (cache_path, archive_path, ...).
+
+    Returns:
+        dict: sezioni, discussioni e post salvati, pagine scaricate ed elementi rimasti in coda.
+    """
+    start_date, end_date = normalize_date_range(start_date, end_date)
+    ensure_indexes(database_name)
+    scheduler = CrawlScheduler()
+    counts = {"sections": 0, "discussions": 0, "posts": 0}
+
+    def count_posts(posts, interrupted):
+        # Si ferma (senza scaricare altre pagine) appena il budget di richieste è esaurito
+        for post in posts:
+            counts["posts"] += 1
+            yield post
+            if budget_exhausted():
+                interrupted.append(True)
+                posts.close()
+                return
+
+    sezioni_viste = set()
+    discussioni_viste = set()
+
+    def discover_sections(link):
+        # Restituisce il contenuto della pagina, riusato per l'elenco delle discussioni della sezione
+        try:
+            content = fetch_page(link)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error downloading page {link}: {str(e)}")
+            return None
+        for section in filter_valid_sections(extract_sections(parse_html(content, only="sections"))):
+            if section_key(section) not in sezioni_viste:
+                sezioni_viste.add(section_key(section))
+                scheduler.push_section(section)
+        return content
+
+    with crawl_session(rate_limit=rate_limit, **session_options) as transport:
+        def budget_exhausted():
+            return max_requests is not None and transport.pages >= max_requests
+
+        discover_sections(url)
+        while scheduler:
+            if budget_exhausted():
+                LOGGER.info(f"Budget di {max_requests} richieste esaurito: {len(scheduler)} elementi non visitati")
+                break
+            kind, item, section = scheduler.pop()
+
+            if kind == SECTION:
+                first_page = discover_sections(item["Link"])
+                discussioni = list(unique_discussions(iter_section_discussions(item, first_page), discussioni_viste))
+                store_forum_data([item], discussioni, database_name)
+                counts["sections"] += 1
+                counts["discussions"] += len(discussioni)
+                for discussione in discussioni:
+                    scheduler.push_discussion(discussione, item)
+            else:
+                posts = iter_posts(item["link"], start_date, end_date, replies=item.get("replies"))
+                interrupted = []
+                store_discussion_posts([(item, count_posts(posts, interrupted))], database_name)
+                if interrupted:
+                    # I post già salvati non vengono duplicati quando la discussione viene ripresa
+                    scheduler.push_discussion(item, section)
+
+        counts["pages"] = transport.pages
+    counts["pending"] = len(scheduler)
+    logging.info(f"Crawl per priorità completato: {counts}")
+    return counts
@@ -0,0 +1,134 @@
+import datetime
+import logging
+import threading
+
+from pymongo import ASCENDING, IndexModel
+
+from shared.utils_mongo import get_database
+from shared.utils_storage import dedup_index_name, ensure_unique_index
+
+
+LOGGER = logging.getLogger("schema")
+
+# Chiavi di deduplicazione di ogni collezione, coperte da un indice univoco (vedi BulkWriter)
+DEDUP_KEYS = {
+    "sezioni": ["ID"],
+    "discussioni": ["title", "replies", "author"],
+    "post": ["_id"],  # _id derivato dal contenuto del post (vedi utils_scraper.post_id)
+    "autori": ["author"],
+}
+
+# Indici usati dalle query di analisi. L'indice composto multikey su ner.entity, ner.word e posted_at
+# serve {"ner.entity": ...} e {"ner": {"$elemMatch": {"entity": ..., "word": ...}}}, anche limitati a
+# un intervallo di date (vedi utils_dates.date_range_filter); posted_at da solo serve i filtri per data.
+INDEXES = {
+    "post": [
+        IndexModel([("ner.entity", ASCENDING), ("ner.word", ASCENDING), ("posted_at", ASCENDING)],
+                   name="ner_entity_word_posted_at"),
+        IndexModel([("posted_at", ASCENDING)], name="posted_at"),
+        # Post nuovi o modificati dall'ultima esportazione (vedi utils_columnar.export_posts)
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "sezioni": [
+        IndexModel([("last_message_at", ASCENDING)], name="last_message_at"),
+    ],
+    # Risultati di modelli non più in uso (vedi utils_inference.MongoInferenceStore.purge)
+    "inference_cache": [
+        IndexModel([("stage", ASCENDING), ("models", ASCENDING)], name="stage_models"),
+    ],
+}
+
+_EXAMPLE_RANGE = {"posted_at": {"$gte": datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+                                 "$lt": datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)}}
+
+# Forme delle query eseguite da utils_analysis, utils_scraper e utils_semantics, con valori di esempio:
+# (nome, collezione, filtro, scansione completa attesa)
+QUERY_SHAPES = [
+    ("analysis.get_top_entities", "post", {"ner.entity": "PER"}, False),
+    ("analysis.get_top_entities[date]", "post", {"ner.entity": "PER", **_EXAMPLE_RANGE}, False),
+    ("analysis.generate_combined_emotion_analysis_report", "post",
+     {"ner": {"$elemMatch": {"entity": "PER", "word": "esempio"}}}, False),
+    ("analysis.generate_combined_emotion_analysis_report[date]", "post",
+     {"ner": {"$elemMatch": {"entity": "PER", "word": "esempio"}}, **_EXAMPLE_RANGE}, False),
+    ("analysis.get_emotion_scores", "post", {"ner": {"$elemMatch": {"entity": "PER"}}}, False),
+    ("analysis.get_emotion_scores[date]", "post",
+     {"$and": [{"ner": {"$elemMatch": {"entity": "PER"}}}, _EXAMPLE_RANGE]}, False),
+    ("analysis.date_range", "post", _EXAMPLE_RANGE, False),
+    ("scraper.backfill_posted_at", "post", {"posted_at": {"$exists": False}}, False),
+    ("columnar.export_posts", "post", {"updated_at": {"$gte": _EXAMPLE_RANGE["posted_at"]["$gte"]}}, False),
+    ("scraper.dedup_sezioni", "sezioni", {"ID": "0"}, False),
+    ("scraper.dedup_discussioni", "discussioni", {"title": "esempio", "replies": "0", "author": "esempio"}, False),
+    ("scraper.dedup_post", "post", {"_id": "0" * 32}, False),
+    ("scraper.dedup_autori", "autori", {"author": "esempio"}, False),
+    ("scraper.migrate_post_ids", "post", {"_id": {"$type": "objectId"}}, False),
+    ("scraper.load_watermarks", "watermarks", {}, True),
+    ("semantics.recupera_autori", "autori", {}, True),
+    ("semantics.integra_database", "post", {}, True),
+    ("inference.purge", "inference_cache", {"stage": "ner", "models": {"$ne": "esempio"}}, False),
+]
+
+# Database i cui indici sono già stati verificati in questo processo
+_ensured = set()
+_ensured_lock = threading.Lock()
+
+
+def ensure_indexes(database_name=None):
+    """
+    Crea gli indici dichiarati in DEDUP_KEYS e INDEXES, se non esistono già. È idempotente e, per
+    ogni database, viene eseguita una sola volta per processo: può essere chiamata all'avvio di
+    ogni funzione che accede al database.
+
+    Returns:
+        list: Nomi degli indici verificati.
+    """
+    db = get_database(database_name)
+    with _ensured_lock:
+        if db.name in _ensured:
+            return []
+    names = []
+    for collection_name, keys in DEDUP_KEYS.items():
+        if ensure_unique_index(db[collection_name], keys):
+            names.append(f"{collection_name}.{dedup_index_name(keys)}")
+    for collection_name, indexes in INDEXES.items():
+        names.extend(f"{collection_name}.{name}" for name in db[collection_name].create_indexes(indexes))
+    with _ensured_lock:
+        _ensured.add(db.name)
+    LOGGER.info(f"Indici di {db.name}: {names}")
+    return names
+
+
+def plan_stages(plan):
+    """Tutti gli stadi (COLLSCAN, IXSCAN, FETCH, ...) di un piano restituito da explain()."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+def audit_queries(database_name=None, shapes=QUERY_SHAPES):
+    """
+    Esegue explain() su ogni forma di query in shapes e segnala quelle che ricorrono a una scansione
+    completa della collezione (COLLSCAN) quando non è attesa.
+
+    Returns:
+        list: Per ogni query un dizionario con nome, collezione, stadi del piano vincente,
+        'collscan' (True se il piano contiene COLLSCAN) e 'flagged' (COLLSCAN non atteso).
+    """
+    db = get_database(database_name)
+    report = []
+    for name, collection_name, filtro, expect_scan in shapes:
+        explain = db[collection_name].find(filtro).explain()
+        stages = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        collscan = "COLLSCAN" in stages
+        flagged = collscan and not expect_scan
+        if flagged:
+            LOGGER.warning(f"{name}: la query {filtro} su {collection_name} esegue una scansione completa (COLLSCAN)")
+        report.append({"name": name, "collection": collection_name, "stages": stages, "collscan": collscan,
+                       "flagged": flagged})
+    return report
@@ -1,14 +1,29 @@
 import datetime
+import hashlib
+import html
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import re
 import logging
 from emoji import demojize
 import emoji
-from pymongo import MongoClient
-from urllib.parse import urlparse, urlunparse
-import pickle
+from pymongo import UpdateOne
+from urllib.parse import parse_qs, urlparse
+
+from shared.utils_archive import CrawlArchive
+from shared.utils_cache import DEFAULT_CACHE_MAX_BYTES, ResponseCache
+from shared.utils_dates import parse_forum_datetime
+from shared.utils_http import AdaptiveRateLimiter, HttpTransport, normalize_url
+from shared.utils_mongo import get_database
+from shared.utils_pipeline import CrawlPipeline, PageTask
+from shared.utils_records import RECORDS_SUFFIX, RecordFile, read_records
+from shared.utils_schema import DEDUP_KEYS, ensure_indexes
+from shared.utils_storage import DEFAULT_BULK_SIZE, BulkWriter
 
 
 LOGGER = logging.getLogger("scraper")
@@ -20,23 +35,155 @@ HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.105 Safari/537.36'
 }
 
-# MongoDB Connection Details (replace placeholders)
-MONGODB_URI = "mongodb://localhost:27017?retryWrites=true&w=majority"
+# Collezione con i watermark di sezioni e discussioni per il crawl incrementale
+WATERMARK_COLLECTION = "watermarks"
+# Post tenuti in memoria prima di essere scritti nel database (vedi store_discussion_posts)
+POST_BATCH_SIZE = 200
+
+# Sessione HTTP del crawl corrente (vedi crawl_session)
+_transport = None
+
+
+def get_transport():
+    """Restituisce la sessione HTTP condivisa, creandone una con i parametri di default se necessario."""
+    global _transport
+    if _transport is None:
+        _transport = HttpTransport(headers=HEADERS)
+    return _transport
+
+
+@contextmanager
+def crawl_session(cache_path=None, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES, cache_max_age=0, archive_path=None,
+                  replay=False, rate_limit=None, **transport_options):
+    """
+    Apre una sessione HTTP condivisa (pool di connessioni, keep-alive, retry con backoff)
+    per tutte le richieste eseguite all'interno del blocco, e la chiude al termine
+    registrando le statistiche di utilizzo. Se una sessione è già aperta viene riutilizzata: gli altri
+    parametri vengono ignorati, tranne rate_limit, il cui limite viene applicato alla sessione per la
+    durata del blocco se questa non ne ha già uno (altrimenti resta quello esistente, con un avviso).
+
+    Args:
+        cache_path (str): Se indicato, le risposte vengono salvate in una cache su disco in questo file
+            e rivalidate con GET condizionali nei crawl successivi.
+        cache_max_bytes (int): Budget della cache su disco, oltre il quale si eliminano le voci meno usate.
+        cache_max_age (float): Secondi entro cui una pagina in cache viene riletta senza rivalidarla.
+        archive_path (str): Se indicato, ogni pagina scaricata viene registrata in questo archivio
+            (vedi utils_archive.CrawlArchive).
+        replay (bool): Se True le pagine vengono lette solo dall'archivio archive_path, senza accedere alla rete.
+        rate_limit (float): Se indicato, velocità iniziale (richieste al secondo) di un AdaptiveRateLimiter
+            che rallenta il crawl in caso di risposte 429/503 o latenze elevate.
+        **transport_options: Parametri di HttpTransport (pool_size, max_retries, backoff_factor, timeout, ...).
+    """
+    global _transport
+    if _transport is not None:
+        attached = None
+        if rate_limit and not _transport.replay:
+            if _transport.rate_limiter is None:
+                attached = _transport.rate_limiter = AdaptiveRateLimiter(rate=rate_limit)
+            else:
+                logging.warning(f"Sessione già aperta con un limite di velocità: rate_limit={rate_limit} ignorato")
+        try:
+            yield _transport
+        finally:
+            if attached is not None:
+                logging.info(f"Limite di velocità della sessione: {attached.stats()}")
+                _transport.rate_limiter = None
+        return
+
+    if replay and not archive_path:
+        raise ValueError("La modalità replay richiede archive_path")
+    cache = ResponseCache(cache_path, cache_max_bytes, cache_max_age) if cache_path and not replay else None
+    archive = CrawlArchive(archive_path, "r" if replay else "a") if archive_path else None
+    if rate_limit and not replay:
+        transport_options.setdefault("rate_limiter", AdaptiveRateLimiter(rate=rate_limit))
+    _transport = HttpTransport(headers=HEADERS, cache=cache, archive=archive, replay=replay, **transport_options)
+    try:
+        yield _transport
+    finally:
+        logging.info(f"Statistiche connessioni: {_transport.stats()}")
+        _transport.close()
+        _transport = None
+
+
+def fetch_page(url):
+    """Scarica una pagina tramite la sessione condivisa. Solleva RequestException in caso di errore."""
+    return get_transport().fetch(url)
+
+
+def fetch_pages(urls, max_workers=None):
+    """
+    Scarica in parallelo un elenco di pagine tramite la sessione condivisa.
+
+    Args:
+        urls (list): URL da scaricare.
+        max_workers (int): Numero di download contemporanei (default: dimensione del pool di connessioni).
+
+    Returns:
+        list: Contenuti delle pagine nello stesso ordine degli URL (None per le pagine non scaricate).
+    """
+    transport = get_transport()
+
+    def fetch(url):
+        try:
+            return transport.fetch(url)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error downloading page {url}: {str(e)}")
+            return None
+
+    if len(urls) <= 1:
+        return [fetch(url) for url in urls]
+    with ThreadPoolExecutor(max_workers=max_workers or transport.pool_size) as executor:
+        return list(executor.map(fetch, urls))
+
+
+def last_page_from_pagination(content, url, page_size):
+    """
+    Ricava l'indice dell'ultima pagina (a partire da 0) di una discussione o di una sezione
+    dai link di paginazione (&st=) presenti nella pagina che puntano allo stesso topic/forum.
+
+    Returns:
+        int: Indice dell'ultima pagina, oppure None se la pagina non contiene link di paginazione.
+    """
+    query = parse_qs(urlparse(url).query)
+    id_key = next((key for key in ("t", "f") if key in query), None)
+    if id_key is None:
+        return None
+
+    offsets = []
+    for href in re.findall(rb'href="([^"]*st=\d+[^"]*)"', content):
+        link_query = parse_qs(urlparse(html.unescape(href.decode("utf-8", "replace"))).query)
+        if link_query.get(id_key) == query[id_key] and link_query.get("st", [""])[0].isdigit():
+            offsets.append(int(link_query["st"][0]))
+    if not offsets:
+        return None
+    return max(offsets) // page_size
+
+
+def open_local_export(base_filename):
+    """
+    Apre in aggiunta un nuovo file di record locale (vedi utils_records.RecordFile) con nome
+    <base_filename>_YYYY-MM-DD_HH-MM-SS.jsonl.gz, in cui salvare i record man mano che vengono trovati.
+    """
+    current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    return RecordFile(f"{base_filename}_{current_time}{RECORDS_SUFFIX}", mode="a")
 
 
 def save_data_locally(data, base_filename):
+    """
+    Salva i record (sezioni o discussioni) in un nuovo file locale (vedi open_local_export), leggibile
+    con read_records o passando il percorso a process_posts.
+
+    Returns:
+        str: Percorso del file, o None in caso di errore.
+    """
     try:
-        # Ottieni la data e l'ora attuali nel formato desiderato (YYYY-MM-DD_HH-MM-SS)
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        # Crea il nome del file con il suffisso "_data_odiena"
-        filename = f"{base_filename}_{current_time}.pkl"
-
-        # Salva i dati nel file
-        with open(filename, 'wb') as f:
-            pickle.dump(data, f)
-        logging.info(f"Dati salvati correttamente in {filename}")
+        with open_local_export(base_filename) as records:
+            records.extend(data)
+        logging.info(f"Dati salvati correttamente in {records.path}")
+        return records.path
     except Exception as e:
         logging.error(f"Si è verificato un errore durante il salvataggio dei dati: {e}")
+        return None
 
 
 def extract_emoji_positions(text):
@@ -46,12 +193,6 @@ def extract_emoji_positions(text):
             emojis_with_positions.append({'emoji': char, 'pos': pos})
     return emojis_with_positions
 
-def normalize_url(url):
-    """Normalizza l'URL rimuovendo differenze come / e //."""
-    parsed = urlparse(url)
-    normalized_path = parsed.path.replace("//", "/")
-    return urlunparse(parsed._replace(path=normalized_path))
-
 def remove_after_pm_email(text):
     keyword = "PM Email"
     idx = text.find(keyword)
@@ -60,6 +201,45 @@ def remove_after_pm_email(text):
     return text
 
 
+# Parser usato da BeautifulSoup: 'html.parser' (predefinito, nessuna dipendenza) o 'lxml' (più veloce)
+HTML_PARSER = 'html.parser'
+
+# Sottoalberi necessari a ciascun tipo di pagina: il resto del documento non viene costruito
+PARSE_ONLY = {
+    "posts": SoupStrainer('li', class_='post'),
+    "discussions": SoupStrainer(['ol', 'link']),  # ol.big_list e link canonico per la paginazione
+    "sections": SoupStrainer('li', class_='off'),
+}
+
+
+def set_html_parser(parser):
+    """
+    Seleziona il parser HTML usato da parse_html ('html.parser' o 'lxml').
+    Se lxml non è installato si resta su 'html.parser'.
+    """
+    global HTML_PARSER
+    if parser == 'lxml':
+        try:
+            import lxml  # noqa: F401
+        except ImportError:
+            logging.warning("lxml non è installato: si usa 'html.parser'")
+            parser = 'html.parser'
+    elif parser != 'html.parser':
+        raise ValueError(f"Parser HTML '{parser}' non supportato.")
+    HTML_PARSER = parser
+
+
+def parse_html(content, only=None):
+    """
+    Costruisce il soup di una pagina a partire dai byte scaricati.
+    :param content: contenuto della pagina
+    :param only: chiave di PARSE_ONLY ('posts', 'discussions', 'sections') per costruire solo i sottoalberi
+        necessari, oppure None per l'intera pagina
+    """
+    parse_only = PARSE_ONLY[only] if only else None
+    return BeautifulSoup(content, HTML_PARSER, parse_only=parse_only)
+
+
 def extract_post(post):
     """
     Extract a post as dictionary from a post div available in a discussion.
@@ -113,6 +293,7 @@ def extract_post(post):
                         'quote_author': quote_author,
                         'quote_date': quote_date,
                         'quote_time': quote_time,
+                        'posted_at': parse_forum_datetime(quote_date, quote_time),
                         'quote_href': quote_href,
                         'quote_content': quote_cleaned
                     }
@@ -131,6 +312,7 @@ def extract_post(post):
             'author': author,
             'date': date,
             'time': time,
+            'posted_at': parse_forum_datetime(date, time),  # UTC, per i filtri per data in MongoDB
             'message': message_cleaned,
         }
 
@@ -157,76 +339,308 @@ def extract_discussion_title(url):
     :return:
     """
     try:
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        response.raise_for_status()
+        content = fetch_page(url)
     except requests.exceptions.RequestException as e:
         logging.error(f"Error downloading page {url}: {e}")
         return None
 
-    soup = BeautifulSoup(response.content, 'html.parser')
+    soup = parse_html(content)
     discussion_text = soup.find('body').find("table").find("h1").text.strip()
     return discussion_text
 
 
-def extract_posts(url: str, start_date: datetime, end_date: datetime):
+def filter_posts_by_date(post_dicts, start_date, end_date):
+    """Mantiene solo i post con data compresa tra start_date e end_date (estremi inclusi)."""
+    paginated_posts = []
+
+    for post_dict in post_dicts:
+        if post_dict and "date" in post_dict:
+            try:
+                # Converte la data del post in un oggetto datetime
+                post_date = datetime.datetime.strptime(post_dict["date"], "%d/%m/%Y")
+                # Controlla se la data del post è tra start_date e end_date
+                if start_date <= post_date <= end_date:
+                    paginated_posts.append(post_dict)
+            except ValueError:
+                logging.warning(f"Invalid date format for post: {post_dict['date']}")
+                continue  # Ignora i post con data non valida
+
+    return paginated_posts
+
+
+def extract_posts_from_soup(soup, start_date, end_date):
     """
-    Given a URL to a discussion this function extracts all the posts for that discussion.
-    The function can deal with pagination, iterating pages until at least one post is returned.
-    :param url: URL to the forum discussion
+    Estrae i post di una singola pagina di discussione, filtrandoli per data.
+    :param soup: pagina della discussione già parsata
     :param start_date: Start date to filter posts
     :param end_date: End date to filter posts
-    :return: A list of posts filtered by date
+    :return: tupla (post filtrati, numero di post presenti nella pagina)
     """
-    posts = []
-    page = 0
+    post_divs = soup.find_all('li', class_='post')
+    post_dicts = [extract_post(post=post) for post in post_divs]
+    return filter_posts_by_date(post_dicts, start_date, end_date), len(post_divs)
+
+
+def post_datetime(post_dict):
+    """Data del post come datetime (a mezzanotte), o None se assente o non valida."""
+    try:
+        return datetime.datetime.strptime(post_dict["date"], "%d/%m/%Y")
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
+def page_signature(post_dicts):
+    """Identifica il contenuto di una pagina tramite il suo primo post."""
+    first = next((post for post in post_dicts if post), None)
+    if first is None:
+        return None
+    return first.get("author"), first.get("date"), first.get("time"), first.get("message")
+
+
+def parse_post_page(content, url):
+    """
+    Analizza una pagina di una discussione.
+    Funzione di modulo (e non annidata) così da poter essere eseguita in un processo separato (vedi utils_pipeline).
+
+    Returns:
+        tuple: (post estratti, numero di post nella pagina, ultima pagina indicata dalla paginazione o None)
+    """
+    post_divs = parse_html(content, only="posts").find_all('li', class_='post')
+    if not post_divs:
+        logging.warning(f"No posts found on page {url}")
+    return [extract_post(post=post) for post in post_divs], len(post_divs), last_page_from_pagination(content, url, 15)
+
+
+def run_page_plan(plan, pages, page_url, parse):
+    """
+    Esegue in questo thread il piano di visita di un elenco di pagine: scarica (in parallelo se più d'una)
+    e analizza le pagine richieste dal piano, salvandole in pages, finché il piano non termina.
+    Generatore: restituisce il controllo dopo ogni gruppo di pagine, così che il chiamante possa
+    emettere subito i risultati già disponibili. Solleva RequestException se una pagina non può essere scaricata.
+    """
+    for wanted in plan:
+        urls = [page_url(page) for page in wanted]
+        contents = [fetch_page(urls[0])] if len(urls) == 1 else fetch_pages(urls)
+        for page, download_url, content in zip(wanted, urls, contents):
+            if content is None:
+                raise requests.exceptions.RequestException(f"page {download_url} not downloaded")
+            pages[page] = parse(content, download_url)
+        yield wanted
+
+
+def post_pages_plan(pages, selected, start_date, end_date, start_page=0, replies=None, stats=None):
+    """
+    Piano di visita delle pagine di una discussione (generatore).
+
+    Produce liste di pagine da scaricare; chi esegue il piano (run_page_plan o la pipeline di utils_pipeline)
+    salva in pages[page] il risultato di parse_post_page e riprende il generatore. Le pagine i cui post fanno
+    parte del risultato vengono aggiunte, in ordine, a selected.
+
+    Il numero di pagine viene letto dai link di paginazione della prima pagina scaricata (o, se mancano,
+    stimato dal numero di risposte; una stima oltre la fine della discussione viene ridotta). Poiché i post sono in ordine cronologico, la prima pagina a partire da
+    start_date e l'ultima prima di end_date vengono individuate per bisezione e l'intervallo tra le due viene
+    richiesto in un'unica volta. Se il numero di pagine non è noto si procede una pagina alla volta,
+    fermandosi al primo post successivo a end_date.
+    """
+    if stats is None:
+        stats = {}
+    stats.update({"pages_skipped": 0, "stopped_early": False})
+
+    def load(page):
+        # Ogni pagina viene scaricata e analizzata una sola volta
+        if page not in pages:
+            yield [page]
+        return pages[page]
+
+    def past_end(page):
+        # Oltre l'ultima pagina il forum può restituire di nuovo l'ultima pagina: una pagina identica a una
+        # pagina precedente già scaricata indica che si è andati oltre la fine. Il confronto è solo con le
+        # pagine precedenti: la copia può essere stata scaricata prima dell'ultima pagina vera
+        signature = page_signature((yield from load(page))[0])
+        return signature is not None and any(
+            other < page and page_signature(result[0]) == signature for other, result in pages.items()
+        )
+
+    def valid_dates(page):
+        dates = [post_datetime(post) for post in (yield from load(page))[0] if post]
+        return [date for date in dates if date is not None]
+
+    def reaches_start(page):
+        # True se la pagina contiene post a partire da start_date, o se è l'ultima pagina
+        if (yield from load(page))[1] < 15:
+            return True
+        dates = yield from valid_dates(page)
+        if dates and dates[-1] >= start_date:
+            return True
+        return (yield from past_end(page))
+
+    def after_end(page):
+        # True se la pagina inizia dopo end_date
+        dates = yield from valid_dates(page)
+        return bool(dates) and dates[0] > end_date
+
+    def first_true(lo, hi, predicate):
+        # Bisezione: il più piccolo indice in [lo, hi] per cui predicate è vero, sapendo che predicate(hi) è vero
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (yield from predicate(mid)):
+                hi = mid
+            else:
+                lo = mid + 1
+        return hi
+
+    def ends_in(page):
+        return any(date > end_date for date in (yield from valid_dates(page)))
+
+    def signature_of(page):
+        return page_signature((yield from load(page))[0])
+
+    def shrink_estimate(lo, hi):
+        # La pagina hi, stimata, può essere una copia dell'ultima pagina: se coincide con la precedente,
+        # l'ultima pagina vera è la prima (in [lo, hi]) identica a hi, individuata per bisezione
+        signature = yield from signature_of(hi)
+        if signature is None or (yield from signature_of(hi - 1)) != signature:
+            return hi
+
+        def same_as_estimate(page):
+            return (yield from signature_of(page)) == signature
+        return (yield from first_true(lo, hi - 1, same_as_estimate))
+
+    yield from load(start_page)
+    last_page = pages[start_page][2]
+    estimated = False
+    if last_page is None and parse_count(replies) is not None:
+        # Nessun link di paginazione: stima dal numero di risposte (i post sono risposte + 1)
+        last_page = parse_count(replies) // 15
+        estimated = True
+    if last_page is not None and last_page < start_page:
+        last_page = None
+    if estimated and last_page is not None and last_page > start_page:
+        # La stima è solo indicativa (risposte non aggiornate o sovrastimate): se va oltre la fine si riduce
+        last_page = yield from shrink_estimate(start_page, last_page)
+
+    # Ricerca della prima pagina utile: bisezione fino all'ultima pagina nota, oppure salti esponenziali
+    page = start_page
+    if not (yield from reaches_start(start_page)):
+        lo = start_page
+        if last_page is not None and last_page > start_page and (yield from reaches_start(last_page)):
+            page = yield from first_true(lo + 1, last_page, reaches_start)
+        else:
+            if last_page is not None and last_page > start_page:
+                lo = last_page
+            step = 1
+            while not (yield from reaches_start(lo + step)):
+                lo, step = lo + step, step * 2
+            page = yield from first_true(lo + 1, lo + step, reaches_start)
+    stats["pages_skipped"] = sum(1 for skipped in range(start_page, page) if skipped not in pages)
+
+    if last_page is not None and page <= last_page:
+        # Numero di pagine noto: individua l'ultima pagina utile e richiede l'intervallo in un'unica volta
+        end = last_page + 1
+        if (yield from ends_in(page)):
+            # La finestra termina già nella prima pagina utile
+            end = page + 1
+            stats["stopped_early"] = page < last_page
+        elif (yield from after_end(last_page)):
+            end = yield from first_true(page + 1, last_page, after_end)
+            stats["stopped_early"] = True
+        missing = [current for current in range(page, end) if current not in pages]
+        if missing:
+            yield missing
+        for current in range(page, end):
+            if current > start_page and (yield from past_end(current)):
+                return
+            selected.append(current)
+        if end <= last_page or pages[last_page][1] < 15 or (yield from ends_in(last_page)):
+            stats["stopped_early"] = stats["stopped_early"] or end <= last_page
+            return
+        # L'ultima pagina è piena: il conteggio potrebbe essere superato, si prosegue in sequenza
+        page = end
+
     while True:
-        paginated_url = f"{url}&st={page * 15}"
-        try:
-            response = requests.get(paginated_url, headers=HEADERS, timeout=10)  # Add timeout for robustness
-            response.raise_for_status()  # Raise exception for bad responses
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error downloading page {url}: {e}")
-            break
-
-        soup = BeautifulSoup(response.content, 'html.parser')
-        post_divs = soup.find_all('li', class_='post')
-
-        if not post_divs:
-            logging.warning(f"No posts found on page {url}")
-
-        paginated_posts = []
-
-        for post in post_divs:
-            post_dict = extract_post(post=post)
-            if post_dict and "date" in post_dict:
-                try:
-                    # Converte la data del post in un oggetto datetime
-                    post_date = datetime.datetime.strptime(post_dict["date"], "%d/%m/%Y")
-                    # Controlla se la data del post è tra start_date e end_date
-                    if start_date <= post_date <= end_date:
-                        paginated_posts.append(post_dict)
-                except ValueError:
-                    logging.warning(f"Invalid date format for post: {post_dict['date']}")
-                    continue  # Ignora i post con data non valida
-
-        # Aggiungi i post filtrati alla lista finale
-        if paginated_posts:
-            posts.extend(paginated_posts)
+        if page > start_page and (yield from past_end(page)):
+            return
+        _, num_post_divs, _ = yield from load(page)
+        selected.append(page)
+
+        # I post sono in ordine cronologico: oltre end_date non serve proseguire
+        if (yield from ends_in(page)):
+            stats["stopped_early"] = True
+            return
 
         # Se non ci sono più post da paginare, interrompi
-        if len(post_divs) < 15:  # Se il numero di post sulla pagina è inferiore a 15, probabilmente siamo all'ultima pagina
-            break
+        if num_post_divs < 15:  # Se il numero di post sulla pagina è inferiore a 15, probabilmente siamo all'ultima pagina
+            return
 
         page += 1
 
+
+def post_page_url(url, page):
+    return f"{url}&st={page * 15}"
+
+
+def selected_posts(pages, selected, start_date, end_date):
+    """Post delle pagine selezionate da post_pages_plan, filtrati per data."""
+    posts = []
+    for page in selected:
+        posts.extend(filter_posts_by_date(pages[page][0], start_date, end_date))
     return posts
 
 
-def download_and_parse(url):
+def iter_posts(url: str, start_date: datetime, end_date: datetime, start_page: int = 0, stats: dict = None,
+               replies=None):
+    """
+    Versione a generatore di extract_posts: restituisce i post filtrati per data pagina per pagina,
+    man mano che vengono scaricati (stessi parametri e stesse statistiche di extract_posts).
+    """
+    if stats is None:
+        stats = {}
+    stats["truncated"] = False
+    pages = {}
+    selected = []
+    emitted = 0
+    plan = post_pages_plan(pages, selected, start_date, end_date, start_page, replies, stats)
+    try:
+        for _ in run_page_plan(plan, pages, partial(post_page_url, url), parse_post_page):  # Retry e backoff gestiti dalla sessione condivisa
+            yield from selected_posts(pages, selected[emitted:], start_date, end_date)
+            emitted = len(selected)
+        yield from selected_posts(pages, selected[emitted:], start_date, end_date)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error downloading page of {url} after retries, discussion truncated: {e}")
+        stats["truncated"] = True
+        yield from selected_posts(pages, selected[emitted:], start_date, end_date)
+    finally:
+        stats["pages"] = len(pages)
+        if stats["pages_skipped"]:
+            logging.info(f"{url}: {stats['pages_skipped']} pagine saltate prima di {start_date:%d/%m/%Y}")
+
+
+def extract_posts(url: str, start_date: datetime, end_date: datetime, start_page: int = 0, stats: dict = None,
+                  replies=None):
+    """
+    Given a URL to a discussion this function extracts all the posts for that discussion.
+    The function can deal with pagination, iterating pages until at least one post is returned.
+
+    Pages are chosen by post_pages_plan: pages entirely outside the date window are never downloaded,
+    and when the number of pages is known the pages of the window are downloaded in parallel.
+    :param url: URL to the forum discussion
+    :param start_date: Start date to filter posts
+    :param end_date: End date to filter posts
+    :param start_page: First page to consider (pages before it are skipped)
+    :param stats: Optional dict filled with 'pages' (pages downloaded), 'pages_skipped' (pages before the
+        window never downloaded), 'stopped_early' (stopped at a post after end_date) and 'truncated'
+        (download failed midway)
+    :param replies: Replies count of the discussion (as returned by extract_discussions), used when the
+        page has no pagination links
+    :return: A list of posts filtered by date
+    """
+    return list(iter_posts(url, start_date, end_date, start_page, stats, replies))
+
+
+def download_and_parse(url, only=None):
     try:
-        response = requests.get(url, headers=HEADERS, timeout=10)  # Timeout added for robustness
-        response.raise_for_status()  # Raise exception for bad responses
-        soup = BeautifulSoup(response.content, 'html.parser')
+        content = fetch_page(url)  # Retry e backoff gestiti dalla sessione condivisa
+        soup = parse_html(content, only)
         return soup
     except requests.exceptions.RequestException as e:
         logging.error(f"Error downloading page {url}: {str(e)}")
@@ -279,6 +693,7 @@ def extract_sections(soup):
                     "Number of Replies": replies_count,
                     "Last Message Date": last_post_date,
                     "Last Message Time": last_post_time,
+                    "last_message_at": parse_forum_datetime(last_post_date, last_post_time),
                     "Link": link,
                     "Is Private": is_private
                 })
@@ -287,8 +702,34 @@ def extract_sections(soup):
 
     return sections
 
+
+def filter_valid_sections(sections):
+    """Rimuove le sezioni con 'Number of Discussions': 'N/A' (annunci, link esterni, ecc.)."""
+    return [
+        section for section in sections
+        if section.get('Number of Discussions') != 'N/A'
+    ]
+
+
+def parse_section_page(content, url):
+    """
+    Analizza una pagina dell'elenco delle sottosezioni di una sezione, nello stesso formato di
+    parse_discussion_page così da poter usare discussion_pages_plan.
+
+    Returns:
+        tuple: (sezioni estratte, True se la pagina è oltre l'ultima, ultima pagina indicata dalla paginazione o None)
+    """
+    soup = parse_html(content)
+    past_last_page = "st" in parse_qs(urlparse(url).query) and is_past_last_page(soup, url)
+    return extract_sections(soup), past_last_page, last_page_from_pagination(content, url, 30)
+
+
 def extract_sections_paginated(url):
-    """Estrae le sezioni iterando su eventuali pagine, con gestione speciale per BASE_URL."""
+    """
+    Estrae le sezioni iterando su eventuali pagine, con gestione speciale per BASE_URL.
+    Le pagine (30 elementi ciascuna, come l'elenco delle discussioni) vengono ricavate dalla paginazione
+    della prima pagina e scaricate insieme (vedi discussion_pages_plan).
+    """
     sections = []
     normalized_base_url = normalize_url(BASE_URL)
     normalized_url = normalize_url(url)  # Normalizza l'URL in ingresso
@@ -300,60 +741,83 @@ def extract_sections_paginated(url):
         if soup:
             sections = extract_sections(soup)
     else:
-        # Estrazione iterativa per URL generici
-        page = 0
-        while True:
-            download_url = normalized_url if page == 0 else f"{normalized_url}&st={page * 30}"
-            logging.info(f"Downloading sections from: {download_url}")  # Log the URL being downloaded
+        logging.info(f"Downloading sections from: {normalized_url}")
+        pages, selected = {}, []
+        plan = discussion_pages_plan(pages, selected)
+        try:
+            for _ in run_page_plan(plan, pages, partial(discussion_page_url, normalized_url), parse_section_page):
+                pass
+        except requests.exceptions.RequestException as e:
+            # Se non riesce a scaricare una pagina, si ferma alle sezioni già estratte
+            logging.error(f"Error downloading sections of {normalized_url}: {str(e)}")
+        for page in selected:
+            sections.extend(pages[page][0])
 
-                        # Controlla se siamo all'ultima pagina a partire dalla seconda
-            if page > 0:
-                current_url = normalize_url(soup.find('link', rel='canonical')['href'])
-                if current_url != normalize_url(download_url):
-                    break
+    # Filtro per rimuovere le sezioni con 'Number of Discussions': 'N/A'
+    return filter_valid_sections(sections)
 
-            soup = download_and_parse(download_url)
-            if soup:
-                page_sections = extract_sections(soup)
-                sections.extend(page_sections)
 
-            page += 1
+def section_key(section):
+    """Chiave canonica di una sezione: il suo ID (o, se manca, il link normalizzato)."""
+    return section.get("ID") or normalize_url(section.get("Link") or "")
 
-    # Filtro per rimuovere le sezioni con 'Number of Discussions': 'N/A'
-    filtered_sections = [
-        section for section in sections
-        if section.get('Number of Discussions') != 'N/A'
-    ]
 
-    return filtered_sections
+def walk_sections(url, max_depth=None):
+    """
+    Visita in ampiezza l'albero delle sezioni a partire da url, scaricando la pagina di ogni sezione
+    una sola volta: una sezione raggiungibile da più sezioni (o da un ciclo di link) viene visitata
+    solo la prima volta che viene trovata. Iterativa, quindi senza limiti di profondità dovuti alla ricorsione.
 
+    Args:
+        url (str): Pagina di partenza (es. la home del forum).
+        max_depth (int): Profondità massima (1 = solo le sezioni della pagina di partenza; None = nessun limite).
 
-def extract_all_sections_recursive(url, all_sections=None):
-    """Esplora ricorsivamente tutte le sezioni a partire da un URL e raccoglie tutte le sezioni in un'unica lista."""
+    Returns:
+        generator: Coppie (sezione, contenuto della prima pagina della sezione o None se non scaricata),
+        nello stesso ordine di extract_all_sections_recursive.
+    """
+    visited = set()
+    queue = deque([(None, url, 0)])
+    while queue:
+        section, link, depth = queue.popleft()
+        content = None
+        if link and (max_depth is None or depth < max_depth):
+            if section is not None:
+                logging.info(f"Exploring link: {link}")
+            try:
+                content = fetch_page(link)  # Retry e backoff gestiti dalla sessione condivisa
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Error downloading page {link}: {str(e)}")
+        if section is not None:
+            yield section, content
+        if content is None:
+            continue
+
+        # Filtro per rimuovere le sezioni con 'Number of Discussions': 'N/A'
+        for child in filter_valid_sections(extract_sections(parse_html(content, only="sections"))):
+            key = section_key(child)
+            if key in visited:
+                continue
+            visited.add(key)
+            queue.append((child, child.get("Link"), depth + 1))
+
+
+def extract_all_sections_recursive(url, all_sections=None, max_depth=None):
+    """Esplora tutte le sezioni a partire da un URL (vedi walk_sections) e raccoglie tutte le sezioni in un'unica lista."""
     if all_sections is None:
         all_sections = []  # Inizializza la lista di sezioni se non è stata passata
+    all_sections.extend(section for section, _ in walk_sections(url, max_depth))
+    return all_sections
 
-    # Estrai le sezioni dalla pagina corrente
-    soup = download_and_parse(url)
-    if soup:
-        sections = extract_sections(soup)
 
-        # Filtro per rimuovere le sezioni con 'Number of Discussions': 'N/A'
-        sections = [
-            section for section in sections
-            if section.get('Number of Discussions') != 'N/A'
-        ]
-        
-        all_sections.extend(sections)  # Aggiungi le sezioni alla lista principale
-
-        # Esplora i link alle sezioni figlie (se esistono)
-        for section in sections:
-            link = section.get("Link")
-            if link:  # Se il link esiste, esplora quella sezione
-                logging.info(f"Exploring link: {link}")
-                extract_all_sections_recursive(link, all_sections)
+def iter_all_sections(url, max_depth=None):
+    """
+    Versione a generatore di extract_all_sections_recursive: restituisce le sezioni nello stesso ordine,
+    man mano che le pagine vengono scaricate.
+    """
+    for section, _ in walk_sections(url, max_depth):
+        yield section
 
-    return all_sections
 
 def extract_discussions(soup):
     data = []
@@ -383,38 +847,143 @@ def extract_discussions(soup):
     return data
 
 
-def extract_discussions_paginated(url):
-    """Estrae le discussioni iterando su eventuali pagine."""
-    discussions = []
-    page = 0
-    original_url = normalize_url(url)  # Normalizza l'URL originale
+def is_past_last_page(soup, download_url):
+    """
+    Verifica, a partire dalla seconda pagina, se si è andati oltre l'ultima pagina di un elenco:
+    il forum risponde con la pagina finale e il suo link canonico non coincide con l'URL richiesto.
+    """
+    canonical_link = soup.find('link', rel='canonical')
+    if not canonical_link or 'href' not in canonical_link.attrs:
+        logging.warning(f"Canonical link not found or invalid on page: {download_url}")
+        return True  # Interrompe se non riesce a trovare il link canonico
+    current_url = normalize_url(canonical_link['href'])
+    return current_url != normalize_url(download_url)
 
-    while True:
-        download_url = original_url if page == 0 else f"{original_url}&st={page * 30}"
-        logging.info(f"Downloading discussions from: {download_url}")  # Log the URL being downloaded
 
-        soup = download_and_parse(download_url)
-        if not soup:
-            logging.warning(f"Failed to download or parse the page: {download_url}")
-            break  # Se non riesce a scaricare o analizzare la pagina, interrompe il ciclo
+def parse_discussion_page(content, url):
+    """
+    Analizza una pagina dell'elenco delle discussioni di una sezione.
+    Funzione di modulo così da poter essere eseguita in un processo separato (vedi utils_pipeline).
 
-        # Starting from the second page, check if it's the last page
-        if page > 0:
-            canonical_link = soup.find('link', rel='canonical')
-            if not canonical_link or 'href' not in canonical_link.attrs:
-                logging.warning(f"Canonical link not found or invalid on page: {download_url}")
-                break  # Interrompe se non riesce a trovare il link canonico
-            current_url = normalize_url(canonical_link['href'])
-            if current_url != normalize_url(download_url):
-                break
-
-        # Estrai le discussioni dalla pagina
-        page_discussions = extract_discussions(soup)
-        discussions.extend(page_discussions)
+    Returns:
+        tuple: (discussioni estratte, True se la pagina è oltre l'ultima, ultima pagina indicata dalla paginazione o None)
+    """
+    soup = parse_html(content, only="discussions")
+    # Il controllo del link canonico vale a partire dalla seconda pagina
+    past_last_page = "st" in parse_qs(urlparse(url).query) and is_past_last_page(soup, url)
+    return extract_discussions(soup), past_last_page, last_page_from_pagination(content, url, 30)
 
+
+def discussion_pages_plan(pages, selected):
+    """
+    Piano di visita delle pagine dell'elenco delle discussioni di una sezione (generatore, vedi post_pages_plan).
+
+    Le pagine indicate dalla paginazione della prima pagina vengono richieste tutte insieme; se la prima
+    pagina non contiene link di paginazione (o l'ultima pagina indicata è ancora valida) si prosegue una
+    pagina alla volta fino al controllo del link canonico.
+    """
+    if 0 not in pages:
+        yield [0]
+    selected.append(0)
+    last_page = pages[0][2] or 0
+    if last_page:
+        yield list(range(1, last_page + 1))
+
+    page = 1
+    while True:
+        if page not in pages:
+            yield [page]
+        # Starting from the second page, check if it's the last page
+        if pages[page][1]:
+            return
+        selected.append(page)
         page += 1
 
-    return discussions
+
+def discussion_page_url(url, page):
+    return url if page == 0 else f"{url}&st={page * 30}"
+
+
+def iter_discussions_paginated(url, first_page=None):
+    """
+    Versione a generatore di extract_discussions_paginated: restituisce le discussioni pagina per pagina.
+    first_page è il contenuto della prima pagina, se già scaricata (es. da walk_sections).
+    """
+    original_url = normalize_url(url)  # Normalizza l'URL originale
+    logging.info(f"Downloading discussions from: {original_url}")  # Log the URL being downloaded
+
+    pages = {}
+    selected = []
+    if first_page is not None:
+        pages[0] = parse_discussion_page(first_page, original_url)
+    emitted = 0
+    plan = discussion_pages_plan(pages, selected)
+    try:
+        for _ in run_page_plan(plan, pages, partial(discussion_page_url, original_url), parse_discussion_page):
+            for page in selected[emitted:]:
+                yield from pages[page][0]
+            emitted = len(selected)
+    except requests.exceptions.RequestException as e:
+        # Se non riesce a scaricare una pagina, si ferma alle discussioni già estratte
+        logging.warning(f"Failed to download or parse a page of {original_url}: {e}")
+    for page in selected[emitted:]:
+        yield from pages[page][0]
+
+
+def extract_discussions_paginated(url):
+    """Estrae le discussioni iterando su eventuali pagine (vedi discussion_pages_plan)."""
+    return list(iter_discussions_paginated(url))
+
+
+def make_pipeline(**pipeline_options):
+    """
+    Crea una CrawlPipeline (vedi utils_pipeline) che scarica tramite la sessione condivisa
+    e analizza le pagine in processi separati, con lo stesso parser HTML di questo processo.
+    """
+    return CrawlPipeline(fetch_page, initializer=set_html_parser, initargs=(HTML_PARSER,), **pipeline_options)
+
+
+def extract_discussions_pipelined(items, pipeline):
+    """
+    Estrae con la pipeline le discussioni di tutte le sezioni.
+
+    Returns:
+        list: Per ogni sezione di items, nello stesso ordine, la lista delle sue discussioni.
+    """
+    def tasks():
+        for index, item in enumerate(items):
+            url = normalize_url(item.get("Link"))
+            pages, selected = {}, []
+            yield PageTask(index, discussion_pages_plan(pages, selected), pages, partial(discussion_page_url, url),
+                           parse_discussion_page, selected)
+
+    discussioni_per_sezione = [[] for _ in items]
+    for task in pipeline.run(tasks()):
+        if task.error is not None:
+            logging.warning(f"Failed to download or parse a page of {items[task.item].get('Link')}: {task.error}")
+        for page in task.selected:
+            discussioni_per_sezione[task.item].extend(task.pages[page][0])
+    return discussioni_per_sezione
+
+
+def extract_posts_pipelined(discussioni, start_date, end_date, pipeline):
+    """
+    Estrae con la pipeline i post di tutte le discussioni (pagine scelte come in extract_posts).
+
+    Returns:
+        generator: Coppie (discussione, post filtrati per data), nell'ordine in cui le discussioni vengono completate.
+    """
+    def tasks():
+        for discussione in discussioni:
+            pages, selected = {}, []
+            plan = post_pages_plan(pages, selected, start_date, end_date, replies=discussione.get("replies"))
+            yield PageTask(discussione, plan, pages, partial(post_page_url, discussione["link"]), parse_post_page,
+                           selected)
+
+    for task in pipeline.run(tasks()):
+        if task.error is not None:
+            logging.error(f"Error downloading page of {task.item['link']} after retries, discussion truncated: {task.error}")
+        yield task.item, selected_posts(task.pages, task.selected, start_date, end_date)
 
 
 def estrai_autori(lista_dizionari, autori_accumulati):
@@ -426,20 +995,88 @@ def estrai_autori(lista_dizionari, autori_accumulati):
     autori_accumulati.update({d["author"].lower() for d in lista_dizionari if d["author"].lower() != "unknown"})
 
 
-def process_discussions(items):
+def add_section_info(discussioni, title, link):
+    """Aggiunge a ogni discussione il titolo e il link della sezione che la elenca."""
+    for discussione in discussioni:
+        discussione["title_section"] = title
+        discussione["link_section"] = link
+
+
+def topic_id(url):
+    """ID della discussione (parametro t=) ricavato dal suo URL, o None."""
+    match = re.search(r"[?&]t=(\d+)", url or "")
+    return match.group(1) if match else None
+
+
+def discussion_key(discussione):
+    """Chiave canonica di una discussione: l'ID del topic o, se manca, titolo, autore e risposte."""
+    return topic_id(discussione.get("link")) or tuple(discussione.get(chiave) for chiave in ["title", "author", "replies"])
+
+
+def unique_discussions(discussioni, viste=None):
+    """Restituisce (generatore) ogni discussione una sola volta, alla prima sezione che la elenca."""
+    if viste is None:
+        viste = set()
+    for discussione in discussioni:
+        key = discussion_key(discussione)
+        if key not in viste:
+            viste.add(key)
+            yield discussione
+
+
+def iter_section_discussions(item, first_page=None):
+    """
+    Discussioni di una sezione, con i dati della sezione, pagina per pagina.
+    first_page è il contenuto della prima pagina della sezione, se già scaricata (vedi walk_sections).
+    """
+    title = item.get("Title")
+    link = item.get("Link")
+    logging.info(f"Titolo: {title}")
+    logging.info(f"Numero di discussioni dichiarato: {item.get('Number of Discussions')}")
+
+    estratte = 0
+    try:
+        for discussione in iter_discussions_paginated(link, first_page):
+            add_section_info([discussione], title, link)
+            estratte += 1
+            yield discussione
+    except Exception as e:
+        logging.error(f"Errore nell'estrazione delle discussioni per il link {link}: {e}")
+    logging.info(f"Numero di discussioni estratte: {estratte}")
+    logging.info("------------------------------------")
+
+
+def iter_discussions(items):
+    """
+    Versione a generatore di process_discussions: restituisce le discussioni, con i dati della sezione,
+    pagina per pagina e una sola volta anche se elencate da più sezioni. items può essere a sua volta
+    un generatore (es. iter_all_sections).
+    """
+    viste = set()
+    for item in items:
+        yield from unique_discussions(iter_section_discussions(item), viste)
+
+
+def process_discussions(items, pipeline=False, **pipeline_options):
     """
     Processa una lista di elementi, stampa informazioni sulle discussioni
     e restituisce un'unica lista con tutte le discussioni estratte.
 
     Args:
         items (list): Lista di dizionari con le informazioni sugli elementi.
+        pipeline (bool): Se True le pagine vengono scaricate e analizzate con la pipeline a stadi
+            (vedi make_pipeline); il risultato è lo stesso.
+        **pipeline_options: Parametri passati a CrawlPipeline (fetch_workers, parse_workers, queue_size, ...).
 
     Returns:
-        list: Lista totale di tutte le discussioni estratte.
+        list: Lista di tutte le discussioni estratte, senza duplicati (vedi discussion_key).
     """
     discussioni_totali = []
+    items = list(items)  # Con la pipeline gli elementi vengono scorsi due volte (anche se items è un generatore)
+    if pipeline:
+        discussioni_per_sezione = extract_discussions_pipelined(items, make_pipeline(**pipeline_options))
 
-    for item in items:
+    for index, item in enumerate(items):
         # Estrazione delle informazioni dall'elemento
         title = item.get("Title")
         num_discussions = item.get("Number of Discussions")
@@ -451,12 +1088,10 @@ def process_discussions(items):
 
         try:
             # Estrazione delle discussioni usando la funzione fornita
-            discussioni = extract_discussions_paginated(link)
+            discussioni = discussioni_per_sezione[index] if pipeline else extract_discussions_paginated(link)
 
             # Aggiunta delle informazioni della sezione a ogni discussione
-            for discussione in discussioni:
-                discussione["title_section"] = title
-                discussione["link_section"] = link
+            add_section_info(discussioni, title, link)
 
             logging.info(f"Numero di discussioni estratte: {len(discussioni)}")
         except Exception as e:
@@ -470,42 +1105,48 @@ def process_discussions(items):
         # Aggiunta delle discussioni alla lista totale
         discussioni_totali.extend(discussioni)
 
-     # Rimozione dei duplicati basata sulle chiavi specificate
-    discussioni_uniche = []
-    viste = set()
-
-    for discussione in discussioni_totali:
-        # Crea una tupla con i valori delle chiavi selezionate
-        chiavi_valori = tuple(discussione.get(chiave) for chiave in ["title","author","replies"])
+    # Rimozione dei duplicati basata sull'ID del topic: una discussione elencata da più sezioni
+    # viene mantenuta (e i suoi post scaricati) una sola volta
+    return list(unique_discussions(discussioni_totali))
 
-        if chiavi_valori not in viste:
-            viste.add(chiavi_valori)
-            discussioni_uniche.append(discussione)
 
-    return discussioni_totali
+def process_forum_data(url="https://quelledialfpma.forumfree.it/", save_to_local=False, archive_path=None, replay=False):
+    """
+    Estrae sezioni e discussioni del forum.
 
-def process_forum_data(url="https://quelledialfpma.forumfree.it/", save_to_local=False):
+    Con archive_path ogni pagina scaricata viene registrata nell'archivio; con replay=True
+    l'intera elaborazione viene eseguita a partire dall'archivio, senza accedere alla rete.
+    Con save_to_local sezioni e discussioni vengono salvate anche in file locali (vedi open_local_export).
+    """
     try:
         # Log dell'inizio del processo
         logging.info(f"Inizio elaborazione dell'URL: {url}")
 
-        # Estrarre tutte le sezioni ricorsivamente
-        logging.info("Estrazione delle sezioni in corso...")
-        sections = extract_all_sections_recursive(url)
-        logging.info(f"Estrazione completata. Numero di sezioni trovate: {len(sections) if sections else 0}")
-
-        # Processare le discussioni
-        logging.info("Elaborazione delle discussioni in corso...")
-        discussions = process_discussions(sections)
+        # Salvataggio dei dati in locale solo se il parametro è True: i record vengono aggiunti ai file
+        # man mano che vengono trovati, così che un'interruzione non perda quanto già estratto
+        with ExitStack() as stack:
+            if save_to_local:
+                sections_file = stack.enter_context(open_local_export("sections"))
+                discussions_file = stack.enter_context(open_local_export("discussions"))
+                logging.info(f"Salvataggio dei dati in {sections_file.path} e {discussions_file.path}")
+
+            stack.enter_context(crawl_session(archive_path=archive_path, replay=replay))
+            # Sezioni visitate in ampiezza: la prima pagina di ogni sezione viene scaricata una sola volta
+            # e usata sia per le sottosezioni sia per l'elenco delle discussioni
+            logging.info("Estrazione delle sezioni e delle discussioni in corso...")
+            sections = []
+            discussions = []
+            viste = set()
+            for section, first_page in walk_sections(url):
+                sections.append(section)
+                found = list(unique_discussions(iter_section_discussions(section, first_page), viste))
+                discussions.extend(found)
+                if save_to_local:
+                    sections_file.append(section)
+                    discussions_file.extend(found)
+            logging.info(f"Estrazione completata. Numero di sezioni trovate: {len(sections) if sections else 0}")
         logging.info(f"Elaborazione completata. Numero di discussioni processate: {len(discussions) if discussions else 0}")
 
-        # Salvataggio dei dati in locale solo se il parametro è True
-        if save_to_local:
-            logging.info("Salvataggio dei dati in locale...")
-            save_data_locally(sections, "sections")
-            save_data_locally(discussions, "discussions")
-            logging.info("Dati salvati con successo.")
-
         # Ritorno dei risultati
         return sections, discussions
 
@@ -524,10 +1165,8 @@ def insert_post_to_mongo(post_dict, database_name, collection_name, chiavi_dedup
     - collection_name: Nome della collezione in cui inserire il post.
     - chiavi_deduplicazione: Lista di chiavi da utilizzare per verificare la presenza di duplicati.
     """
-    # Configurazione della connessione a MongoDB
-    client = MongoClient(MONGODB_URI)
-    db = client[database_name]
-    collection = db[collection_name]
+    # Connessione condivisa a MongoDB (vedi utils_mongo)
+    collection = get_database(database_name)[collection_name]
 
     # Creazione del filtro di deduplicazione basato sulle chiavi specificate
     filtro = {chiave: post_dict.get(chiave) for chiave in chiavi_deduplicazione}
@@ -536,21 +1175,16 @@ def insert_post_to_mongo(post_dict, database_name, collection_name, chiavi_dedup
     existing_post = collection.find_one(filtro)
 
     if existing_post:
-        print(f"Post con {filtro} già esistente. Salto l'inserimento.")
+        LOGGER.debug(f"Post con {filtro} già esistente. Salto l'inserimento.")
     else:
         collection.insert_one(post_dict)
-        print(f"Post con {filtro} inserito nella collezione.")
+        LOGGER.debug(f"Post con {filtro} inserito nella collezione.")
 
 
-def process_posts(discussioni, database_name, start_date=None, end_date=None):
+def normalize_date_range(start_date=None, end_date=None):
     """
-    Processes the posts between the specified start and end dates, 
-    and inserts them into MongoDB. Defaults to 01/01/2001 for start_date
-    and 12/31/2070 for end_date if not provided.
-
-    Parameters:
-    - start_date: The start date (datetime) for filtering posts (optional).
-    - end_date: The end date (datetime) for filtering posts (optional).
+    Converte le date di inizio e fine in datetime, applicando i valori di default
+    01/01/2001 e 31/12/2070 se non fornite. Le stringhe sono attese nel formato YYYY-MM-DD.
     """
     # Default date values if not provided
     if start_date is None:
@@ -565,74 +1199,384 @@ def process_posts(discussioni, database_name, start_date=None, end_date=None):
         # Converti la stringa in datetime se è passata come stringa
         if isinstance(end_date, str):
             end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+    return start_date, end_date
+
+
+def open_writer(database_name, collection_name, batch_size=DEFAULT_BULK_SIZE, **options):
+    """
+    Apre un BulkWriter sulla collezione, deduplicato sulle chiavi di DEDUP_KEYS: da usare al posto
+    di insert_post_to_mongo quando si scrivono molti documenti (una bulk_write ogni batch_size).
+    """
+    return BulkWriter(get_database(database_name)[collection_name], DEDUP_KEYS[collection_name], batch_size, **options)
 
-    autori_unici = set()
 
-    # Iterate through results and extract posts
-    for i in discussioni:
-        posts = extract_posts(i["link"], start_date, end_date)
-        discussion_title = i["title"]
-        discussion_link = i["link"]
-        discussion_author = i["author"]
-        section_link = i["link_section"]
-        section_title = i["title_section"]
-        
-        for j in posts:
-            # Create a dictionary with the post and discussion data
-            post_dict = {
-                "section_title": section_title,
-                "section_link": section_link,
-                "discussion_title": discussion_title,
-                "discussion_link": discussion_link,
-                "discussion_author": discussion_author,
-                **j  # Flatten the post data directly into the dictionary
-            }
+def post_id(post):
+    """
+    Identificativo deterministico di un post salvato: hash di link della discussione, autore, data,
+    ora e messaggio. Usato come _id, deduplica i post tramite la chiave primaria invece che con un
+    confronto (o un indice) sull'intero testo del messaggio.
+    """
+    parts = [normalize_url(post.get("discussion_link") or ""), post.get("author"), post.get("date"),
+             post.get("time"), post.get("message")]
+    data = "\x1f".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
 
-            print(post_dict)
 
-            if "author" in j:
-                autore = j["author"].lower()  # Autore in minuscolo per evitare duplicati
-                autori_unici.add(autore)
+def migrate_post_ids(database_name, batch_size=DEFAULT_BULK_SIZE):
+    """
+    Migrazione una tantum dei post salvati prima dell'introduzione di post_id: ogni post con _id
+    generato da MongoDB viene riscritto con l'_id derivato dal contenuto e l'originale cancellato,
+    a blocchi di batch_size. I duplicati (stesso _id) vengono eliminati mantenendo il primo trovato.
+    La migrazione può essere interrotta e rieseguita: un post viene cancellato solo dopo che la sua
+    copia con il nuovo _id è stata scritta. Al termine viene rimosso l'indice su messaggio e autore.
+
+    Returns:
+        dict: Post riscritti con il nuovo _id e duplicati eliminati.
+    """
+    collection = get_database(database_name)["post"]
+    old_ids = []
+
+    with BulkWriter(collection, DEDUP_KEYS["post"], batch_size, flush_interval=None) as writer:
+        def flush():
+            writer.flush()
+            collection.delete_many({"_id": {"$in": old_ids}})
+            old_ids.clear()
+
+        for documento in collection.find({"_id": {"$type": "objectId"}}).batch_size(batch_size):
+            old_ids.append(documento["_id"])
+            writer.add({**documento, "_id": post_id(documento), "updated_at": datetime.datetime.now(datetime.timezone.utc)})
+            if len(old_ids) >= batch_size:
+                flush()
+        flush()
+
+    if "dedup_message_author" in collection.index_information():
+        collection.drop_index("dedup_message_author")
+    ensure_indexes(database_name)
+    counts = {"migrated": writer.inserted, "duplicates": writer.skipped}
+    logging.info(f"Migrazione degli _id dei post completata: {counts}")
+    return counts
+
+
+def backfill_posted_at(database_name, batch_size=DEFAULT_BULK_SIZE):
+    """
+    Migrazione una tantum dei documenti salvati prima dell'introduzione dei campi datetime: aggiunge
+    posted_at (UTC) ai post e alle loro citazioni e last_message_at alle sezioni, calcolandoli dalle
+    stringhe di data e ora, con aggiornamenti a blocchi di batch_size. Può essere rieseguita: vengono
+    considerati solo i documenti a cui il campo manca.
+
+    Returns:
+        dict: Documenti aggiornati per collezione.
+    """
+    db = get_database(database_name)
+    counts = {"post": 0, "sezioni": 0}
+
+    def backfill(collection_name, field, projection, values):
+        collection = db[collection_name]
+        operations = []
+        for documento in collection.find({field: {"$exists": False}}, projection).batch_size(batch_size):
+            operations.append(UpdateOne({"_id": documento["_id"]}, {"$set": values(documento)}))
+            if len(operations) >= batch_size:
+                counts[collection_name] += collection.bulk_write(operations, ordered=False).modified_count
+                operations.clear()
+        if operations:
+            counts[collection_name] += collection.bulk_write(operations, ordered=False).modified_count
+
+    def post_values(post):
+        values = {"posted_at": parse_forum_datetime(post.get("date"), post.get("time")),
+                  "updated_at": datetime.datetime.now(datetime.timezone.utc)}
+        if post.get("quotes"):
+            values["quotes"] = [
+                {**quote, "posted_at": parse_forum_datetime(quote.get("quote_date"), quote.get("quote_time"))}
+                for quote in post["quotes"]
+            ]
+        return values
+
+    backfill("post", "posted_at", ["date", "time", "quotes"], post_values)
+    backfill("sezioni", "last_message_at", ["Last Message Date", "Last Message Time"], lambda sezione: {
+        "last_message_at": parse_forum_datetime(sezione.get("Last Message Date"), sezione.get("Last Message Time")),
+    })
+    ensure_indexes(database_name)
+    logging.info(f"Backfill delle date completato: {counts}")
+    return counts
+
+
+def store_posts(discussioni, posts_per_discussione, database_name):
+    """
+    Inserisce in MongoDB i post estratti, arricchiti con i dati della discussione e della sezione,
+    e infine gli autori unici.
 
-            # Insert the post_dict into MongoDB
-            insert_post_to_mongo(post_dict, database_name, "post", ["message","author"])
+    Parameters:
+    - discussioni: Lista delle discussioni da cui provengono i post.
+    - posts_per_discussione: Iterabile con la lista dei post di ciascuna discussione, nello stesso ordine.
+    - database_name: Nome del database MongoDB.
 
-    for autore in autori_unici:
-        autore_dict = {"author":autore}
+    Returns:
+    - dict: Documenti inseriti e già presenti per le collezioni "post" e "autori".
+    """
+    return store_discussion_posts(zip(discussioni, posts_per_discussione), database_name)
 
-        insert_post_to_mongo(autore_dict,database_name,"autori",["author"])
 
+def store_discussion_posts(discussioni_e_post, database_name, batch_size=POST_BATCH_SIZE):
+    """
+    Come store_posts, a partire da coppie (discussione, post) in qualunque ordine. I post di ogni
+    discussione possono essere un generatore: vengono accumulati al massimo batch_size post alla volta
+    e scritti con una sola bulk_write (vedi open_writer), insieme ai nuovi autori. Tutti i post sono
+    scritti quando la funzione termina.
+    """
+    autori_visti = set()
+
+    with open_writer(database_name, "post", batch_size) as post_writer, \
+            open_writer(database_name, "autori", batch_size) as autori_writer:
+        for i, posts in discussioni_e_post:
+            discussion_title = i["title"]
+            discussion_link = i["link"]
+            discussion_author = i["author"]
+            section_link = i["link_section"]
+            section_title = i["title_section"]
+
+            for j in posts:
+                # Create a dictionary with the post and discussion data
+                post_dict = {
+                    "updated_at": datetime.datetime.now(datetime.timezone.utc),  # Vedi utils_columnar
+                    "section_title": section_title,
+                    "section_link": section_link,
+                    "discussion_title": discussion_title,
+                    "discussion_link": discussion_link,
+                    "discussion_author": discussion_author,
+                    **j  # Flatten the post data directly into the dictionary
+                }
+                post_writer.add({"_id": post_id(post_dict), **post_dict})
+
+                if "author" in j:
+                    autore = j["author"].lower()  # Autore in minuscolo per evitare duplicati
+                    if autore not in autori_visti:
+                        autori_visti.add(autore)
+                        autori_writer.add({"author": autore})
+
+    return {"post": post_writer.counts(), "autori": autori_writer.counts()}
+
+
+def process_posts(discussioni, database_name, start_date=None, end_date=None, pipeline=False,
+                  batch_size=POST_BATCH_SIZE, **pipeline_options):
+    """
+    Processes the posts between the specified start and end dates, 
+    and inserts them into MongoDB. Defaults to 01/01/2001 for start_date
+    and 12/31/2070 for end_date if not provided.
 
+    Parameters:
+    - discussioni: Discussions to process; any iterable, including a generator such as iter_discussions
+      (discussions are consumed one at a time), or the path of a file saved by save_data_locally
+      (streamed with read_records).
+    - start_date: The start date (datetime) for filtering posts (optional).
+    - end_date: The end date (datetime) for filtering posts (optional).
+    - pipeline: If True, pages are downloaded, parsed (in a process pool) and written by the staged
+      pipeline (see make_pipeline); posts of a discussion are written as soon as it is complete.
+    - batch_size: Maximum number of posts buffered in memory before being written.
+    - pipeline_options: Parameters for CrawlPipeline (fetch_workers, parse_workers, queue_size, ...).
 
+    Returns:
+    - dict: Inserted and already existing documents per collection (see store_discussion_posts).
+    """
+    start_date, end_date = normalize_date_range(start_date, end_date)
+    if isinstance(discussioni, str):
+        discussioni = read_records(discussioni)
+
+    with crawl_session():
+        if pipeline:
+            pipeline = make_pipeline(**pipeline_options)
+            discussioni_e_post = extract_posts_pipelined(discussioni, start_date, end_date, pipeline)
+        else:
+            # Iterate through results and stream posts page by page, one discussion at a time
+            discussioni_e_post = (
+                (i, iter_posts(i["link"], start_date, end_date, replies=i.get("replies"))) for i in discussioni
+            )
+        return store_discussion_posts(discussioni_e_post, database_name, batch_size)
 
-def process_forum_data_and_insert(database_name, start_date, end_date, url="https://quelledialfpma.forumfree.it/"):
-    # Estrazione dei dati dal forum
-    result_sections, result_discussion = process_forum_data(url)
-    
-    # Inserimento delle sezioni nel database (iterando su ogni sezione)
-    for sezione in result_sections:
-        insert_post_to_mongo(sezione, database_name, "sezioni", ["ID"])
-    
-    # Inserimento delle discussioni nel database (iterando su ogni discussione)
-    for discussione in result_discussion:
-        insert_post_to_mongo(discussione, database_name, "discussioni", ["title", "replies", "author"])
-    
-    # Elaborazione dei post nel database
-    process_posts(result_discussion, database_name, start_date, end_date)
+
+def store_forum_data(result_sections, result_discussion, database_name):
+    """Inserisce sezioni e discussioni nel database, deduplicandole; restituisce i conteggi per collezione."""
+    with open_writer(database_name, "sezioni") as sezioni_writer, \
+            open_writer(database_name, "discussioni") as discussioni_writer:
+        for sezione in result_sections:
+            sezioni_writer.add(sezione)
+        for discussione in result_discussion:
+            discussioni_writer.add(discussione)
+    return {"sezioni": sezioni_writer.counts(), "discussioni": discussioni_writer.counts()}
+
+
+def iter_stored_discussions(url, database_name):
+    """
+    Estrae sezioni e discussioni del forum salvandole nel database man mano che vengono trovate
+    (come store_forum_data) e restituisce, come generatore, le discussioni salvate.
+    """
+    viste = set()
+    with open_writer(database_name, "sezioni") as sezioni_writer, \
+            open_writer(database_name, "discussioni") as discussioni_writer:
+        for sezione, first_page in walk_sections(url):
+            sezioni_writer.add(sezione)
+            for discussione in unique_discussions(iter_section_discussions(sezione, first_page), viste):
+                discussioni_writer.add(discussione)
+                yield discussione
+
+
+def process_forum_data_and_insert(database_name, start_date, end_date, url="https://quelledialfpma.forumfree.it/", cache_path=None, incremental=False, frontier_path=None, resume=False, reset=False):
+    ensure_indexes(database_name)
+    # Una sola sessione HTTP per l'intero crawl (con cache su disco opzionale)
+    with crawl_session(cache_path=cache_path):
+        if frontier_path:
+            # Crawl riprendibile: lo stato di ogni URL è salvato nella frontiera (vedi utils_frontier)
+            from shared.utils_frontier import crawl_with_frontier
+            # resume/reset: vedi crawl_with_frontier (un crawl già presente nella frontiera non viene ignorato)
+            crawl_with_frontier(database_name, start_date, end_date, url, frontier_path, resume=resume, reset=reset)
+            return
+
+        if incremental:
+            # Scarica solo ciò che è cambiato rispetto ai watermark salvati
+            process_forum_data_incremental(database_name, start_date, end_date, url)
+            return
+
+        # Sezioni, discussioni e post vengono estratti e salvati in streaming: la scrittura inizia
+        # con la prima sezione e la memoria non cresce con la dimensione del forum
+        process_posts(iter_stored_discussions(url, database_name), database_name, start_date, end_date)
+
+
+def parse_count(value):
+    """Converte un contatore del forum (es. "1.234") in intero; None se non numerico."""
+    digits = re.sub(r"\D", "", value or "")
+    return int(digits) if digits else None
+
+
+def load_watermarks(collection):
+    """Carica tutti i watermark del crawl incrementale, indicizzati per _id."""
+    return {doc["_id"]: doc for doc in collection.find()}
+
+
+def save_watermark(collection, key, values):
+    """Aggiorna (o crea) il watermark identificato da key."""
+    values = {**values, "updated_at": datetime.datetime.now(datetime.timezone.utc)}
+    collection.update_one({"_id": key}, {"$set": values}, upsert=True)
+
+
+def section_watermark_key(section):
+    return f"sezione:{section['ID']}"
+
+
+def discussion_watermark_key(discussione):
+    return f"discussione:{normalize_url(discussione['link'])}"
+
+
+def section_changed(section, watermarks):
+    """Una sezione è cambiata se numero di risposte o data/ora dell'ultimo messaggio differiscono dal watermark."""
+    watermark = watermarks.get(section_watermark_key(section))
+    if watermark is None:
+        return True
+    return (
+        watermark.get("replies") != section.get("Number of Replies")
+        or watermark.get("last_message_date") != section.get("Last Message Date")
+        or watermark.get("last_message_time") != section.get("Last Message Time")
+    )
+
+
+def discussion_start_page(discussione, watermarks):
+    """
+    Restituisce la prima pagina della discussione che contiene post nuovi rispetto al watermark,
+    o None se il numero di risposte non è cambiato.
+    """
+    watermark = watermarks.get(discussion_watermark_key(discussione))
+    if watermark is None:
+        return 0
+    replies = parse_count(discussione.get("replies"))
+    if replies is None or watermark.get("replies") is None:
+        return 0
+    if replies == watermark["replies"]:
+        return None
+    if replies < watermark["replies"]:
+        # Post cancellati: la paginazione è cambiata, si riparte dall'inizio
+        return 0
+    # I post già visti sono replies + 1 (il primo post non è una risposta); 15 post per pagina
+    return (watermark["replies"] + 1) // 15
+
+
+def process_forum_data_incremental(database_name, start_date=None, end_date=None, url="https://quelledialfpma.forumfree.it/"):
+    """
+    Aggiornamento incrementale del database: usando i watermark salvati nella collezione "watermarks"
+    scarica l'elenco delle discussioni solo per le sezioni il cui numero di risposte o ultimo messaggio
+    è cambiato, al loro interno solo le discussioni con nuove risposte e, per ciascuna, solo le pagine
+    finali che contengono i post nuovi. L'albero delle sezioni viene comunque visitato (una pagina per
+    sezione), perché i contatori di una sezione non includono necessariamente le sottosezioni.
+    I watermark vengono aggiornati solo dopo che i post corrispondenti sono stati salvati.
+    """
+    start_date, end_date = normalize_date_range(start_date, end_date)
+
+    watermarks_collection = get_database(database_name)[WATERMARK_COLLECTION]
+    watermarks = load_watermarks(watermarks_collection)
+
+    with crawl_session():
+        # Della prima pagina di ogni sezione si conserva il contenuto solo per le sezioni modificate
+        all_sections = 0
+        sections, first_pages = [], []
+        for section, first_page in walk_sections(url):
+            all_sections += 1
+            if section_changed(section, watermarks):
+                sections.append(section)
+                first_pages.append(first_page)
+        logging.info(f"Sezioni modificate dall'ultimo aggiornamento: {len(sections)} su {all_sections}")
+
+        viste = set()
+        discussions = []
+        for section, first_page in zip(sections, first_pages):
+            discussions.extend(unique_discussions(iter_section_discussions(section, first_page), viste))
+        store_forum_data(sections, discussions, database_name)
+
+        sezioni_incomplete = set()
+        discussioni_viste = set()
+        pagine_scaricate = 0
+        for discussione in discussions:
+            key = discussion_watermark_key(discussione)
+            start_page = discussion_start_page(discussione, watermarks)
+            if start_page is None or key in discussioni_viste:
+                continue
+            discussioni_viste.add(key)
+
+            stats = {}
+            posts = extract_posts(discussione["link"], start_date, end_date, start_page=start_page, stats=stats,
+                                  replies=discussione.get("replies"))
+            pagine_scaricate += stats["pages"]
+            store_posts([discussione], [posts], database_name)
+
+            if stats["truncated"]:
+                sezioni_incomplete.add(discussione["link_section"])
+                continue
+            watermark = {"replies": parse_count(discussione.get("replies"))}
+            if posts:
+                watermark["last_post_date"] = posts[-1].get("date")
+                watermark["last_post_time"] = posts[-1].get("time")
+            save_watermark(watermarks_collection, key, watermark)
+
+        for section in sections:
+            if section["Link"] in sezioni_incomplete:
+                continue
+            save_watermark(watermarks_collection, section_watermark_key(section), {
+                "replies": section.get("Number of Replies"),
+                "last_message_date": section.get("Last Message Date"),
+                "last_message_time": section.get("Last Message Time"),
+            })
+
+    logging.info(f"Aggiornamento incrementale completato: {len(discussioni_viste)} discussioni aggiornate, {pagine_scaricate} pagine di post scaricate")
 
 
 def filtra_discussioni(result_discussion, nomi_da_cercare):
     return [d for d in result_discussion if d.get("title") in nomi_da_cercare]
 
 
-def data_storage(database_name, disc_da_cercare, start_date=None, end_date= None):
-    result_sections, result_discussion = process_forum_data()
-    result_discussion_subset = filtra_discussioni(result_discussion, disc_da_cercare)
-    
-    for sezione in result_sections:
-        insert_post_to_mongo(sezione, database_name, "sezioni", ["ID"])
-    for discussione in result_discussion:
-        insert_post_to_mongo(discussione, database_name, "discussioni", ["title", "replies", "author"])
-    
-    process_posts(result_discussion_subset, database_name, start_date, end_date)
+def data_storage(database_name, disc_da_cercare, start_date=None, end_date= None, cache_path=None):
+    ensure_indexes(database_name)
+    # Con cache_path le pagine già scaricate (es. l'indice del forum) vengono solo rivalidate
+    with crawl_session(cache_path=cache_path):
+        result_sections, result_discussion = process_forum_data()
+        result_discussion_subset = filtra_discussioni(result_discussion, disc_da_cercare)
+
+        store_forum_data(result_sections, result_discussion, database_name)
+
+        process_posts(result_discussion_subset, database_name, start_date, end_date)
     print("Processo forum completato!")
@@ -1,11 +1,16 @@
 # utils.py
+import datetime
 import os
 from huggingface_hub import hf_hub_download
 from transformers import pipeline, AutoTokenizer, AutoModelForTokenClassification, MarianMTModel, MarianTokenizer, AutoModelForSequenceClassification
 from dotenv import load_dotenv
 import re
 import spacy
-from pymongo import MongoClient
+from pymongo import UpdateOne
+from shared.utils_emotions import RELEVANT_THRESHOLD, encode_emotions
+from shared.utils_mongo import get_database
+from shared.utils_schema import ensure_indexes
+from shared.utils_translation import MarianTranslator
 
 # Modelli e file da scaricare
 MODEL_1_ID="osiria/bert-italian-uncased-ner"
@@ -16,6 +21,12 @@ MODEL_3_ID="SamLowe/roberta-base-go_emotions"
 
 MODEL_4_ID="Helsinki-NLP/opus-mt-it-en"
 
+# Messaggi analizzati insieme da integra_database in modalità batch
+DEFAULT_INFERENCE_BATCH_SIZE = 32
+# Differenza massima tra i punteggi dell'analisi a blocchi e quelli dell'analisi per messaggio: il padding
+# dei blocchi cambia le ultime cifre dei calcoli in virgola mobile, non le entità e le emozioni trovate
+BATCH_SCORE_TOLERANCE = 1e-4
+
 
 nlp = spacy.load("it_core_news_sm")
 
@@ -86,20 +97,11 @@ def load_model_and_files(model_id: str, model_type: str = "ner"):
             return pipeline("ner", model=model, tokenizer=tokenizer)
         
         elif model_type == "translation":
-            # Carica il modello e tokenizer per traduzione
+            # Carica il modello e tokenizer per traduzione: il traduttore accetta un testo o una lista
+            # di testi (tradotti a blocchi, vedi utils_translation.MarianTranslator)
             model = MarianMTModel.from_pretrained(model_id)
             tokenizer = MarianTokenizer.from_pretrained(model_id)
-            
-            # Definizione di una funzione per eseguire la traduzione
-            def translate_text(text):
-                # Tokenizza il testo
-                inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True)
-                # Ottieni la traduzione
-                translated = model.generate(**inputs)
-                # Decodifica la traduzione
-                return tokenizer.decode(translated[0], skip_special_tokens=True)
-            
-            return translate_text
+            return MarianTranslator(model, tokenizer)
         
         elif model_type == "classification":
             # Carica il modello e tokenizer per classificazione del testo
@@ -295,7 +297,7 @@ def traduci_output(output):
 
     return output
 
-def process_text_with_models(text, model_1_pipeline, model_2_pipeline, model_1_id, model_2_id):
+def process_text_with_models(text, model_1_pipeline, model_2_pipeline, model_1_id, model_2_id, cache=None):
     """
     Esegue l'analisi di un messaggio usando due modelli, ricostruisce i risultati e li unisce.
 
@@ -307,11 +309,16 @@ def process_text_with_models(text, model_1_pipeline, model_2_pipeline, model_1_i
         model_2_id (str): L'ID del secondo modello.
         reconstruct_word (function): Funzione per ricostruire parole complete dai sub-token.
         merge_results (function): Funzione per unire i risultati dei due modelli, dando preferenza al secondo modello.
+        cache (InferenceCache): Cache dei risultati (vedi utils_inference); None = nessuna cache.
 
     Returns:
         list: Lista di risultati finali dopo l'elaborazione e l'unione delle entità.
     """
-    
+    if cache is not None:
+        # Risultato già calcolato per lo stesso testo con gli stessi modelli, altrimenti calcolato e salvato
+        return cache.get_or_compute("ner", [model_1_pipeline, model_2_pipeline], [text], lambda testi: [
+            process_text_with_models(testi[0], model_1_pipeline, model_2_pipeline, model_1_id, model_2_id)])[0]
+
     # 1. Esegui l'analisi solo se le pipeline sono caricate correttamente
     result_1 = []
     if model_1_pipeline:
@@ -325,17 +332,57 @@ def process_text_with_models(text, model_1_pipeline, model_2_pipeline, model_1_i
     else:
         print(f"Errore nel caricare la pipeline per il modello 2: {model_2_id}")
 
-    # 2. Ricostruisci i risultati dai sub-token in parole complete per entrambi i modelli
+    return combina_ner(result_1, result_2)
+
+
+def combina_ner(result_1, result_2):
+    """Ricostruisce le parole dai sub-token dei due modelli NER e unisce i risultati (preferendo il modello 2)."""
+    # 1. Ricostruisci i risultati dai sub-token in parole complete per entrambi i modelli
     reconstructed_model_1_results = reconstruct_word(result_1) if result_1 else []
     reconstructed_model_2_results = reconstruct_word(result_2) if result_2 else []
 
-    # 3. Unisci i risultati dei due modelli, con la preferenza per il modello 2
-    final_results = merge_results(reconstructed_model_1_results, reconstructed_model_2_results)
+    # 2. Unisci i risultati dei due modelli, con la preferenza per il modello 2
+    return merge_results(reconstructed_model_1_results, reconstructed_model_2_results)
+
+
+def ordina_per_lunghezza(pipeline_fn, texts, batch_size):
+    """
+    Esegue la pipeline sulla lista di testi a blocchi di batch_size, dopo averli ordinati per lunghezza
+    così che ogni blocco contenga testi simili e il padding sia minimo; restituisce i risultati
+    nell'ordine originale dei testi.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    outputs = pipeline_fn([texts[i] for i in order], batch_size=batch_size)
+    results = [None] * len(texts)
+    for i, output in zip(order, outputs):
+        results[i] = output
+    return results
+
+
+def process_texts_with_models(texts, model_1_pipeline, model_2_pipeline, model_1_id, model_2_id, batch_size,
+                              cache=None):
+    """Versione a blocchi di process_text_with_models: una lista di risultati NER, uno per testo."""
+    if cache is not None:
+        # I modelli vengono eseguiti solo sui testi (distinti) assenti dalla cache
+        return cache.get_or_compute("ner", [model_1_pipeline, model_2_pipeline], texts, lambda testi: (
+            process_texts_with_models(testi, model_1_pipeline, model_2_pipeline, model_1_id, model_2_id, batch_size)))
+
+    results_1 = [[] for _ in texts]
+    if model_1_pipeline:
+        results_1 = ordina_per_lunghezza(model_1_pipeline, texts, batch_size)
+    else:
+        print(f"Errore nel caricare la pipeline per il modello 1: {model_1_id}")
+
+    results_2 = [[] for _ in texts]
+    if model_2_pipeline:
+        results_2 = ordina_per_lunghezza(model_2_pipeline, texts, batch_size)
+    else:
+        print(f"Errore nel caricare la pipeline per il modello 2: {model_2_id}")
 
-    return final_results
+    return [combina_ner(result_1, result_2) for result_1, result_2 in zip(results_1, results_2)]
     
 
-def process_emotions_and_translate(text, model_4_pipeline, model_3_pipeline):
+def process_emotions_and_translate(text, model_4_pipeline, model_3_pipeline, cache=None):
     """
     Esegue la traduzione del testo, la classificazione delle emozioni nel testo tradotto
     e la traduzione dei label delle emozioni in italiano.
@@ -345,11 +392,17 @@ def process_emotions_and_translate(text, model_4_pipeline, model_3_pipeline):
         model_4_pipeline: La pipeline per la traduzione del testo.
         model_3_pipeline: La pipeline per la classificazione delle emozioni.
         traduci_output (function): Funzione per tradurre i label delle emozioni in italiano.
+        cache (InferenceCache): Cache dei risultati (vedi utils_inference); None = nessuna cache.
 
     Returns:
         list: Lista di emozioni con i label tradotti in italiano.
     """
-    
+    if cache is not None:
+        # In cache le emozioni del testo, come in process_emotions_and_translate_batch
+        return [cache.get_or_compute("emotions", [model_4_pipeline, model_3_pipeline], [text], lambda testi: [
+            process_emotions_and_translate(testi[0], model_4_pipeline, model_3_pipeline)[0]])[0]]
+
+
     # 1. Tradurre il testo con il modello di traduzione
     text_tradotto = model_4_pipeline(text)
     
@@ -362,6 +415,21 @@ def process_emotions_and_translate(text, model_4_pipeline, model_3_pipeline):
     # 4. Restituire il risultato finale
     return output_tradotto
 
+
+def process_emotions_and_translate_batch(texts, model_4_pipeline, model_3_pipeline, batch_size, cache=None):
+    """
+    Versione a blocchi di process_emotions_and_translate: i testi vengono tradotti e le traduzioni
+    classificate a blocchi di batch_size. Restituisce, per ogni testo, la lista delle emozioni con i
+    label tradotti in italiano.
+    """
+    if cache is not None:
+        return cache.get_or_compute("emotions", [model_4_pipeline, model_3_pipeline], texts, lambda testi: (
+            process_emotions_and_translate_batch(testi, model_4_pipeline, model_3_pipeline, batch_size)))
+
+    testi_tradotti = model_4_pipeline(list(texts), batch_size=batch_size)
+    output_classificazione = ordina_per_lunghezza(model_3_pipeline, testi_tradotti, batch_size)
+    return [traduci_output(emozioni) for emozioni in output_classificazione]
+
 def recupera_autori(autori_collection):
     # Recupera la lista di autori dal database
     autori_cursor = autori_collection.find()
@@ -409,13 +477,57 @@ def load_models():
     
     return model_1_pipeline, model_2_pipeline, model_3_pipeline, model_4_pipeline, model_1_id, model_2_id
 
-def analisi_semantica(text, autori, model_1_pipeline, model_2_pipeline, model_3_pipeline, model_4_pipeline, model_1_id, model_2_id):
+def analisi_semantica(text, autori, model_1_pipeline, model_2_pipeline, model_3_pipeline, model_4_pipeline, model_1_id, model_2_id,
+                      cache=None):
     # Supponendo che i risultati siano già ottenuti
-    risultato_ner = process_text_with_models(text, model_1_pipeline, model_2_pipeline, model_1_id, model_2_id)
-    risultato_sentiment = process_emotions_and_translate(text, model_4_pipeline, model_3_pipeline)[0]
+    risultato_ner = process_text_with_models(text, model_1_pipeline, model_2_pipeline, model_1_id, model_2_id, cache)
+    risultato_sentiment = process_emotions_and_translate(text, model_4_pipeline, model_3_pipeline, cache)[0]
+    return componi_risultato(risultato_ner, risultato_sentiment, autori)
+
+
+def analisi_semantica_batch(texts, autori, model_1_pipeline, model_2_pipeline, model_3_pipeline, model_4_pipeline,
+                            model_1_id, model_2_id, batch_size=DEFAULT_INFERENCE_BATCH_SIZE, cache=None):
+    """
+    Come analisi_semantica su una lista di testi: le pipeline NER e il classificatore delle emozioni
+    ricevono i testi a blocchi di batch_size (ordinati per lunghezza) invece che uno alla volta.
+
+    Entità ed emozioni sono le stesse di analisi_semantica, ma i punteggi non sono identici bit per bit:
+    il padding dei blocchi ne cambia le ultime cifre, entro BATCH_SCORE_TOLERANCE (vedi confronta_risultati).
+
+    Returns:
+        list: Un risultato di analisi_semantica per ogni testo, nello stesso ordine.
+    """
+    risultati_ner = process_texts_with_models(texts, model_1_pipeline, model_2_pipeline, model_1_id, model_2_id,
+                                              batch_size, cache)
+    risultati_sentiment = process_emotions_and_translate_batch(texts, model_4_pipeline, model_3_pipeline, batch_size,
+                                                               cache)
+    return [componi_risultato(risultato_ner, risultato_sentiment, autori)
+            for risultato_ner, risultato_sentiment in zip(risultati_ner, risultati_sentiment)]
+
+
+def confronta_risultati(expected, actual):
+    """
+    Confronta due liste di risultati di analisi_semantica (es. per messaggio e a blocchi).
 
+    Returns:
+        tuple: (True se entità ed emozioni sono le stesse, massima differenza dei punteggi)
+    """
+    same, max_diff = len(expected) == len(actual), 0.0
+    for a, b in zip(expected, actual):
+        ner_a = [(item["word"], item["entity"]) for item in a["ner"]]
+        ner_b = [(item["word"], item["entity"]) for item in b["ner"]]
+        same = same and ner_a == ner_b and a["sentiment_analysis_full"].keys() == b["sentiment_analysis_full"].keys()
+        scores = [(x["score"], y["score"]) for x, y in zip(a["ner"], b["ner"])]
+        scores += [(a["sentiment_analysis_full"][k], b["sentiment_analysis_full"].get(k, 0.0))
+                   for k in a["sentiment_analysis_full"]]
+        max_diff = max([max_diff] + [abs(x - y) for x, y in scores])
+    return same, max_diff
+
+
+def componi_risultato(risultato_ner, risultato_sentiment, autori):
+    """Risultato di analisi_semantica a partire dalle entità NER unite e dalle emozioni di un testo."""
     # Filtrare i sentimenti per raggiungere uno score cumulativo di almeno 0.95
-    selected_sentiments = [sentiment for sentiment in risultato_sentiment if sentiment["score"] > 0.15]
+    selected_sentiments = [sentiment for sentiment in risultato_sentiment if sentiment["score"] > RELEVANT_THRESHOLD]
     
     # Controlla se la lista non è vuota
     if risultato_ner:
@@ -436,32 +548,121 @@ def analisi_semantica(text, autori, model_1_pipeline, model_2_pipeline, model_3_
     }
 
 
-def integra_database(nome_db):
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client[nome_db]
+def aggiornamento_post(risultato, compact_emotions=False):
+    """Aggiornamento MongoDB che salva nel post il risultato di analisi_semantica."""
+    # updated_at segnala il post come modificato all'esportazione incrementale (vedi utils_columnar)
+    aggiornato = datetime.datetime.now(datetime.timezone.utc)
+    if compact_emotions:
+        return {
+            "$set": {"ner": risultato["ner"], **encode_emotions(risultato["sentiment_analysis_full"]),
+                     "updated_at": aggiornato},
+            "$unset": {"sentiment_analysis_full": "", "sentiment_analysis_relevant": ""},
+        }
+    return {"$set": {**risultato, "updated_at": aggiornato}}
+
+
+def integra_database(nome_db, compact_emotions=False, batch_size=None, cache=None):
+    """
+    Arricchisce i post del database con i risultati di analisi_semantica (NER ed emozioni).
+    Con compact_emotions=True i punteggi delle emozioni vengono salvati nella codifica compatta
+    (vettore float32 in BinData, vedi utils_emotions) invece che come dizionari.
+
+    Con batch_size i messaggi vengono analizzati a blocchi di batch_size (vedi analisi_semantica_batch:
+    stesse entità ed emozioni, punteggi entro BATCH_SCORE_TOLERANCE) e i risultati di ogni blocco salvati
+    con un solo bulk_write; se un blocco fallisce, i suoi messaggi vengono rianalizzati uno alla volta. Senza batch_size ogni messaggio viene analizzato e
+    salvato singolarmente.
+
+    Con cache (un InferenceCache, vedi utils_inference.open_inference_cache) i messaggi già analizzati
+    con gli stessi modelli, in questa o in un'esecuzione precedente, non vengono rianalizzati.
+
+    Per distribuire l'analisi su più processi vedi utils_enrichment.integra_database_parallel.
+    """
+    db = get_database(nome_db)
+    ensure_indexes(nome_db)  # L'indice su ner.entity/ner.word serve alle analisi sui risultati
     collection = db["post"]
     autori_collection = db["autori"]
     
     autori = recupera_autori(autori_collection)
-    cursor = collection.find().batch_size(50)
+    cursor = collection.find({}, {"message": 1}).batch_size(max(50, batch_size or 0))
     
     models_pipelines = load_models()
+    arricchisci_post(collection, cursor, autori, models_pipelines, compact_emotions, batch_size, cache)
+
+    if cache is not None:
+        print(f"Cache di inferenza: {cache.stats()}")
+    print("Elaborazione completata!")
+
+
+def arricchisci_post(collection, documenti, autori, models_pipelines, compact_emotions=False, batch_size=None,
+                     cache=None, verbose=True):
+    """
+    Analizza i messaggi dei documenti (con almeno _id e message) e salva i risultati nella collezione,
+    come descritto in integra_database. Con verbose=False non stampa i messaggi e l'avanzamento.
+
+    Returns:
+        dict: Messaggi analizzati ("posts") e _id dei documenti non elaborati per un errore ("failed").
+    """
     model_1_pipeline, model_2_pipeline, model_3_pipeline, model_4_pipeline, model_1_id, model_2_id  = models_pipelines
-    
-    for documento in cursor:
+    conteggi = {"posts": 0, "failed": []}
+
+    def analizza_singolarmente(documento, messaggio_pulito):
         try:
-            messaggio = documento.get("message")
-            if not messaggio:
-                continue
-            
-            messaggio_pulito = rimuovi_emoji(messaggio)
-            print(messaggio_pulito)
-            
-            risultato = analisi_semantica(messaggio_pulito, autori, model_1_pipeline, model_2_pipeline, model_3_pipeline, model_4_pipeline, model_1_id, model_2_id)
-            
-            collection.update_one({"_id": documento["_id"]}, {"$set": risultato})
-        
+            risultato = analisi_semantica(messaggio_pulito, autori, model_1_pipeline, model_2_pipeline, model_3_pipeline, model_4_pipeline, model_1_id, model_2_id, cache)
+            collection.update_one({"_id": documento["_id"]}, aggiornamento_post(risultato, compact_emotions))
+            conteggi["posts"] += 1
         except Exception as e:
             print(f"Errore nel processare il documento {documento['_id']}: {e}")
-    
-    print("Elaborazione completata!")
\ No newline at end of file
+            conteggi["failed"].append(documento["_id"])
+
+    def analizza_blocco(blocco):
+        documenti_blocco, messaggi = zip(*blocco)
+        try:
+            risultati = analisi_semantica_batch(list(messaggi), autori, model_1_pipeline, model_2_pipeline,
+                                                model_3_pipeline, model_4_pipeline, model_1_id, model_2_id, batch_size,
+                                                cache)
+        except Exception as e:
+            print(f"Errore nel processare un blocco di {len(blocco)} documenti, analisi dei singoli messaggi: {e}")
+            for documento, messaggio_pulito in blocco:
+                analizza_singolarmente(documento, messaggio_pulito)
+            return
+        aggiornamenti = [(documento["_id"], aggiornamento_post(risultato, compact_emotions))
+                         for documento, risultato in zip(documenti_blocco, risultati)]
+        try:
+            collection.bulk_write([UpdateOne({"_id": _id}, aggiornamento) for _id, aggiornamento in aggiornamenti],
+                                  ordered=False)
+        except Exception as e:
+            # I risultati sono già calcolati: si salvano uno alla volta (gli aggiornamenti sono idempotenti)
+            print(f"Errore nel salvare un blocco di {len(blocco)} documenti, salvataggio dei singoli documenti: {e}")
+            for _id, aggiornamento in aggiornamenti:
+                try:
+                    collection.update_one({"_id": _id}, aggiornamento)
+                    conteggi["posts"] += 1
+                except Exception as e:
+                    print(f"Errore nel salvare il documento {_id}: {e}")
+                    conteggi["failed"].append(_id)
+            return
+        conteggi["posts"] += len(blocco)
+        if verbose:
+            print(f"Analizzati {len(blocco)} messaggi")
+
+    blocco = []
+    for documento in documenti:
+        messaggio = documento.get("message")
+        if not messaggio:
+            continue
+
+        messaggio_pulito = rimuovi_emoji(messaggio)
+        if not batch_size:
+            if verbose:
+                print(messaggio_pulito)
+            analizza_singolarmente(documento, messaggio_pulito)
+            continue
+
+        blocco.append((documento, messaggio_pulito))
+        if len(blocco) >= batch_size:
+            analizza_blocco(blocco)
+            blocco = []
+    if blocco:
+        analizza_blocco(blocco)
+
+    return conteggi
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+
+LOGGER = logging.getLogger("storage")
+
+# Documenti accumulati prima di una bulk_write e tempo massimo (in secondi) tra due scritture
+DEFAULT_BULK_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+_DUPLICATE_KEY = 11000
+
+# Indici univoci già creati in questo processo: (database, collezione, chiavi)
+_indexed = set()
+_indexed_lock = threading.Lock()
+
+
+def dedup_index_name(keys):
+    """Nome dell'indice univoco sulle chiavi di deduplicazione ("_id_" per la chiave primaria)."""
+    return "_id_" if list(keys) == ["_id"] else "dedup_" + "_".join(keys)
+
+
+def ensure_unique_index(collection, keys):
+    """
+    Crea (se non esiste) l'indice univoco sulle chiavi di deduplicazione della collezione.
+    Se la collezione contiene già duplicati l'indice non può essere creato: viene registrato un
+    avviso e la deduplicazione resta affidata alle sole upsert. Restituisce True se l'indice esiste.
+    """
+    if list(keys) == ["_id"]:
+        return True  # La chiave primaria è già univoca
+    key = (collection.database.name, collection.name, tuple(keys))
+    with _indexed_lock:
+        if key in _indexed:
+            return True
+    try:
+        collection.create_index([(k, ASCENDING) for k in keys], unique=True, name=dedup_index_name(keys))
+    except OperationFailure as e:
+        LOGGER.warning(f"Indice univoco {keys} non creato su {collection.name}: {e}")
+        return False
+    with _indexed_lock:
+        _indexed.add(key)
+    return True
+
+
+class BulkWriter:
+    """
+    Scrittura a blocchi di documenti in una collezione MongoDB, deduplicati sulle chiavi indicate
+    (stessa semantica di insert_post_to_mongo: un documento viene inserito solo se non ne esiste
+    già uno con gli stessi valori delle chiavi).
+
+    I documenti vengono accumulati e scritti con una sola bulk_write non ordinata di upsert
+    ($setOnInsert) quando il buffer raggiunge batch_size documenti o quando, all'aggiunta di un
+    documento, sono passati più di flush_interval secondi dall'ultima scrittura. Le chiavi sono
+    coperte da un indice univoco (vedi ensure_unique_index), così la ricerca del duplicato usa
+    l'indice e due inserimenti concorrenti dello stesso documento non producono duplicati.
+
+    Args:
+        collection: Collezione pymongo di destinazione.
+        keys (list): Chiavi di deduplicazione.
+        batch_size (int): Documenti per bulk_write.
+        flush_interval (float): Secondi massimi tra due scritture (None = solo per dimensione).
+        unique_index (bool): Se True crea l'indice univoco sulle chiavi.
+    """
+
+    def __init__(self, collection, keys, batch_size=DEFAULT_BULK_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 unique_index=True):
+        self.collection = collection
+        self.keys = list(keys)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.inserted = 0
+        self.skipped = 0
+        self._buffer = {}
+        self._last_flush = time.monotonic()
+        if unique_index:
+            ensure_unique_index(collection, self.keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def add(self, document):
+        """Accoda un documento; scrive il buffer se è pieno o se è passato flush_interval."""
+        filtro = {k: document.get(k) for k in self.keys}
+        key = tuple(repr(v) for v in filtro.values())
+        if key in self._buffer:
+            # Duplicato di un documento ancora nel buffer: non serve inviarlo al server
+            self.skipped += 1
+        else:
+            fields = {k: v for k, v in document.items() if k != "_id"}
+            self._buffer[key] = UpdateOne(filtro, {"$setOnInsert": fields}, upsert=True)
+        if len(self._buffer) >= self.batch_size or (
+                self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Scrive i documenti accodati. Restituisce (inseriti, già presenti) di questa scrittura."""
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return 0, 0
+        operations = list(self._buffer.values())
+        self._buffer.clear()
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            inserted = result.upserted_count
+        except BulkWriteError as e:
+            # Con l'indice univoco due upsert concorrenti dello stesso documento ne fanno fallire una:
+            # il documento è comunque presente, quindi viene contato come già esistente
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != _DUPLICATE_KEY]
+            if errors:
+                raise
+            inserted = e.details.get("nUpserted", 0)
+        skipped = len(operations) - inserted
+        self.inserted += inserted
+        self.skipped += skipped
+        LOGGER.info(f"{self.collection.name}: {inserted} documenti inseriti, {skipped} già presenti")
+        return inserted, skipped
+
+    def close(self):
+        """Scrive i documenti rimasti nel buffer."""
+        self.flush()
+
+    def counts(self):
+        """Totale dei documenti inseriti e di quelli scartati perché già presenti."""
+        return {"inserted": self.inserted, "skipped": self.skipped}
@@ -0,0 +1,114 @@
+import logging
+import re
+
+import torch
+
+
+LOGGER = logging.getLogger("translation")
+
+# Testi tradotti insieme in una chiamata a generate
+DEFAULT_TRANSLATION_BATCH_SIZE = 16
+
+# Fine di una frase: punteggiatura seguita da spazi (i messaggi troppo lunghi vengono divisi qui)
+_SENTENCE_END = re.compile(r"(?<=[.!?…;])\s+")
+
+
+class MarianTranslator:
+    """
+    Traduzione a blocchi con un modello MarianMT (es. Helsinki-NLP/opus-mt-it-en).
+
+    Accetta un testo o una lista di testi e restituisce una traduzione per ciascuno. I testi vengono
+    tokenizzati una sola volta, ordinati per numero di token e tradotti a blocchi di batch_size, così
+    che ogni blocco contenga testi di lunghezza simile e il padding sia minimo; generate viene
+    eseguito sotto torch.inference_mode. I testi più lunghi del limite del modello non vengono
+    troncati: sono divisi in frasi (e le frasi troppo lunghe in gruppi di parole), tradotte insieme
+    agli altri testi e poi riunite.
+
+    Args:
+        model: Il modello MarianMTModel.
+        tokenizer: Il relativo MarianTokenizer.
+        batch_size (int): Testi per chiamata a generate.
+        num_beams (int): Ampiezza della beam search (1 = greedy); None = configurazione del modello.
+        max_new_tokens (int): Lunghezza massima della traduzione; None = configurazione del modello.
+        max_input_tokens (int): Token oltre i quali un testo viene diviso; None = limite del modello.
+    """
+
+    def __init__(self, model, tokenizer, batch_size=DEFAULT_TRANSLATION_BATCH_SIZE, num_beams=None,
+                 max_new_tokens=None, max_input_tokens=None):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.generation_options = {}
+        if num_beams is not None:
+            self.generation_options["num_beams"] = num_beams
+        if max_new_tokens is not None:
+            self.generation_options["max_new_tokens"] = max_new_tokens
+        if max_input_tokens is None:
+            max_input_tokens = min(tokenizer.model_max_length, model.config.max_position_embeddings)
+        self.max_input_tokens = max_input_tokens
+
+    def __call__(self, texts, batch_size=None):
+        if isinstance(texts, str):
+            return self.translate([texts], batch_size)[0]
+        return self.translate(texts, batch_size)
+
+    def _token_count(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _split(self, text):
+        """Divide un testo troppo lungo in parti entro il limite di token (frasi intere quando possibile)."""
+        limit = self.max_input_tokens - 1  # Spazio per il token di fine sequenza
+        units = []
+        for sentence in _SENTENCE_END.split(text):
+            if self._token_count(sentence) <= limit:
+                units.append(sentence)
+                continue
+            # Frase troppo lunga: gruppi di parole consecutive
+            words = []
+            for word in sentence.split():
+                if words and self._token_count(" ".join(words + [word])) > limit:
+                    units.append(" ".join(words))
+                    words = []
+                words.append(word)
+            if words:
+                units.append(" ".join(words))
+
+        # Riunisce le frasi consecutive finché restano entro il limite, per non tradurre frasi isolate
+        parts = []
+        for unit in units:
+            if parts and self._token_count(parts[-1] + " " + unit) <= limit:
+                parts[-1] += " " + unit
+            else:
+                parts.append(unit)
+        return parts
+
+    def translate(self, texts, batch_size=None):
+        """Traduce una lista di testi; restituisce una lista di traduzioni nello stesso ordine."""
+        batch_size = batch_size or self.batch_size
+        texts = list(texts)
+        encodings = self.tokenizer(texts)["input_ids"]
+
+        # Parti da tradurre (input_ids) e, per ogni testo, l'intervallo delle sue parti
+        pieces, spans = [], []
+        for text, input_ids in zip(texts, encodings):
+            start = len(pieces)
+            if len(input_ids) <= self.max_input_tokens:
+                pieces.append(input_ids)
+            else:
+                parts = self._split(text)
+                LOGGER.debug(f"Testo di {len(input_ids)} token diviso in {len(parts)} parti")
+                pieces.extend(self.tokenizer(parts, truncation=True, max_length=self.max_input_tokens)["input_ids"])
+            spans.append((start, len(pieces)))
+
+        translated = [None] * len(pieces)
+        order = sorted(range(len(pieces)), key=lambda i: len(pieces[i]), reverse=True)
+        with torch.inference_mode():
+            for begin in range(0, len(order), batch_size):
+                bucket = order[begin:begin + batch_size]
+                inputs = self.tokenizer.pad({"input_ids": [pieces[i] for i in bucket]}, return_tensors="pt")
+                inputs = inputs.to(self.model.device)
+                outputs = self.model.generate(**inputs, **self.generation_options)
+                for i, translation in zip(bucket, self.tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+                    translated[i] = translation
+
+        return [" ".join(translated[start:end]) for start, end in spans]
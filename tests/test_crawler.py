@@ -0,0 +1,145 @@
+"""
+Crawler asincrono (utils_crawler) a confronto con lo scraper sincrono: il crawler legge le pagine da
+serve_recorded_pages, lo scraper le stesse pagine tramite fetch_page, senza rete.
+"""
+import asyncio
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from shared import utils_crawler, utils_scraper
+from shared.utils_crawler import AsyncForumCrawler, recorded_page_name, serve_recorded_pages
+
+
+BASE = utils_scraper.BASE_URL
+# Sezioni: radice -> 1, 2; 1 -> 3. Discussioni per sezione e numero di post per discussione
+TREE = {None: [1, 2], 1: [3], 2: [], 3: []}
+DISCUSSIONS = {1: list(range(100, 135)), 2: [200, 201, 202], 3: [300]}
+POSTS = {topic: (topic * 7) % 50 + 1 for topics in DISCUSSIONS.values() for topic in topics}
+POSTS.update({100: 30, 101: 15, 200: 45, 300: 16})  # Ultima pagina piena e discussioni al limite di pagina
+
+
+def section_li(forum):
+    topics = DISCUSSIONS[forum]
+    return (f'<li class="off"><div class="aa"><h3 class="web"><a href="?f={forum}">Sezione {forum}</a></h3>'
+            f'<h4 class="desc">Descrizione {forum}</h4></div><div class="topics"><em>{len(topics)}</em></div>'
+            f'<div class="replies"><em>{sum(POSTS[t] for t in topics)}</em></div>'
+            f'<div class="zz"><div class="when">0{forum}/02/2024, 10:{forum:02d}</div></div></li>')
+
+
+def pagination(kind, key, page, pages, size):
+    if pages <= 1:
+        return ""
+    links = "".join(f'<li><a href="?{kind}={key}&amp;st={i * size}">{i + 1}</a></li>' for i in range(pages) if i != page)
+    return f'<ul class="pages"><li class="current">{page + 1}</li>{links}</ul>'
+
+
+def html(body, canonical):
+    return (f'<html><head><link rel="canonical" href="{canonical}"></head><body>{body}</body></html>').encode("utf-8")
+
+
+def render(url):
+    """Pagina del forum simulato; oltre l'ultima pagina di un elenco viene restituita l'ultima pagina."""
+    query = parse_qs(urlparse(url).query)
+    offset = int(query.get("st", ["0"])[0])
+    if "f" in query:
+        forum = int(query["f"][0])
+        topics = DISCUSSIONS[forum]
+        last = (len(topics) - 1) // 30
+        page = min(offset // 30, last)
+        items = "".join(
+            f'<li class="x"><div class="bb"><h3 class="web"><a href="?t={t}">Discussione {t}</a></h3></div>'
+            f'<div class="xx"><a>autore{t % 5}</a></div><div class="yy"><div class="replies"><em>{POSTS[t] - 1}</em>'
+            f'</div><div class="views"><em>{t * 3}</em></div></div></li>'
+            for t in topics[page * 30:(page + 1) * 30]
+        )
+        subsections = "".join(section_li(child) for child in TREE[forum]) if page == 0 else ""
+        canonical = f"{BASE}?f={forum}" + (f"&st={page * 30}" if page else "")
+        return html(f'<ul>{subsections}</ul>{pagination("f", forum, page, last + 1, 30)}'
+                    f'<ol class="big_list">{items}</ol>', canonical)
+    if "t" in query:
+        topic = int(query["t"][0])
+        last = (POSTS[topic] - 1) // 15
+        page = min(offset // 15, last)
+        posts = ""
+        for i in range(page * 15, min(POSTS[topic], (page + 1) * 15)):
+            day = datetime.date(2023, 1, 1) + datetime.timedelta(days=i)
+            posts += (f'<li class="post"><div class="nick"><a>autore{(topic + i) % 7}</a></div>'
+                      f'<span class="when">Posted on {day:%d/%m/%Y}, 10:{i % 60:02d}</span>'
+                      f'<table><tr><td class="right Item">messaggio {topic}-{i}</td></tr></table></li>')
+        canonical = f"{BASE}?t={topic}" + (f"&st={page * 15}" if page else "")
+        return html(f'{pagination("t", topic, page, last + 1, 15)}<ul>{posts}</ul>', canonical)
+    return html("<ul>" + "".join(section_li(child) for child in TREE[None]) + "</ul>", BASE)
+
+
+def recorded_urls():
+    """URL registrati: tutte le pagine degli elenchi, più due pagine oltre la fine di ciascuno."""
+    urls = [BASE]
+    for forum, topics in DISCUSSIONS.items():
+        urls += [f"{BASE}?f={forum}"] + [f"{BASE}?f={forum}&st={i * 30}" for i in range(1, (len(topics) - 1) // 30 + 3)]
+        for topic in topics:
+            urls += [f"{BASE}?t={topic}&st={i * 15}" for i in range((POSTS[topic] - 1) // 15 + 3)]
+    return urls
+
+
+@pytest.fixture
+def recorded_forum(tmp_path, monkeypatch):
+    """Pagine registrate servite da serve_recorded_pages; lo scraper sincrono legge le stesse pagine."""
+    for url in recorded_urls():
+        (tmp_path / recorded_page_name(url)).write_bytes(render(url))
+    monkeypatch.setattr(utils_scraper, "fetch_page", render)
+    monkeypatch.setattr(utils_scraper, "fetch_pages", lambda urls, max_workers=None: [render(url) for url in urls])
+    server, base_url = serve_recorded_pages(str(tmp_path))
+    yield base_url
+    server.shutdown()
+
+
+def test_async_crawl_matches_sync_scraper(recorded_forum):
+    sync_sections, sync_discussions = utils_scraper.process_forum_data()
+    assert len(sync_discussions) == sum(len(topics) for topics in DISCUSSIONS.values())
+    assert utils_crawler.process_forum_data_async(base_url_override=recorded_forum) == (sync_sections, sync_discussions)
+
+
+@pytest.mark.parametrize("start, end", [(None, None), ("2023-01-10", "2023-02-05"), ("2023-01-20", None)])
+def test_async_posts_match_sync_scraper(recorded_forum, start, end):
+    start_date, end_date = utils_scraper.normalize_date_range(start, end)
+    _, discussions = utils_scraper.process_forum_data()
+    expected = [utils_scraper.extract_posts(d["link"], start_date, end_date) for d in discussions]
+
+    async def crawl():
+        async with AsyncForumCrawler(base_url_override=recorded_forum) as crawler:
+            return await crawler.extract_all_posts(discussions, start_date, end_date)
+    actual = asyncio.run(crawl())
+    assert actual == expected
+    # Ultima pagina piena: la copia servita oltre la fine non viene ripetuta
+    full = next(posts for d, posts in zip(discussions, actual) if d["link"].endswith("?t=100"))
+    assert len(full) == len({post["message"] for post in full})
+
+
+class _RedirectHandler(BaseHTTPRequestHandler):
+    target = None
+
+    def do_GET(self):
+        self.send_response(302)
+        self.send_header("Location", self.target + self.path.lstrip("/"))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_async_crawler_follows_redirects(recorded_forum):
+    # Come requests nella versione sincrona, un redirect non è un errore
+    server = ThreadingHTTPServer(("127.0.0.1", 0), type("Handler", (_RedirectHandler,), {"target": recorded_forum}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        async def fetch():
+            async with AsyncForumCrawler(base_url_override=f"http://127.0.0.1:{server.server_address[1]}/") as crawler:
+                return await crawler.fetch(f"{BASE}?t=100&st=0")
+        assert asyncio.run(fetch()) == render(f"{BASE}?t=100&st=0")
+    finally:
+        server.shutdown()
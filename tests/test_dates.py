@@ -0,0 +1,25 @@
+"""Filtri per intervallo di date (utils_dates.date_range_filter)."""
+import datetime
+
+import pytest
+
+from shared.utils_dates import date_range_filter, parse_forum_datetime
+
+
+UTC = datetime.timezone.utc
+
+
+@pytest.mark.parametrize("end_date", ["2023-06-30", datetime.datetime(2023, 6, 30), datetime.datetime(2023, 6, 30, 15, 0)])
+def test_end_date_includes_whole_day(end_date):
+    bounds = date_range_filter(None, end_date)["posted_at"]
+    assert bounds == {"$lt": datetime.datetime(2023, 6, 30, 22, 0, tzinfo=UTC)}  # Mezzanotte del 1/7 a Roma
+    last_post = parse_forum_datetime("30/06/2023", "23:59")
+    assert last_post < bounds["$lt"] <= parse_forum_datetime("01/07/2023", "00:00")
+
+
+def test_start_and_end_strings():
+    assert date_range_filter("2023-01-01", "2023-01-31") == {"posted_at": {
+        "$gte": datetime.datetime(2022, 12, 31, 23, 0, tzinfo=UTC),
+        "$lt": datetime.datetime(2023, 1, 31, 23, 0, tzinfo=UTC),
+    }}
+    assert date_range_filter() == {}
@@ -0,0 +1,100 @@
+"""Piano di visita delle pagine di una discussione (post_pages_plan) su un forum simulato, senza rete."""
+import datetime
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from shared import utils_scraper
+
+
+URL = "https://forum.example/?t=1"
+
+
+def post_html(index):
+    day = datetime.date(2023, 1, 1) + datetime.timedelta(days=index)
+    return (f'<li class="post"><div class="nick"><a>autore{index % 3}</a></div>'
+            f'<span class="when">Posted on {day:%d/%m/%Y}, 10:{index % 60:02d}</span>'
+            f'<table><tr><td class="right Item">messaggio {index}</td></tr></table></li>')
+
+
+def thread_pages(num_posts):
+    """Pagine di una discussione senza link di paginazione; oltre la fine il forum restituisce l'ultima pagina."""
+    last = (num_posts - 1) // 15
+
+    def render(url):
+        page = min(int(parse_qs(urlparse(url).query).get("st", ["0"])[0]) // 15, last)
+        posts = "".join(post_html(i) for i in range(page * 15, min(num_posts, (page + 1) * 15)))
+        return f"<html><body><ul>{posts}</ul></body></html>".encode("utf-8")
+    return render
+
+
+@pytest.fixture
+def forum(monkeypatch):
+    requested = []
+
+    def install(num_posts):
+        render = thread_pages(num_posts)
+
+        def fetch_page(url):
+            requested.append(url)
+            return render(url)
+        monkeypatch.setattr(utils_scraper, "fetch_page", fetch_page)
+        monkeypatch.setattr(utils_scraper, "fetch_pages", lambda urls, max_workers=None: [fetch_page(u) for u in urls])
+        return requested
+    return install
+
+
+def messages(posts):
+    return [post["message"] for post in posts]
+
+
+@pytest.mark.parametrize("num_posts, replies", [(46, 65), (46, 66), (46, 80), (7, 40), (99, 130), (60, 59)])
+def test_overflow_copy_does_not_hide_last_page(forum, num_posts, replies):
+    # replies sovrastimato: la stima dell'ultima pagina punta a una copia dell'ultima pagina vera,
+    # scaricata prima di quest'ultima
+    forum(num_posts)
+    posts = utils_scraper.extract_posts(URL, datetime.datetime(2001, 1, 1), datetime.datetime(2070, 12, 31),
+                                        replies=str(replies))
+    assert messages(posts) == [f"messaggio {i}" for i in range(num_posts)]
+
+
+def test_overflow_copy_loaded_before_last_page(forum):
+    # La copia (pagina 4) viene scaricata per prima: la pagina 3 resta l'ultima pagina vera
+    forum(46)
+    pages = {4: utils_scraper.parse_post_page(thread_pages(46)(URL + "&st=60"), URL + "&st=60")}
+    selected = []
+    plan = utils_scraper.post_pages_plan(pages, selected, datetime.datetime(2001, 1, 1),
+                                         datetime.datetime(2070, 12, 31), replies="45")
+    for _ in utils_scraper.run_page_plan(plan, pages, lambda page: utils_scraper.post_page_url(URL, page),
+                                         utils_scraper.parse_post_page):
+        pass
+    assert selected == [0, 1, 2, 3]
+
+
+def test_date_window_with_overestimated_replies(forum):
+    forum(46)
+    posts = utils_scraper.extract_posts(URL, datetime.datetime(2023, 2, 10), datetime.datetime(2070, 12, 31),
+                                        replies="200")
+    assert messages(posts) == [f"messaggio {i}" for i in range(40, 46)]
+
+
+def test_overestimated_replies_shrink_last_page(forum):
+    # Una stima molto oltre la fine viene ridotta per bisezione invece di scaricare tutte le pagine stimate
+    requested = forum(46)
+    posts = utils_scraper.extract_posts(URL, datetime.datetime(2001, 1, 1), datetime.datetime(2070, 12, 31),
+                                        replies="600")
+    assert messages(posts) == [f"messaggio {i}" for i in range(46)]
+    assert len(requested) < 12
+
+
+@pytest.mark.parametrize("num_posts", [1, 14, 15, 16, 30, 31, 46, 100])
+@pytest.mark.parametrize("extra_replies", [-20, -1, 0, 1, 14, 15, 31, 200])
+@pytest.mark.parametrize("start_day, end_day", [(0, 400), (20, 400), (0, 20), (17, 33)])
+def test_replies_estimate_matches_thread(forum, num_posts, extra_replies, start_day, end_day):
+    forum(num_posts)
+    start = datetime.datetime(2023, 1, 1) + datetime.timedelta(days=start_day)
+    end = datetime.datetime(2023, 1, 1) + datetime.timedelta(days=end_day)
+    replies = max(0, num_posts - 1 + extra_replies)
+    posts = utils_scraper.extract_posts(URL, start, end, replies=str(replies))
+    expected = [f"messaggio {i}" for i in range(num_posts) if start_day <= i <= end_day]
+    assert messages(posts) == expected
@@ -0,0 +1,40 @@
+"""File di record compressi a blocchi (utils_records.RecordFile)."""
+import datetime
+
+import pytest
+
+from shared.utils_records import RecordFile, read_records
+
+
+# Caratteri che str.splitlines considera fine riga, oltre a "\n" e "\r"
+LINE_BREAKS = "\u2028\u2029\x85\x0b\x0c\x1c\x1d\x1e\r\n"
+
+
+def make_records(n):
+    return [{"_id": str(i), "message": f"riga{LINE_BREAKS[i % len(LINE_BREAKS)]}{i} {LINE_BREAKS} fine",
+             "posted_at": datetime.datetime(2023, 1, 1, 10, i % 60, tzinfo=datetime.timezone.utc)}
+            for i in range(n)]
+
+
+@pytest.mark.parametrize("block_records", [1, 3, 256])
+def test_round_trip_with_line_separators(tmp_path, block_records):
+    path = str(tmp_path / "posts.jsonl.gz")
+    records = make_records(20)
+    with RecordFile(path, mode="a", block_records=block_records) as out:
+        out.extend(records)
+    assert list(read_records(path)) == records
+    with RecordFile(path) as stored:
+        assert len(stored) == len(records)
+        assert [stored[i] for i in range(len(records))] == records
+        assert list(stored.records(7)) == records[7:]
+
+
+def test_rebuilt_index_counts_records_with_line_separators(tmp_path):
+    path = str(tmp_path / "posts.jsonl.gz")
+    records = make_records(10)
+    with RecordFile(path, mode="a", block_records=4) as out:
+        out.extend(records)
+    (tmp_path / "posts.jsonl.gz.idx").unlink()
+    with RecordFile(path) as stored:
+        assert len(stored) == len(records)
+        assert stored[9] == records[9]
@@ -0,0 +1,70 @@
+"""
+Analisi semantica a blocchi (analisi_semantica_batch) a confronto con quella per messaggio, con modelli
+BERT piccoli creati localmente (pesi casuali, nessun download): stesse entità ed emozioni, punteggi
+entro BATCH_SCORE_TOLERANCE.
+"""
+import random
+
+import pytest
+
+spacy = pytest.importorskip("spacy")
+if not spacy.util.is_package("it_core_news_sm"):
+    pytest.skip("modello spaCy it_core_news_sm non installato (richiesto da utils_semantics)", allow_module_level=True)
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from shared.utils_semantics import (  # noqa: E402
+    BATCH_SCORE_TOLERANCE,
+    analisi_semantica,
+    analisi_semantica_batch,
+    confronta_risultati,
+)
+
+
+WORDS = ["ciao", "grazie", "mario", "roma", "milano", "ansia", "dottore", "sonno", "oggi", "domani", "bene", "male",
+         "terapia", "farmaco", "giulia", "paura", "sempre", "mai", "casa", "lavoro"]
+NER_LABELS = ["O", "B-PER", "I-PER", "B-LOC", "I-LOC"]
+EMOTION_LABELS = ["admiration", "amusement", "anger", "annoyance", "approval", "caring", "confusion", "curiosity",
+                  "desire", "disappointment", "disapproval", "disgust", "embarrassment", "excitement", "fear",
+                  "gratitude", "grief", "joy", "love", "nervousness", "optimism", "pride", "realization", "relief",
+                  "remorse", "sadness", "surprise", "neutral"]
+
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory):
+    vocab = tmp_path_factory.mktemp("tokenizer") / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS + [f"##{w}" for w in WORDS]))
+    tokenizer = transformers.BertTokenizerFast(vocab_file=str(vocab))
+
+    def config(labels):
+        return transformers.BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=2,
+                                       num_attention_heads=2, intermediate_size=64, initializer_range=0.3,
+                                       id2label=dict(enumerate(labels)), label2id={l: i for i, l in enumerate(labels)})
+    torch.manual_seed(0)
+    ner_1 = transformers.pipeline("ner", model=transformers.BertForTokenClassification(config(NER_LABELS)).eval(),
+                                  tokenizer=tokenizer)
+    ner_2 = transformers.pipeline("ner", model=transformers.BertForTokenClassification(config(NER_LABELS)).eval(),
+                                  tokenizer=tokenizer)
+    emotions = transformers.pipeline(
+        "text-classification", model=transformers.BertForSequenceClassification(config(EMOTION_LABELS)).eval(),
+        tokenizer=tokenizer, top_k=None)
+
+    def translate(texts, batch_size=None):  # La traduzione non è oggetto del confronto
+        return texts
+    return ner_1, ner_2, emotions, translate, "ner-1", "ner-2"
+
+
+def messages(n, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 60))) for _ in range(n)]
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 16, 64])
+def test_batch_matches_single_within_tolerance(models, batch_size):
+    texts = messages(40)
+    autori = ["mario"]
+    expected = [analisi_semantica(text, autori, *models) for text in texts]
+    actual = analisi_semantica_batch(texts, autori, *models, batch_size=batch_size)
+    same, max_diff = confronta_risultati(expected, actual)
+    assert same
+    assert max_diff <= BATCH_SCORE_TOLERANCE